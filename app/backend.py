@@ -1,9 +1,54 @@
+import json, time, asyncio, logging
+from functools import partial
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from pydantic import BaseModel
 from typing import Optional, List, Dict
-from scripts.rag_pipeline import get_rag_response, generate_quiz, parse_quiz_text
+from scripts.rag_pipeline import (
+    aget_rag_response, astream_rag_response, abatch_rag_responses, agenerate_quiz, astream_quiz, parse_quiz_text, answer_cache,
+    get_embeddings, aprecompute_quiz_queries, available_topic_keys, ensure_warm, readiness, BATCH_MAX_QUESTIONS, ask_flight, quiz_flight,
+)
+from scripts.limits import queue_stats
+from scripts.quiz_pool import QuizPool, load_topic_keys, valid_questions
+from scripts.serving import log_memory_report, memory_report
+from scripts.metrics import Trace, metrics_response_body
+from scripts.logs import get_logger, log
 
-app = FastAPI()
+logger = get_logger("backend")
+
+# Parsed, validated quizzes generated ahead of time for the chapters of
+# data/topics.json, filled in the background from startup (see QUIZ_POOL_WARM). Refills
+# bypass quiz_flight so that they never store the quiz of a request in flight.
+quiz_pool = QuizPool(partial(agenerate_quiz, coalesce=False), parse_quiz_text)
+
+
+async def startup():
+    # Runs in the background so the server accepts connections (and answers
+    # /healthz) at once; /readyz turns 200 when the warmup is done
+    try:
+        await ensure_warm()
+    except Exception as e:
+        log(logger, logging.ERROR, "warmup_failed", exc_info=True, error=str(e))
+        return
+    topic_keys = available_topic_keys(load_topic_keys())
+    try:
+        await aprecompute_quiz_queries(topic_keys)
+    except Exception as e:
+        log(logger, logging.WARNING, "quiz_precompute_failed", error=str(e))
+    quiz_pool.start(topic_keys)
+    # With memory-mapped indexes most of the index pages show up as shared
+    log_memory_report()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup_task = asyncio.create_task(startup())
+    yield
+    startup_task.cancel()
+    await quiz_pool.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 class QuizRequest(BaseModel):
     grade: str
@@ -15,23 +60,180 @@ class Query(BaseModel):
     subject: str
     question: str = ""
     history: Optional[List[Dict[str, str]]] = None
+    # With a session id the server keeps the history; `history` is then ignored
+    session_id: Optional[str] = None
 
 @app.post("/ask")
-def ask(query: Query):
+async def ask(query: Query):
+    trace = Trace("/ask", query.grade, query.subject)
     try:
-        answer = get_rag_response(query.question, query.grade, query.subject, query.history)
-        return {"answer": answer}
+        answer = await aget_rag_response(query.question, query.grade, query.subject, query.history, query.session_id, trace=trace)
+        with trace.stage("serialize"):
+            return JSONResponse({"answer": answer})
     except Exception as e:
-        print(f"[ERROR] Backend crashed: {e}")
+        trace.notes["error"] = str(e)
+        log(logger, logging.ERROR, "backend_crashed", exc_info=True, error=str(e))
         return {"answer": f"Error: {e}"}
+    finally:
+        trace.finish()
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Server-sent events stream used to reach the client before generation finishes
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+@app.post("/ask/stream")
+async def ask_stream(query: Query):
+    # Sends a "sources" event, then one "token" event per LLM token, then "done"
+    async def events():
+        trace = Trace("/ask/stream", query.grade, query.subject)
+        serialize = 0.0
+        try:
+            async for event, data in astream_rag_response(query.question, query.grade, query.subject, query.history, query.session_id, trace=trace):
+                start = time.perf_counter()
+                message = sse_event(event, data)
+                serialize += time.perf_counter() - start
+                yield message
+        except Exception as e:
+            trace.notes["error"] = str(e)
+            log(logger, logging.ERROR, "stream_failed", exc_info=True, error=str(e))
+            yield sse_event("error", {"message": str(e)})
+        finally:
+            trace.record("serialize", serialize)
+            trace.finish()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+class BatchQuery(BaseModel):
+    grade: str
+    subject: str
+    questions: List[str]
+
+
+@app.post("/ask/batch")
+async def ask_batch(batch: BatchQuery):
+    # Answers a worksheet: one "result" event per question ({"index", "question",
+    # "answer", "sources"}) as soon as it is ready, in completion order, then "done"
+    if len(batch.questions) > BATCH_MAX_QUESTIONS:
+        return JSONResponse({"error": f"At most {BATCH_MAX_QUESTIONS} questions per batch"}, status_code=413)
+
+    async def events():
+        trace = Trace("/ask/batch", batch.grade, batch.subject)
+        try:
+            async for indices, result in abatch_rag_responses(batch.questions, batch.grade, batch.subject, trace=trace):
+                for i in indices:
+                    yield sse_event("result", {"index": i, "question": batch.questions[i], **result})
+            yield sse_event("done", {key: trace.notes.get(key, 0) for key in ("questions", "unique", "cached", "failed")})
+        except Exception as e:
+            trace.notes["error"] = str(e)
+            log(logger, logging.ERROR, "batch_failed", exc_info=True, error=str(e))
+            yield sse_event("error", {"message": str(e)})
+        finally:
+            trace.finish()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 @app.post("/quiz")
-def quiz_endpoint(payload: QuizRequest):
+async def quiz_endpoint(payload: QuizRequest):
+    trace = Trace("/quiz", payload.grade, payload.subject)
     try:
-        raw_quiz_text = generate_quiz(subject=payload.subject, grade=payload.grade, topic=payload.topic)
-        structured_quiz = parse_quiz_text(raw_quiz_text)
+        if payload.topic:
+            quiz = quiz_pool.pop((payload.grade, payload.subject.lower(), payload.topic))
+            if quiz is not None:
+                trace.notes["quiz_pool"] = "hit"
+                return {"quiz": quiz}
+
+        # Pool empty (or no topic): generate now, still dropping malformed questions
+        trace.notes["quiz_pool"] = "miss"
+        raw_quiz_text = await agenerate_quiz(subject=payload.subject, grade=payload.grade, topic=payload.topic, trace=trace)
+        with trace.stage("parse"):
+            structured_quiz = valid_questions(parse_quiz_text(raw_quiz_text))
         return {"quiz": structured_quiz}
     except Exception as e:
-        print(f"[ERROR] Quiz generation failed: {e}")
-        return {"quiz": f"Error: {e}"}
\ No newline at end of file
+        trace.notes["error"] = str(e)
+        log(logger, logging.ERROR, "quiz_failed", exc_info=True, error=str(e))
+        return {"quiz": f"Error: {e}"}
+    finally:
+        trace.finish()
+
+
+@app.post("/quiz/stream")
+async def quiz_stream(payload: QuizRequest):
+    # One "question" event per validated question as soon as the model has
+    # written its answer line, then "done" ({"questions", "dropped"})
+    async def events():
+        trace = Trace("/quiz/stream", payload.grade, payload.subject)
+        try:
+            quiz = quiz_pool.pop((payload.grade, payload.subject.lower(), payload.topic)) if payload.topic else None
+            if quiz is not None:
+                trace.notes["quiz_pool"] = "hit"
+                for question in quiz:
+                    yield sse_event("question", question)
+                yield sse_event("done", {"questions": len(quiz), "dropped": 0})
+                return
+
+            trace.notes["quiz_pool"] = "miss"
+            async for event, data in astream_quiz(payload.grade, payload.subject, payload.topic, trace=trace):
+                yield sse_event(event, data)
+        except Exception as e:
+            trace.notes["error"] = str(e)
+            log(logger, logging.ERROR, "quiz_stream_failed", exc_info=True, error=str(e))
+            yield sse_event("error", {"message": str(e)})
+        finally:
+            trace.finish()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.get("/queue")
+async def queue():
+    # Slots in use and requests waiting for upstream LLM / embedding calls
+    return queue_stats()
+
+
+@app.get("/cache")
+async def cache_stats():
+    query_embeddings = get_embeddings().stats() if get_embeddings.loaded() else {}
+    return {"answers": answer_cache.stats(), "query_embeddings": query_embeddings}
+
+
+@app.get("/coalescing")
+async def coalescing():
+    # Requests that shared an identical in-flight computation instead of calling upstream
+    return {"ask": ask_flight.stats(), "quiz": quiz_flight.stats()}
+
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text format: request and per-stage latency histograms and LLM token counters
+    body, content_type = metrics_response_body()
+    return Response(body, media_type=content_type)
+
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process is up and serving requests
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    # Readiness: indexes and clients are loaded; includes the time of each warmup phase
+    state = readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+
+@app.get("/memory")
+async def memory():
+    # Memory of the worker that handles this request
+    return memory_report()
+
+
+@app.get("/quiz/pool")
+async def quiz_pool_stats():
+    return quiz_pool.stats()
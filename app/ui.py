@@ -1,5 +1,5 @@
 import streamlit as st
-import requests, json
+import requests, json, uuid
 import streamlit.components.v1 as components
 
 from pathlib import Path
@@ -155,6 +155,19 @@ def render_markdown_with_mathjax(markdown_text: str):
 
     components.html(html_template, height=900, scrolling=True)
 
+def iter_sse_events(response):
+    # Minimal server-sent events reader: yields (event, parsed JSON data)
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
 # ---------------- QA MODE ---------------- #
 if mode == "QA":
     st.markdown("### Chat with NCERT Tutor")
@@ -164,6 +177,9 @@ if mode == "QA":
         st.session_state.chat_history = []
     if "user_input" not in st.session_state:
         st.session_state.user_input = ""
+    # The backend keeps this session's history, so only the new question is sent
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = str(uuid.uuid4())
 
     # Display chat history
     for msg in st.session_state.chat_history:
@@ -186,73 +202,86 @@ if mode == "QA":
     send_clicked = st.button("Send")
 
     if send_clicked and st.session_state.user_input.strip():
-        with st.spinner("Tutor is thinking..."):
-            try:
-                user_input = st.session_state.user_input.strip()
-              
-                # Prepare conversation history for backend (excluding sources)
-                history_for_backend = [
-                    {"role": msg["role"], "content": msg["content"]}
-                    for msg in st.session_state.chat_history
-                    if msg["role"] in ("user", "assistant")
-                ]
-
-                res = requests.post(
-                    "http://localhost:8000/ask",
-                    json={
-                        "question": user_input,
-                        "grade": grade,
-                        "subject": subject,
-                        "history": history_for_backend
-                    },
-                    timeout=30
-                )
+        user_input = st.session_state.user_input.strip()
+        st.markdown(f"**You:** {user_input}")
+
+        # Filled in progressively as tokens stream in from the backend
+        answer_box = st.empty()
+        answer_box.markdown("**Tutor:** _thinking..._")
+        try:
+            answer, sources = "", []
+            with requests.post(
+                "http://localhost:8000/ask/stream",
+                json={
+                    "question": user_input,
+                    "grade": grade,
+                    "subject": subject,
+                    "session_id": st.session_state.session_id
+                },
+                stream=True,
+                timeout=(5, 30)  # connect timeout, max gap between events
+            ) as res:
                 res.raise_for_status()
-                res_data = res.json()
-                raw_answer = res_data.get("answer", "No answer received.")
-                answer = raw_answer.get("answer") if isinstance(raw_answer, dict) else raw_answer
-                sources = raw_answer.get("sources", [])
-
-                # Add user and assistant messages to history
-                st.session_state.chat_history.append({
-                    "role": "user",
-                    "content": st.session_state.user_input
-                })
-                st.session_state.chat_history.append({
-                    "role": "assistant",
-                    "content": answer,
-                    "sources": sources
-                })
-                st.session_state.user_input = ""  # Clear input after sending
-
-                st.rerun()  # Refresh to show new messages
-
-            except Exception as e:
-                st.session_state.chat_history.append({
-                    "role": "assistant",
-                    "content": "❌ Sorry, an error occurred while generating your answer.",
-                    "sources": []
-                })
-                st.session_state.user_input = ""
-                st.rerun()
+                for event, data in iter_sse_events(res):
+                    if event == "sources":
+                        sources = data
+                    elif event == "token":
+                        answer += data
+                        answer_box.markdown(f"**Tutor:** {answer}▌")
+                    elif event == "error":
+                        raise RuntimeError(data.get("message", "Streaming failed"))
+
+            # Add user and assistant messages to history
+            st.session_state.chat_history.append({
+                "role": "user",
+                "content": user_input
+            })
+            st.session_state.chat_history.append({
+                "role": "assistant",
+                "content": answer or "No answer received.",
+                "sources": sources
+            })
+            st.session_state.user_input = ""  # Clear input after sending
+
+            st.rerun()  # Refresh to show new messages
+
+        except Exception as e:
+            st.session_state.chat_history.append({
+                "role": "assistant",
+                "content": "❌ Sorry, an error occurred while generating your answer.",
+                "sources": []
+            })
+            st.session_state.user_input = ""
+            st.rerun()
 
 # ---------------- QUIZ MODE ---------------- #
 elif mode == "Quiz":
     if st.button("Generate Quiz"):
+        # Questions are listed as they stream in; the answer widgets follow once the quiz is complete
+        preview_box = st.empty()
         with st.spinner("Generating quiz..."):
             try:
-                res = requests.post(
-                    "http://localhost:8000/quiz",
+                quiz_data = []
+                with requests.post(
+                    "http://localhost:8000/quiz/stream",
                     json={
                         "grade": grade,
                         "subject": subject,
                         "topic": topic if topic else None
                     },
-                    timeout=60
-                )
-                res.raise_for_status()
-                quiz_data = res.json().get("quiz", [])
-                st.write(quiz_data)
+                    stream=True,
+                    timeout=(5, 60)  # connect timeout, max gap between events
+                ) as res:
+                    res.raise_for_status()
+                    for event, data in iter_sse_events(res):
+                        if event == "question":
+                            quiz_data.append(data)
+                            preview_box.markdown("\n\n".join(
+                                f"**Q{idx+1}:** {q['question']}" for idx, q in enumerate(quiz_data)
+                            ))
+                        elif event == "error":
+                            raise RuntimeError(data.get("message", "Quiz generation failed"))
+                preview_box.empty()
                 if not quiz_data:
                     st.warning("No quiz generated. {raw_answer}")
                     st.session_state["quiz_data"] = []
@@ -0,0 +1,100 @@
+# Compares retrieval restricted to the chapters picked by the routing table with
+# the search over the whole partition. Queries are word windows sampled from
+# chunks. Per number of routed chapters: latency of routing plus search, overlap
+# of the retrieved sources with the unrouted ones (what the answer is built
+# from), and how often the source chunk's chapter was among those routed to.
+#
+#   python benchmarks/chapter_routing.py --top 1 2 3 --queries 200 [--fake-embeddings]
+import os, sys, time, random, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import percentile, write_report, fake_pipeline
+from benchmarks.hybrid_retrieval import sample_queries
+
+
+def latency(latencies):
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def chapter_of(chapters, pos):
+    return next((chapter for chapter, (start, end) in chapters.items() if start <= pos < end), None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chapter-routed against whole-partition retrieval.")
+    parser.add_argument("--top", type=int, nargs="+", default=[1, 2, 3], help="chapters searched per query")
+    parser.add_argument("--queries", type=int, default=200, help="queries per partition")
+    parser.add_argument("--words", type=int, default=8, help="words per sampled query")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fake-embeddings", action="store_true", help="offline run; routing results are meaningless")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if args.fake_embeddings:
+        rag_pipeline = fake_pipeline()
+    else:
+        from scripts import rag_pipeline
+
+    rng = random.Random(args.seed)
+    report = {"k": args.k, "partitions": {}}
+    for (grade, subject), (vectorstore, chapters, _, router) in sorted(rag_pipeline.get_vectorstores().items()):
+        if router is None:
+            print(f"[WARNING] No routing table for {grade}/{subject}, rebuild the vector store.")
+            continue
+
+        retriever = rag_pipeline.get_partition_retriever(grade, subject, k=args.k)
+        queries = sample_queries(vectorstore, args.queries, args.words, rng)
+        embeddings = [vectorstore.embeddings.embed_query(query) for query, _ in queries]
+        partition = {"chapters": len(chapters), "queries": len(queries)}
+
+        # Whole partition, as without a routing table
+        timings, dense_timings, unrouted = [], [], []
+        for (query, _), embedding in zip(queries, embeddings):
+            start = time.perf_counter()
+            rag_pipeline.search_partition_ids(vectorstore, embedding, args.k)
+            dense_timings.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            docs = retriever.search_vector(embedding, query)
+            timings.append(time.perf_counter() - start)
+            unrouted.append({doc.id for doc in docs})
+        partition["unrouted"] = {**latency(timings), "dense_p50_ms": percentile(dense_timings, 50) * 1000}
+
+        for top in args.top:
+            if top >= len(chapters):
+                continue
+            timings, dense_timings, overlaps, same, routed_right = [], [], [], 0, 0
+            for (query, target), embedding, baseline in zip(queries, embeddings, unrouted):
+                start = time.perf_counter()
+                route = retriever.route([embedding], top)[0]
+                docs = retriever.search_vector(embedding, query, route)
+                timings.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                rag_pipeline.search_partition_ids(vectorstore, embedding, args.k, retriever.id_ranges(route))
+                dense_timings.append(time.perf_counter() - start)
+
+                ids = {doc.id for doc in docs}
+                overlaps.append(len(ids & baseline) / len(baseline) if baseline else 1.0)
+                same += ids == baseline
+                routed_right += chapter_of(chapters, target) in route.chapters
+            n = len(queries) or 1
+            partition[f"top_{top}"] = {
+                **latency(timings),
+                "dense_p50_ms": percentile(dense_timings, 50) * 1000,
+                "source_overlap": sum(overlaps) / n,
+                "identical_sources": same / n,
+                "source_chapter_routed": routed_right / n,
+            }
+        report["partitions"][f"{grade}/{subject}"] = partition
+
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Shared helpers for the benchmark scripts: latency statistics, JSON reports and
+# the offline stand-ins for the OpenAI chat model and embeddings.
+import os, io, re, sys, json, contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Same dimension as text-embedding-3-small, so fake queries fit real indexes
+FAKE_EMBEDDING_SIZE = 1536
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else 0.0
+
+
+def latency_summary(latencies):
+    # latencies in seconds -> milliseconds
+    return {
+        "n": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def write_report(report, output=None):
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+@contextlib.contextmanager
+def quiet():
+    # The pipeline logs every query; keep the JSON report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+class FakeEncoding:
+    # Whitespace tokens instead of the o200k BPE file, which tiktoken downloads
+    def encode(self, text):
+        return re.findall(r"\S+\s*|\s+", text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+def fake_pipeline(responses=("This is a fake answer.",)):
+    # Imports scripts.rag_pipeline with a deterministic embedder, a canned chat
+    # model and a local tokenizer in place of the OpenAI clients and tiktoken;
+    # nothing leaves the process
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline")
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from scripts import conversation, rag_pipeline
+    from scripts.embedding_cache import CachingQueryEmbeddings
+
+    encoding = FakeEncoding()
+    conversation.get_encoding = lambda: encoding
+    rag_pipeline.WARMUP_PHASES["tokenizer"] = conversation.get_encoding
+    rag_pipeline.get_embeddings.value = CachingQueryEmbeddings(DeterministicFakeEmbedding(size=FAKE_EMBEDDING_SIZE))
+    rag_pipeline.get_llm.value = FakeListChatModel(responses=list(responses))
+    return rag_pipeline
@@ -0,0 +1,169 @@
+# Compares dense, BM25, hybrid (RRF) and hybrid-with-lexical-fast-path retrieval
+# on the saved vector store. Queries are word windows sampled from chunks, and a
+# hit means the source chunk is in the top k.
+#
+#   python benchmarks/hybrid_retrieval.py --queries 200 --k 4 [--fake-embeddings]
+#
+# With --margins, natural questions labelled with a phrase of the passage that
+# answers them (retrieval_questions.jsonl) are used instead to tune
+# LEXICAL_FASTPATH_MARGIN: per margin, how often the fast path is taken and how
+# often its top k holds the labelled passage.
+#
+#   python benchmarks/hybrid_retrieval.py --margins 1.1 1.2 1.5 2 [--fake-embeddings]
+import os, sys, json, time, random, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import percentile, write_report, fake_pipeline
+
+
+def summarize(latencies, hits):
+    return {
+        "hit_rate": sum(hits) / len(hits) if hits else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def sample_queries(vectorstore, n, words, rng):
+    queries = []
+    ids = list(vectorstore.index_to_docstore_id.items())
+    for pos, doc_id in rng.sample(ids, min(n, len(ids))):
+        tokens = vectorstore.docstore.search(doc_id).page_content.split()
+        if len(tokens) < words:
+            continue
+        start = rng.randrange(0, len(tokens) - words + 1)
+        queries.append((" ".join(tokens[start:start + words]), pos))
+    return queries
+
+
+QUESTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_questions.jsonl")
+
+
+def load_questions(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def contains_answer(docs, answer):
+    answer = " ".join(answer.lower().split())
+    return any(answer in " ".join(doc.page_content.lower().split()) for doc in docs)
+
+
+def margin_sweep(rag_pipeline, questions, k, margins):
+    vectorstores = rag_pipeline.get_vectorstores()
+    questions = [q for q in questions if (q["grade"], q["subject"]) in vectorstores]
+    retrievers = {key: rag_pipeline.get_partition_retriever(*key, k=k) for key in {(q["grade"], q["subject"]) for q in questions}}
+
+    # Routed hybrid search, the path taken when the fast path declines
+    hybrid = []
+    for q in questions:
+        retriever = retrievers[(q["grade"], q["subject"])]
+        embedding = retriever.vectorstore.embeddings.embed_query(q["question"])
+        docs = retriever.search_vector(embedding, q["question"], retriever.route([embedding])[0])
+        hybrid.append(contains_answer(docs, q["answer"]))
+
+    report = {"questions": len(questions), "hybrid_recall": sum(hybrid) / len(hybrid) if hybrid else 0.0, "margins": {}}
+    default = rag_pipeline.LEXICAL_FASTPATH_MARGIN
+    try:
+        for margin in margins:
+            rag_pipeline.LEXICAL_FASTPATH_MARGIN = margin
+            taken, fast_hits, hits = 0, 0, 0
+            for q, hybrid_hit in zip(questions, hybrid):
+                docs = retrievers[(q["grade"], q["subject"])].lexical_fast_path(q["question"])
+                if docs is None:
+                    hits += hybrid_hit
+                    continue
+                taken += 1
+                hit = contains_answer(docs, q["answer"])
+                fast_hits += hit
+                hits += hit
+            n = len(questions) or 1
+            report["margins"][str(margin)] = {
+                "fast_path_rate": taken / n,
+                "fast_path_recall": fast_hits / taken if taken else None,
+                "recall": hits / n,
+            }
+    finally:
+        rag_pipeline.LEXICAL_FASTPATH_MARGIN = default
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dense, BM25 and hybrid retrieval latency and hit rate.")
+    parser.add_argument("--queries", type=int, default=200, help="queries per partition")
+    parser.add_argument("--words", type=int, default=8, help="words per sampled query")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--margins", type=float, nargs="+", help="sweep LEXICAL_FASTPATH_MARGIN over the labelled questions")
+    parser.add_argument("--questions", default=QUESTIONS_FILE, help="labelled questions for --margins (JSON lines)")
+    parser.add_argument("--fake-embeddings", action="store_true", help="offline run; dense results are meaningless")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if args.fake_embeddings:
+        rag_pipeline = fake_pipeline()
+    else:
+        from scripts import rag_pipeline
+
+    if args.margins:
+        write_report({"k": args.k, **margin_sweep(rag_pipeline, load_questions(args.questions), args.k, args.margins)}, args.output)
+        return
+
+    rng = random.Random(args.seed)
+    report = {"k": args.k, "partitions": {}}
+    for (grade, subject), (vectorstore, chapters, lexical, _) in sorted(rag_pipeline.get_vectorstores().items()):
+        if lexical is None:
+            print(f"[WARNING] No BM25 index for {grade}/{subject}, rebuild the vector store.")
+            continue
+
+        retriever = rag_pipeline.get_partition_retriever(grade, subject, k=args.k)
+        results = {mode: ([], []) for mode in ("embed", "dense", "lexical", "hybrid", "fast_path")}
+        fast_path_taken = 0
+
+        for query, target in sample_queries(vectorstore, args.queries, args.words, rng):
+            target_id = vectorstore.index_to_docstore_id[target]
+            start = time.perf_counter()
+            embedding = vectorstore.embeddings.embed_query(query)
+            embed_time = time.perf_counter() - start
+            results["embed"][0].append(embed_time)
+
+            start = time.perf_counter()
+            dense = rag_pipeline.search_partition_ids(vectorstore, embedding, args.k)
+            results["dense"][0].append(embed_time + time.perf_counter() - start)
+            results["dense"][1].append(target in dense)
+
+            start = time.perf_counter()
+            hits, _ = lexical.search(query, args.k)
+            results["lexical"][0].append(time.perf_counter() - start)
+            results["lexical"][1].append(target in [doc_id for doc_id, _ in hits])
+
+            start = time.perf_counter()
+            docs = retriever.search_vector(embedding, query)
+            results["hybrid"][0].append(embed_time + time.perf_counter() - start)
+            results["hybrid"][1].append(target_id in [doc.id for doc in docs])
+
+            # What /ask does: lexical fast path first, embedding + hybrid otherwise
+            start = time.perf_counter()
+            docs = retriever.lexical_fast_path(query)
+            if docs is None:
+                docs = retriever.search_vector(embedding, query, retriever.route([embedding])[0])
+                elapsed = embed_time + time.perf_counter() - start
+            else:
+                fast_path_taken += 1
+                elapsed = time.perf_counter() - start
+            results["fast_path"][0].append(elapsed)
+            results["fast_path"][1].append(target_id in [doc.id for doc in docs])
+
+        partition = {mode: summarize(*values) for mode, values in results.items() if mode != "embed"}
+        partition["embed_p50_ms"] = percentile(results["embed"][0], 50) * 1000
+        partition["fast_path_rate"] = fast_path_taken / len(results["embed"][0]) if results["embed"][0] else 0.0
+        partition["queries"] = len(results["embed"][0])
+        report["partitions"][f"{grade}/{subject}"] = partition
+
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# Compares FAISS index types on the vectors of the saved vector store without
+# rebuilding it: recall@k against the exact flat search, per-query latency and
+# index size, for every value of each type's search knob (efSearch / nprobe).
+#
+#   python benchmarks/index_recall.py --types hnsw ivf_flat ivf_pq --k 10
+#   python benchmarks/index_recall.py --types hnsw --params hnsw:M=16,efConstruction=100
+import os, sys, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import write_report
+from scripts.chunk_store import load_partition_store
+from scripts.index_types import INDEX_TYPES, build_index, parse_index_params, read_index_config, index_vectors, recall_report
+from scripts.partitions import load_partitions
+from scripts.rag_pipeline import STORE_DIR
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall, latency and memory of FAISS index types on the saved vectors.")
+    parser.add_argument("--store-dir", default=STORE_DIR)
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=["hnsw", "ivf_flat", "ivf_pq"])
+    parser.add_argument("--params", nargs="*", default=[], help="per type, e.g. ivf_pq:m=96,nbits=8")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="queries per partition")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    params = {}
+    for spec in args.params:
+        kind, values = spec.split(":", 1)
+        params[kind] = parse_index_params(values)
+
+    report = {"k": args.k, "partitions": {}}
+    for name in sorted(load_partitions(args.store_dir)):
+        path = os.path.join(args.store_dir, name)
+        vectors = index_vectors(load_partition_store(path, None).index, read_index_config(path))
+        if vectors is None:
+            print(f"[WARNING] {name} stores PQ codes only, rebuild it with an exact index type to compare.")
+            continue
+        report["partitions"][name] = {
+            kind: recall_report(*build_index(vectors, kind, params.get(kind)), vectors, args.k, args.queries, args.seed)
+            for kind in args.types
+        }
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# Load generator for the API. Questions are drawn from the chapters listed in
+# data/topics.json. Run the backend against benchmarks/mock_openai.py to test
+# without the real API:
+#
+#   python benchmarks/load_test.py --url http://127.0.0.1:8000 --concurrency 32 --duration 60
+#   python benchmarks/load_test.py --rps 20 --mix ask:0.5,stream:0.4,quiz:0.1 --output run.json
+import os, sys, json, time, random, asyncio, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from benchmarks.common import latency_summary, write_report
+from scripts.quiz_pool import load_topic_keys, TOPIC_FILE
+
+QUESTION_TEMPLATES = [
+    "What is {topic}?",
+    "Explain {topic} with an example.",
+    "What are the main ideas of {topic}?",
+    "How is {topic} used in practice?",
+    "Summarise the chapter on {topic}.",
+]
+
+
+def topic_name(chapter):
+    # "03_stack" -> "stack"
+    return chapter.split("_", 1)[-1].replace("_", " ")
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        kind, weight = part.split(":")
+        if kind not in ("ask", "stream", "quiz"):
+            raise argparse.ArgumentTypeError(f"Unknown request kind: {kind}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def make_request(kind, topic_keys, rng):
+    grade, subject, chapter = rng.choice(topic_keys)
+    if kind == "quiz":
+        return "/quiz", {"grade": grade, "subject": subject, "topic": chapter}
+    question = rng.choice(QUESTION_TEMPLATES).format(topic=topic_name(chapter))
+    return ("/ask/stream" if kind == "stream" else "/ask"), {"grade": grade, "subject": subject, "question": question}
+
+
+def failed(kind, body):
+    # The API reports pipeline failures inside 200 responses
+    if kind == "stream":
+        return b"event: error" in body
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return True
+    if kind == "quiz":
+        return not isinstance(data.get("quiz"), list) or not data["quiz"]
+    answer = data.get("answer")
+    return not isinstance(answer, dict) or str(answer.get("answer", "")).startswith("Sorry, an error occurred")
+
+
+async def send(client, kind, path, payload, results):
+    start = time.perf_counter()
+    ttfb = first_token = None
+    body = b""
+    try:
+        async with client.stream("POST", path, json=payload) as response:
+            async for chunk in response.aiter_raw():
+                now = time.perf_counter() - start
+                if ttfb is None:
+                    ttfb = now
+                body += chunk
+                if first_token is None and kind == "stream" and b"event: token" in body:
+                    first_token = now
+            ok = response.status_code == 200 and not failed(kind, body)
+            status = response.status_code
+    except httpx.HTTPError as e:
+        ok, status = False, type(e).__name__
+    results.append({
+        "kind": kind, "ok": ok, "status": status, "latency": time.perf_counter() - start,
+        "ttfb": ttfb, "first_token": first_token,
+    })
+
+
+async def closed_loop(client, args, topic_keys, mix, rng, results, deadline):
+    # `concurrency` users, each sending its next request when the previous one finishes
+    async def user():
+        while time.perf_counter() < deadline:
+            kind = rng.choices(list(mix), weights=list(mix.values()))[0]
+            await send(client, kind, *make_request(kind, topic_keys, rng), results)
+
+    await asyncio.gather(*(user() for _ in range(args.concurrency)))
+
+
+async def open_loop(client, args, topic_keys, mix, rng, results, deadline):
+    # Poisson arrivals at `rps`, independent of how fast the server answers
+    in_flight = set()
+    dropped = 0
+    next_arrival = time.perf_counter()
+    while next_arrival < deadline:
+        await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+        if len(in_flight) >= args.max_in_flight:
+            dropped += 1
+        else:
+            kind = rng.choices(list(mix), weights=list(mix.values()))[0]
+            task = asyncio.create_task(send(client, kind, *make_request(kind, topic_keys, rng), results))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        next_arrival += rng.expovariate(args.rps)
+    await asyncio.gather(*in_flight)
+    return dropped
+
+
+def summarize(results, seconds):
+    ok = [r for r in results if r["ok"]]
+    report = {
+        "requests": len(results),
+        "throughput_rps": len(ok) / seconds if seconds else 0.0,
+        "errors": len(results) - len(ok),
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "latency": latency_summary([r["latency"] for r in ok]),
+        "ttfb": latency_summary([r["ttfb"] for r in ok if r["ttfb"] is not None]),
+    }
+    first_tokens = [r["first_token"] for r in ok if r["first_token"] is not None]
+    if first_tokens:
+        report["first_token"] = latency_summary(first_tokens)
+    statuses = {}
+    for r in results:
+        if not r["ok"]:
+            statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    if statuses:
+        report["error_statuses"] = statuses
+    return report
+
+
+async def run(args):
+    topic_keys = [key for key in load_topic_keys(args.topics) if not args.subjects or key[1] in args.subjects]
+    if not topic_keys:
+        raise SystemExit(f"No topics found in {args.topics}")
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        # Wait until the server has loaded its indexes
+        for _ in range(int(args.ready_timeout * 2)):
+            try:
+                if (await client.get("/readyz")).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+        else:
+            raise SystemExit(f"{args.url} did not become ready")
+
+        results = []
+        start = time.perf_counter()
+        deadline = start + args.duration
+        dropped = 0
+        if args.rps:
+            dropped = await open_loop(client, args, topic_keys, mix, rng, results, deadline)
+        else:
+            await closed_loop(client, args, topic_keys, mix, rng, results, deadline)
+        seconds = time.perf_counter() - start
+
+        report = {
+            "url": args.url,
+            "mode": f"open loop, {args.rps} rps" if args.rps else f"closed loop, {args.concurrency} users",
+            "mix": mix,
+            "seconds": seconds,
+            **summarize(results, seconds),
+            "by_kind": {kind: summarize([r for r in results if r["kind"] == kind], seconds) for kind in mix},
+        }
+        if args.rps:
+            report["dropped_arrivals"] = dropped
+        try:
+            report["server_queue"] = (await client.get("/queue")).json()
+        except (httpx.HTTPError, ValueError):
+            pass
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive /ask, /ask/stream and /quiz at a target rate or concurrency.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=16, help="closed-loop users (ignored with --rps)")
+    parser.add_argument("--rps", type=float, default=0.0, help="open-loop arrival rate")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="open loop: arrivals beyond this are dropped")
+    parser.add_argument("--mix", default="ask:0.5,stream:0.4,quiz:0.1", help="request kinds and weights")
+    parser.add_argument("--topics", default=TOPIC_FILE)
+    parser.add_argument("--subjects", nargs="+", help="only ask about these subjects (e.g. the ones indexed)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--ready-timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    write_report(asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
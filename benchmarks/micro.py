@@ -0,0 +1,171 @@
+# Offline micro-benchmarks of the hot paths, with fake embeddings and a fake
+# chat model; no API key or network is needed.
+#
+#   python benchmarks/micro.py [--only ingest search chain parse] [--output run.json]
+#
+# The search and chain benchmarks need a built store, e.g.
+#   python scripts/build_vector_store.py --fake-embeddings
+import os, sys, time, random, argparse, platform
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from benchmarks.common import latency_summary, write_report, quiet, fake_pipeline
+
+BENCHMARKS = ("ingest", "search", "chain", "parse")
+
+
+def bench_ingest(args):
+    # Parse and split every bundled PDF, as build_vector_store does before embedding
+    from scripts.ingest_data import load_and_split_all
+
+    start = time.perf_counter()
+    with quiet():
+        docs = load_and_split_all(args.data_dir, args.workers)
+    seconds = time.perf_counter() - start
+    pages = len({(doc.metadata.get("source"), doc.metadata.get("page")) for doc in docs})
+    return {
+        "workers": args.workers,
+        "files": len({doc.metadata.get("source") for doc in docs}),
+        "pages": pages,
+        "chunks": len(docs),
+        "seconds": seconds,
+        "pages_per_s": pages / seconds if seconds else 0.0,
+        "chunks_per_s": len(docs) / seconds if seconds else 0.0,
+    }
+
+
+def bench_search(args, rag_pipeline):
+    # Dense search per partition at several k: whole partition, restricted to one
+    # chapter's id range (what quiz retrieval does), and LangChain's metadata
+    # filter on the same chapter for comparison
+    rng = np.random.default_rng(args.seed)
+    report = {}
+    for (grade, subject), (vectorstore, chapters, _, _) in sorted(rag_pipeline.get_vectorstores().items()):
+        queries = rng.standard_normal((args.queries, vectorstore.index.d)).astype(np.float32)
+        chapter = sorted(chapters)[0]
+        id_range = tuple(chapters[chapter])
+        partition = {"size": vectorstore.index.ntotal, "chapter": chapter, "k": {}}
+        for k in args.k:
+            timings = {"unfiltered": [], "chapter_range": [], "metadata_filter": []}
+            for query in queries:
+                embedding = query.tolist()
+                start = time.perf_counter()
+                rag_pipeline.search_partition(vectorstore, embedding, k)
+                timings["unfiltered"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                rag_pipeline.search_partition(vectorstore, embedding, k, [id_range])
+                timings["chapter_range"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                vectorstore.similarity_search_by_vector(embedding, k=k, filter={"chapter": chapter}, fetch_k=max(20, 4 * k))
+                timings["metadata_filter"].append(time.perf_counter() - start)
+            partition["k"][str(k)] = {mode: latency_summary(values) for mode, values in timings.items()}
+        report[f"{grade}/{subject}"] = partition
+    return report
+
+
+def bench_chain(args, rag_pipeline):
+    # Cost of compiling the QA chain versus fetching it from the registry, and of
+    # a full get_rag_response call with the LLM and embedder replaced by fakes
+    from scripts.metrics import Trace
+
+    report = {}
+    for grade, subject in sorted(rag_pipeline.get_vectorstores()):
+        cold, warm, calls = [], [], []
+        for _ in range(args.iterations):
+            rag_pipeline._chain_registry.clear()
+            start = time.perf_counter()
+            rag_pipeline.get_qa_chain(grade, subject)
+            cold.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            rag_pipeline.get_qa_chain(grade, subject)
+            warm.append(time.perf_counter() - start)
+
+        with quiet():
+            for i in range(args.iterations):
+                trace = Trace("benchmark", grade, subject)
+                start = time.perf_counter()
+                rag_pipeline.get_rag_response(f"explain topic number {i}", grade, subject, trace=trace)
+                calls.append(time.perf_counter() - start)
+                # get_rag_response answers with an apology instead of raising;
+                # timing that path would measure nothing
+                if "error" in trace.notes:
+                    sys.exit(f"[ERROR] get_rag_response failed for {grade}/{subject}: {trace.notes['error']}")
+        report[f"{grade}/{subject}"] = {
+            "build": latency_summary(cold),
+            "registry_hit": latency_summary(warm),
+            "get_rag_response": latency_summary(calls),
+        }
+    return report
+
+
+def synthetic_quiz(n_questions, rng):
+    words = "stack queue list tuple function loop variable value result python data file".split()
+    lines = []
+    for i in range(1, n_questions + 1):
+        lines.append(f"Q{i}. What does {' '.join(rng.choice(words) for _ in range(8))} return?")
+        for option in "ABCD":
+            lines.append(f"{option}. {' '.join(rng.choice(words) for _ in range(4))}")
+        lines.append(f"Answer: {rng.choice('ABCD')}")
+    return "\n".join(lines)
+
+
+def bench_parse(args, rag_pipeline):
+    rng = random.Random(args.seed)
+    report = {}
+    for n_questions in args.questions:
+        text = synthetic_quiz(n_questions, rng)
+        timings = []
+        with quiet():
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                parsed = rag_pipeline.parse_quiz_text(text)
+                timings.append(time.perf_counter() - start)
+        mean = sum(timings) / len(timings)
+        report[str(n_questions)] = {
+            "bytes": len(text),
+            "parsed": len(parsed),
+            **latency_summary(timings),
+            "questions_per_s": n_questions / mean if mean else 0.0,
+            "mb_per_s": len(text) / mean / 2**20 if mean else 0.0,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks for ingestion, search, chain construction and quiz parsing.")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--data-dir", default="data/")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="PDF parsing processes")
+    parser.add_argument("--queries", type=int, default=200, help="search queries per partition")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 4, 10])
+    parser.add_argument("--iterations", type=int, default=50, help="repetitions for the chain and parse benchmarks")
+    parser.add_argument("--questions", type=int, nargs="+", default=[5, 100, 1000], help="questions per synthetic quiz")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    rag_pipeline = fake_pipeline() if set(args.only) - {"ingest"} else None
+    for name in args.only:
+        if name in ("search", "chain") and not rag_pipeline.get_vectorstores():
+            print(f"[WARNING] No vector store found, skipping the {name} benchmark.", file=sys.stderr)
+            continue
+        start = time.perf_counter()
+        report[name] = bench_ingest(args) if name == "ingest" else globals()[f"bench_{name}"](args, rag_pipeline)
+        print(f"[INFO] {name} benchmark took {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# Local stand-in for the OpenAI chat completions and embeddings endpoints, for
+# load tests that must not reach (or pay for) the real API.
+#
+#   python benchmarks/mock_openai.py --port 9000 --chat-latency lognormal:400:0.5 --error-rate 0.01
+#   OPENAI_BASE_URL=http://127.0.0.1:9000/v1 OPENAI_API_KEY=sk-mock uvicorn app.backend:app
+#
+# Latency specs: fixed:<ms>, uniform:<min ms>:<max ms> or lognormal:<median ms>:<sigma>.
+import os, sys, json, time, random, asyncio, hashlib, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.common import FAKE_EMBEDDING_SIZE
+
+QUIZ_QUESTION = """Q{n}. Which statement about {topic} is correct?
+A. The first statement
+B. The second statement
+C. The third statement
+D. The fourth statement
+Answer: {answer}
+"""
+ANSWER_WORDS = "the tutor explains that this concept follows from the definitions given in the chapter".split()
+
+
+def parse_latency(spec):
+    # Returns a function giving one delay in seconds per call
+    kind, *params = spec.split(":")
+    params = [float(p) for p in params]
+    if kind == "fixed":
+        return lambda: params[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(params[0], params[1]) / 1000
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(np.log(params[0]), params[1]) / 1000
+    raise argparse.ArgumentTypeError(f"Unknown latency distribution: {spec}")
+
+
+def fake_vector(item):
+    # Deterministic unit vector per input; OpenAIEmbeddings may send token id lists
+    text = item if isinstance(item, str) else json.dumps(item)
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(FAKE_EMBEDDING_SIZE).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def create_app(args):
+    app = FastAPI()
+    chat_latency = parse_latency(args.chat_latency)
+    embedding_latency = parse_latency(args.embedding_latency)
+    error_statuses = [int(status) for status in args.error_status.split(",")]
+    counters = {"chat": 0, "stream": 0, "embeddings": 0, "errors": 0}
+
+    def injected_error():
+        if random.random() >= args.error_rate:
+            return None
+        counters["errors"] += 1
+        status = random.choice(error_statuses)
+        return JSONResponse(
+            {"error": {"message": "Injected error", "type": "mock_error", "code": status}},
+            status_code=status,
+            headers={"Retry-After": "1"} if status == 429 else None,
+        )
+
+    def reply_text(messages):
+        prompt = " ".join(str(message.get("content", "")) for message in messages)
+        if "multiple choice questions" in prompt:
+            return "".join(QUIZ_QUESTION.format(n=n, topic="this chapter", answer="ABCD"[n % 4]) for n in range(1, 6))
+        return " ".join(random.choice(ANSWER_WORDS) for _ in range(args.answer_words)).capitalize() + "."
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        error = injected_error()
+        await asyncio.sleep(chat_latency())
+        if error is not None:
+            return error
+
+        text = reply_text(body.get("messages", []))
+        model = body.get("model", "mock")
+        created = int(time.time())
+        if not body.get("stream"):
+            counters["chat"] += 1
+            if args.tokens_per_s:
+                await asyncio.sleep(len(text.split()) / args.tokens_per_s)
+            return {
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(text.split()), "total_tokens": len(text.split())},
+            }
+
+        counters["stream"] += 1
+
+        def chunk(delta, finish_reason=None):
+            data = {
+                "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(data)}\n\n"
+
+        async def events():
+            yield chunk({"role": "assistant", "content": ""})
+            for token in text.split(" "):
+                if args.tokens_per_s:
+                    await asyncio.sleep(1 / args.tokens_per_s)
+                yield chunk({"content": token + " "})
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        error = injected_error()
+        await asyncio.sleep(embedding_latency())
+        if error is not None:
+            return error
+        counters["embeddings"] += 1
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        # A single list of token ids is one input, not many
+        if inputs and isinstance(inputs[0], int):
+            inputs = [inputs]
+        return {
+            "object": "list", "model": body.get("model", "mock"),
+            "data": [{"object": "embedding", "index": i, "embedding": fake_vector(item)} for i, item in enumerate(inputs)],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return counters
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI chat completions and embeddings server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--chat-latency", default="lognormal:400:0.4", help="time to first token")
+    parser.add_argument("--embedding-latency", default="lognormal:60:0.3")
+    parser.add_argument("--tokens-per-s", type=float, default=80.0, help="generation speed (0 = instant)")
+    parser.add_argument("--answer-words", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", default="429,500", help="statuses used for injected errors")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for spec in (args.chat_latency, args.embedding_latency):
+        parse_latency(spec)
+
+    random.seed(args.seed)
+    import uvicorn
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os, json, time, sqlite3, hashlib, itertools
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 6 * 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 5000))
+ANSWER_CACHE_MAX_MB = float(os.getenv("ANSWER_CACHE_MAX_MB", 128))
+# Optional SQLite file so cached answers survive restarts; empty = in-process only
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "")
+
+CacheEntry = namedtuple("CacheEntry", ["bucket", "vector", "result", "created", "size"])
+
+
+def history_digest(history_text: str) -> str:
+    # Conversations with the same (whitespace/case-normalised) history share answers
+    normalized = " ".join(history_text.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16] if normalized else ""
+
+
+class SemanticAnswerCache:
+    # Answers keyed by (grade, subject, history digest) and the query embedding.
+    # A lookup hits when a cached question in the same bucket has cosine
+    # similarity >= threshold. Entries expire after `ttl` seconds and the
+    # least recently used ones are evicted beyond `max_entries` / `max_bytes`.
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES, max_bytes=int(ANSWER_CACHE_MAX_MB * 2**20),
+                 path=ANSWER_CACHE_PATH):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # entry id -> CacheEntry, least recently used first
+        self.buckets = {}             # bucket -> (entry ids, stacked unit vectors) for one matmul per lookup
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._ids = itertools.count()
+
+        self.conn = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers (id INTEGER PRIMARY KEY, bucket TEXT, vector BLOB, result TEXT, created REAL)"
+            )
+            self._load()
+
+    def _load(self):
+        cutoff = time.time() - self.ttl
+        with self.conn:
+            self.conn.execute("DELETE FROM answers WHERE created < ?", (cutoff,))
+        rows = self.conn.execute("SELECT id, bucket, vector, result, created FROM answers ORDER BY created").fetchall()
+        for entry_id, bucket, blob, result, created in rows:
+            self._add(entry_id, tuple(json.loads(bucket)), np.frombuffer(blob, dtype=np.float32), json.loads(result), created)
+        if rows:
+            self._ids = itertools.count(rows[-1][0] + 1)
+        self._evict()
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _add(self, entry_id, bucket, vector, result, created):
+        size = vector.nbytes + len(json.dumps(result))
+        self.entries[entry_id] = CacheEntry(bucket, vector, result, created, size)
+        self.bytes += size
+        self.buckets.pop(bucket, None)
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id)
+        self.bytes -= entry.size
+        self.buckets.pop(entry.bucket, None)
+        if self.conn:
+            with self.conn:
+                self.conn.execute("DELETE FROM answers WHERE id = ?", (entry_id,))
+
+    def _evict(self):
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _bucket_matrix(self, bucket):
+        if bucket not in self.buckets:
+            ids = [entry_id for entry_id, entry in self.entries.items() if entry.bucket == bucket]
+            matrix = np.stack([self.entries[entry_id].vector for entry_id in ids]) if ids else None
+            self.buckets[bucket] = (ids, matrix)
+        return self.buckets[bucket]
+
+    def lookup(self, grade, subject, history_text, embedding):
+        bucket = (grade, subject.lower(), history_digest(history_text))
+        ids, matrix = self._bucket_matrix(bucket)
+        if matrix is not None:
+            scores = matrix @ self._unit(embedding)
+            for pos in np.argsort(-scores):
+                if scores[pos] < self.threshold:
+                    break
+                entry_id = ids[pos]
+                if time.time() - self.entries[entry_id].created > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                self.entries.move_to_end(entry_id)
+                self.hits += 1
+                return self.entries[entry_id].result
+        self.misses += 1
+        return None
+
+    def store(self, grade, subject, history_text, embedding, result):
+        bucket = (grade, subject.lower(), history_digest(history_text))
+        vector = self._unit(embedding)
+        entry_id, created = next(self._ids), time.time()
+        self._add(entry_id, bucket, vector, result, created)
+        if self.conn:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT INTO answers (id, bucket, vector, result, created) VALUES (?, ?, ?, ?, ?)",
+                    (entry_id, json.dumps(bucket), vector.tobytes(), json.dumps(result), created),
+                )
+        self._evict()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+        }
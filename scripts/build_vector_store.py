@@ -1,19 +1,256 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from ingest_data import load_and_split_all
+import os, json, shutil, hashlib, argparse, uuid
+from collections import defaultdict
+
+from ingest_data import list_pdf_files, iter_split_files, print_ingest_report, NearDuplicateFilter, drop_near_duplicates, INGEST_WORKERS
+from partitions import partition_name, chapter_ranges, save_partitions, load_partitions
+from lexical_index import BM25Index
+from routing import ChapterRouter, ROUTING_CENTROIDS, ROUTING_FILE
+from chunk_store import load_partition_store, save_partition_store
+from index_types import INDEX_TYPES, build_index, parse_index_params, read_index_config, write_index_config, index_vectors, recall_report
+from embedding_cache import CachedEmbeddings, EmbeddingCache, EMBEDDING_CACHE_PATH, EMBEDDING_BATCH_SIZE, EMBEDDING_CONCURRENCY
 from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
+from langchain_community.embeddings import DeterministicFakeEmbedding
+import numpy as np
+
+STORE_DIR = "vector_store"
+DATA_DIR = "data/"
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Records, for every PDF, the content hash it was indexed at and the ids of the
+# vectors it produced, so a rebuild only has to embed new or changed files,
+# and for every partition the index settings it was built with, so a change
+# of --index-type / --index-params / --routing-centroids rebuilds it.
+MANIFEST_FILE = "manifest.json"
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def load_manifest(store_dir=STORE_DIR):
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, store_dir=STORE_DIR):
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def build_config(index_type="flat", index_params=None, routing_centroids=ROUTING_CENTROIDS):
+    return {"index_type": index_type, "index_params": dict(index_params or {}), "routing_centroids": routing_centroids}
+
+
+def built_config(manifest, store_dir, name):
+    # Settings a partition was built with; stores from before they were recorded
+    # are described by their index.json (default parameters) and routing table
+    if name in manifest.get("partitions", {}):
+        return manifest["partitions"][name]
+    path = os.path.join(store_dir, name)
+    config = read_index_config(path)
+    has_routing = os.path.exists(os.path.join(path, ROUTING_FILE))
+    return build_config(config.get("requested", config["type"]), None, ROUTING_CENTROIDS if has_routing else None)
+
+
+def load_partition_entries(store_dir, name, embeddings):
+    # Returns {vector id: (document, vector)} for an existing partition
+    path = os.path.join(store_dir, name)
+    if not os.path.exists(path):
+        return {}
+    vectorstore = load_partition_store(path, embeddings)
+    entries = [(doc_id, vectorstore.docstore.search(doc_id)) for _, doc_id in sorted(vectorstore.index_to_docstore_id.items())]
+    vectors = index_vectors(vectorstore.index, read_index_config(path))
+    if vectors is None:
+        # PQ codes only approximate the vectors; the embedding cache has the originals
+        vectors = embeddings.embed_documents([doc.page_content for _, doc in entries])
+    return {doc_id: (doc, vector) for (doc_id, doc), vector in zip(entries, vectors)}
+
+
+def save_partition(store_dir, name, entries, index_type="flat", index_params=None, reports=None,
+                   routing_centroids=ROUTING_CENTROIDS):
+    # Stable sort keeps page order inside a chapter and gives each chapter
+    # a contiguous id range in the sub-index
+    entries.sort(key=lambda entry: entry[1].metadata["chapter"])
+    ids = [doc_id for doc_id, _, _ in entries]
+    docs = [doc for _, doc, _ in entries]
+
+    vectors = np.array([vector for _, _, vector in entries], dtype=np.float32)
+    index, config = build_index(vectors, index_type, index_params)
+    if config.get("requested"):
+        print(f"[WARNING] Partition {name}: {len(vectors)} vectors are too few to train {config['requested']}, built a flat index.")
+    # Chunk text and metadata go to a read-only SQLite file next to the index
+    save_partition_store(os.path.join(store_dir, name), index, ids, docs)
+    write_index_config(os.path.join(store_dir, name), config)
+    if reports is not None:
+        reports[name] = recall_report(index, config, vectors)
+
+    # BM25 index over the same chunks, numbered by the same FAISS ids
+    BM25Index.build([doc.page_content for doc in docs]).save(os.path.join(store_dir, name))
+    # Chapter centroids, to route questions that name no chapter
+    ranges = chapter_ranges(docs)
+    ChapterRouter.build(vectors, ranges, routing_centroids).save(os.path.join(store_dir, name))
+    return ranges
+
+
+def update_vector_store(embeddings, data_dir=DATA_DIR, store_dir=STORE_DIR, full=False, workers=INGEST_WORKERS,
+                        index_type="flat", index_params=None, reports=None, routing_centroids=ROUTING_CENTROIDS):
+    manifest = {"files": {}} if full else load_manifest(store_dir)
+    partitions = {} if full else load_partitions(store_dir)
+    indexed = manifest["files"]
+    built = manifest.setdefault("partitions", {})
+    config = build_config(index_type, index_params, routing_centroids)
+
+    current = {}
+    for file_path, grade, subject, chapter in list_pdf_files(data_dir):
+        current[os.path.relpath(file_path, data_dir)] = {
+            "path": file_path,
+            "sha256": file_hash(file_path),
+            "grade": grade,
+            "subject": subject,
+            "chapter": chapter,
+        }
+
+    changed = [f for f, info in current.items() if indexed.get(f, {}).get("sha256") != info["sha256"]]
+    removed = [f for f in indexed if f not in current]
+    # Partitions built with other index settings are rebuilt from their stored vectors
+    outdated = [name for name in partitions if built_config(manifest, store_dir, name) != config]
+    if not changed and not removed and not outdated:
+        print("[INFO] Vector store is up to date.")
+        return partitions
+
+    print(f"[INFO] {len(changed)} new or changed files, {len(removed)} removed files, "
+          f"{len(outdated)} partitions with other index settings.")
+
+    # Only partitions touched by a change are rebuilt
+    affected = defaultdict(list)
+    for f in changed:
+        affected[partition_name(current[f]["grade"], current[f]["subject"])].append(f)
+    for f in removed:
+        affected.setdefault(partition_name(indexed[f]["grade"], indexed[f]["subject"]), [])
+    for name in outdated:
+        affected.setdefault(name, [])
+
+    # Changed files of every affected partition are parsed in one process pool,
+    # in partition order, while earlier files are being embedded
+    order = sorted(affected)
+    pdf_files = [
+        (current[f]["path"], current[f]["grade"], current[f]["subject"], current[f]["chapter"])
+        for name in order for f in affected[name]
+    ]
+    parsed = iter_split_files(pdf_files, workers)
+
+    report = []
+    for name in order:
+        files = affected[name]
+        # Reuse the stored vectors of unchanged files instead of re-embedding them
+        existing = {} if full else load_partition_entries(store_dir, name, embeddings)
+        entries = []
+        for f, info in indexed.items():
+            if f in current and f not in changed and partition_name(info["grade"], info["subject"]) == name:
+                entries.extend((doc_id, *existing[doc_id]) for doc_id in info["ids"])
+        kept = len(entries)
+        # New chunks that nearly repeat a chunk of this partition are not embedded
+        dedup = NearDuplicateFilter()
+        for _, doc, _ in entries:
+            dedup.is_duplicate(doc.page_content)
+
+        new_docs = []
+        for f, (pdf_file, all_docs, seconds, stripped) in zip(files, parsed):
+            info = current[f]
+            if all_docs is None:
+                indexed.pop(f, None)
+                continue
+            docs, duplicate_bytes = drop_near_duplicates(all_docs, dedup)
+            report.append((
+                pdf_file[0], len({doc.metadata.get("page") for doc in all_docs}), len(docs), seconds,
+                stripped, len(all_docs) - len(docs), duplicate_bytes,
+            ))
+            ids = [str(uuid.uuid4()) for _ in docs]
+            new_docs.extend(zip(ids, docs))
+            indexed[f] = {key: info[key] for key in ("sha256", "grade", "subject", "chapter")}
+            indexed[f]["ids"] = ids
+
+        # One call per partition so the embedder can batch and parallelise requests
+        if new_docs:
+            vectors = embeddings.embed_documents([doc.page_content for _, doc in new_docs])
+            entries.extend((doc_id, doc, vector) for (doc_id, doc), vector in zip(new_docs, vectors))
+
+        print(f"[INFO] Partition {name}: kept {kept} vectors, embedded {len(entries) - kept} new chunks.")
+        if not entries:
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+            partitions.pop(name, None)
+            built.pop(name, None)
+            continue
+
+        first = entries[0][1].metadata
+        partitions[name] = {
+            "grade": first["grade"],
+            "subject": first["subject"],
+            "size": len(entries),
+            "chapters": save_partition(store_dir, name, entries, index_type, index_params, reports, routing_centroids),
+        }
+        built[name] = config
+
+    for f in removed:
+        del indexed[f]
+
+    if report:
+        print_ingest_report(report)
+    save_partitions(store_dir, partitions)
+    save_manifest(manifest, store_dir)
+    return partitions
+
 
 if __name__ == "__main__":
-    print("[INFO] Loading and splitting all documents...")
-    all_docs = load_and_split_all("data/")
+    parser = argparse.ArgumentParser(description="Build or incrementally update the partitioned vector store.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--store-dir", default=STORE_DIR)
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and re-embed every file")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="processes used to parse PDFs")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE, help="texts per embedding request")
+    parser.add_argument("--concurrency", type=int, default=EMBEDDING_CONCURRENCY, help="embedding requests in flight")
+    parser.add_argument("--cache-path", default=EMBEDDING_CACHE_PATH, help="on-disk embedding cache")
+    parser.add_argument("--fake-embeddings", action="store_true", help="use a deterministic local embedder (offline testing)")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat", help="FAISS index built for rebuilt partitions")
+    parser.add_argument("--index-params", default="", help="e.g. M=32,efConstruction=200,efSearch=64 or nlist=256,nprobe=16,m=64,nbits=8")
+    parser.add_argument("--routing-centroids", type=int, default=ROUTING_CENTROIDS, help="k-means centroids per chapter in the routing table")
+    parser.add_argument("--index-report", help="write recall@10 / latency / memory vs the flat index per rebuilt partition here (JSON)")
+    args = parser.parse_args()
+
+    if args.fake_embeddings:
+        model_name, base_embeddings = "fake-1536", DeterministicFakeEmbedding(size=1536)
+    else:
+        model_name, base_embeddings = EMBEDDING_MODEL, OpenAIEmbeddings(model=EMBEDDING_MODEL)
+    embeddings = CachedEmbeddings(
+        base_embeddings, model_name, EmbeddingCache(args.cache_path),
+        batch_size=args.batch_size, concurrency=args.concurrency,
+    )
+
+    print("[INFO] Checking documents for changes...")
+    reports = {} if args.index_report else None
+    partitions = update_vector_store(
+        embeddings, args.data_dir, args.store_dir, full=args.full, workers=args.workers,
+        index_type=args.index_type, index_params=parse_index_params(args.index_params), reports=reports,
+        routing_centroids=args.routing_centroids,
+    )
+    embeddings.report()
+    if reports:
+        with open(args.index_report, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"[INFO] Index report for {len(reports)} partitions written to {args.index_report}")
 
-    if not all_docs:
+    if not partitions:
         print("[WARNING] No documents found. Please check your data directory.")
     else:
-        print(f"[INFO] Creating vector store with {len(all_docs)} chunks...")
-        embeddings = OpenAIEmbeddings(model='text-embedding-3-small')
-        vectorstore = FAISS.from_documents(all_docs, embeddings)
-        vectorstore.save_local("vector_store")
-        print("[SUCCESS] Vector store saved to 'vector_store/'")
+        print(f"[SUCCESS] {len(partitions)} partitions saved to '{args.store_dir}/'")
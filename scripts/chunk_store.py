@@ -0,0 +1,136 @@
+import os, json, sqlite3, threading
+from collections.abc import Mapping
+from typing import List
+
+import faiss
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+
+# Layout of one partition directory:
+#   index.faiss    -> the FAISS index, vector position i is FAISS id i
+#   chunks.sqlite  -> read-only chunk text and metadata, one row per FAISS id
+#   index.json     -> index type and parameters (scripts/index_types.py)
+#   routing.npz    -> chapter centroids for routing (scripts/routing.py)
+# Unlike the pickled InMemoryDocstore (index.pkl), nothing but the index is
+# read at load time: rows are fetched for the top-k hits of a query, and the
+# file's pages are shared by every process through the OS page cache.
+FAISS_INDEX_FILE = "index.faiss"
+CHUNK_STORE_FILE = "chunks.sqlite"
+
+
+def write_chunk_store(folder_path, ids, docs):
+    path = os.path.join(folder_path, CHUNK_STORE_FILE)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute(
+            "CREATE TABLE chunks (pos INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, "
+            "page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        with conn:
+            conn.executemany(
+                "INSERT INTO chunks (pos, id, page_content, metadata) VALUES (?, ?, ?, ?)",
+                ((pos, doc_id, doc.page_content, json.dumps(doc.metadata, default=str))
+                 for pos, (doc_id, doc) in enumerate(zip(ids, docs))),
+            )
+    finally:
+        conn.close()
+    # Readers of the old file keep their handle; new readers see the complete new one
+    os.replace(tmp_path, path)
+
+
+class ChunkStore(Docstore):
+    # Read-only docstore over chunks.sqlite. Each thread gets its own connection,
+    # opened on first use, so the store can be shared by request handler threads.
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self.size = self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def _connect(self):
+        # immutable=1: the file never changes while open, so SQLite skips locking
+        return sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    @staticmethod
+    def _document(doc_id, page_content, metadata):
+        return Document(id=doc_id, page_content=page_content, metadata=json.loads(metadata))
+
+    def search(self, search: str):
+        row = self.conn.execute("SELECT id, page_content, metadata FROM chunks WHERE id = ?", (search,)).fetchone()
+        return self._document(*row) if row else f"ID {search} not found."
+
+    def by_position(self, positions: List[int]) -> List[Document]:
+        # Documents for FAISS ids, in the given order, in one query
+        if not positions:
+            return []
+        rows = self.conn.execute(
+            f"SELECT pos, id, page_content, metadata FROM chunks WHERE pos IN ({','.join('?' * len(positions))})",
+            [int(pos) for pos in positions],
+        )
+        found = {pos: self._document(*row) for pos, *row in rows}
+        return [found[pos] for pos in positions if pos in found]
+
+    def id_at(self, pos: int):
+        row = self.conn.execute("SELECT id FROM chunks WHERE pos = ?", (int(pos),)).fetchone()
+        return row[0] if row else None
+
+    def ids(self):
+        return [doc_id for doc_id, in self.conn.execute("SELECT id FROM chunks ORDER BY pos")]
+
+
+class PositionIds(Mapping):
+    # FAISS id -> docstore id, read from the chunk store instead of held in a dict
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+
+    def __getitem__(self, pos):
+        doc_id = self.store.id_at(pos)
+        if doc_id is None:
+            raise KeyError(pos)
+        return doc_id
+
+    def __iter__(self):
+        return iter(range(self.store.size))
+
+    def __len__(self):
+        return self.store.size
+
+    def items(self):
+        return list(enumerate(self.store.ids()))
+
+
+def load_partition_store(folder_path, embeddings, io_flags=0) -> FAISS:
+    # FAISS vector store over index.faiss + chunks.sqlite, falling back to the
+    # pickled index.pkl of stores built before the chunk store existed.
+    # io_flags are faiss.read_index flags, e.g. IO_FLAG_MMAP for serving.
+    chunk_path = os.path.join(folder_path, CHUNK_STORE_FILE)
+    if not os.path.exists(chunk_path):
+        return FAISS.load_local(folder_path, embeddings, allow_dangerous_deserialization=True)
+    index = faiss.read_index(os.path.join(folder_path, FAISS_INDEX_FILE), io_flags)
+    docstore = ChunkStore(chunk_path)
+    return FAISS(embeddings, index, docstore, PositionIds(docstore))
+
+
+def save_partition_store(folder_path, index, ids, docs):
+    os.makedirs(folder_path, exist_ok=True)
+    # Written aside and renamed: servers may have the current file memory-mapped
+    path = os.path.join(folder_path, FAISS_INDEX_FILE)
+    faiss.write_index(index, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    write_chunk_store(folder_path, ids, docs)
+    # The pickled docstore of an older build is no longer read
+    legacy = os.path.join(folder_path, "index.pkl")
+    if os.path.exists(legacy):
+        os.remove(legacy)
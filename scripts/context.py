@@ -0,0 +1,93 @@
+import os, re
+
+import numpy as np
+from langchain_core.callbacks import dispatch_custom_event
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+
+from scripts.conversation import count_tokens
+from scripts.lexical_index import tokenize
+
+# Prompt budget for the retrieved context, counted with the chat model's tokenizer;
+# 0 sends the retrieved chunks unchanged
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 600))
+# Candidates taken from the search before the MMR selection of the final k chunks,
+# and the weight of relevance against novelty in that selection (1 = relevance only)
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", 12))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.7))
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def mmr(vectors: np.ndarray, k: int, lambda_mult=MMR_LAMBDA):
+    # Maximal marginal relevance over candidates given best first: relevance
+    # falls linearly with the rank, redundancy is the highest cosine similarity
+    # to a candidate already chosen. Returns the chosen positions.
+    n = len(vectors)
+    if n <= k:
+        return list(range(n))
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarity = unit @ unit.T
+    relevance = 1 - np.arange(n) / n
+    chosen = [0]
+    while len(chosen) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * similarity[:, chosen].max(axis=1)
+        scores[chosen] = -np.inf
+        chosen.append(int(np.argmax(scores)))
+    return chosen
+
+
+def split_sentences(text: str):
+    return [sentence.strip() for sentence in SENTENCE_END.split(text) if sentence.strip()]
+
+
+def compress_docs(docs, query, budget=CONTEXT_TOKEN_BUDGET, idf=None):
+    # Returns (docs, tokens before, tokens after). Sentences repeated between
+    # chunks (chunk overlap, adjacent pages) are sent once. Over the budget, the
+    # sentences sharing the rarest terms with the query are kept, in their
+    # original order; earlier (better ranked) chunks win ties.
+    before = sum(count_tokens(doc.page_content) for doc in docs)
+    if budget <= 0 or not docs:
+        return docs, before, before
+
+    terms = set(tokenize(query))
+    weight = idf or (lambda term: 1.0)
+    seen = set()
+    sentences = []  # (doc number, position, text, tokens, score)
+    for number, doc in enumerate(docs):
+        for position, sentence in enumerate(split_sentences(doc.page_content)):
+            key = " ".join(sentence.lower().split())
+            if key in seen:
+                continue
+            seen.add(key)
+            score = sum(weight(term) for term in terms & set(tokenize(sentence)))
+            sentences.append((number, position, sentence, count_tokens(sentence), score))
+
+    if sum(sentence[3] for sentence in sentences) > budget:
+        kept, used = set(), 0
+        for i in sorted(range(len(sentences)), key=lambda i: (-sentences[i][4], sentences[i][0], sentences[i][1])):
+            if used + sentences[i][3] <= budget:
+                kept.add(i)
+                used += sentences[i][3]
+        sentences = [sentence for i, sentence in enumerate(sentences) if i in kept]
+
+    compressed = []
+    for number, doc in enumerate(docs):
+        text = " ".join(sentence[2] for sentence in sentences if sentence[0] == number)
+        if text:
+            compressed.append(Document(id=doc.id, page_content=text, metadata=doc.metadata))
+    return compressed, before, sum(count_tokens(doc.page_content) for doc in compressed)
+
+
+def context_compressor(lexical=None, budget=CONTEXT_TOKEN_BUDGET):
+    # Runnable placed before a stuff-documents chain: replaces inputs["context"]
+    # with the compressed documents and reports the token counts to the
+    # callbacks as a "context_compressed" event (see metrics.LLMUsage)
+    idf = lexical.idf if lexical is not None else None
+
+    def compress(inputs, config):
+        docs, before, after = compress_docs(inputs["context"], inputs["input"], budget, idf)
+        dispatch_custom_event("context_compressed", {"tokens_before": before, "tokens_after": after}, config=config)
+        return docs
+
+    return RunnablePassthrough.assign(context=RunnableLambda(compress))
@@ -0,0 +1,221 @@
+import os, time, sqlite3, asyncio, logging, threading
+from functools import lru_cache
+
+import tiktoken
+
+from scripts.logs import get_logger, log
+
+logger = get_logger("conversation")
+
+# Prompt budget for conversation history, counted with the chat model's tokenizer
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1500))
+# Most recent messages kept verbatim; older ones are folded into a rolling summary
+HISTORY_KEEP_MESSAGES = int(os.getenv("HISTORY_KEEP_MESSAGES", 6))
+SESSION_TTL = float(os.getenv("SESSION_TTL", 4 * 3600))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", 10000))
+# Sessions are kept in SQLite so that every worker process of the server
+# (python -m scripts.serving --workers N) sees the same conversations
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "cache/sessions.sqlite")
+# A worker summarising a session holds it for at most this long
+SUMMARY_LEASE = 120.0
+# Seconds a query waits for another worker's write lock before failing; the
+# queries run in threads, so a wait never blocks the event loop
+SESSION_BUSY_TIMEOUT = float(os.getenv("SESSION_BUSY_TIMEOUT", 1.0))
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    # Loaded on first use: the BPE file may need to be fetched and read from disk
+    return tiktoken.encoding_for_model("gpt-4o-mini")
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    # Keeps the end of the text, which holds the most recent information
+    tokens = get_encoding().encode(text)
+    return text if len(tokens) <= max_tokens else get_encoding().decode(tokens[-max_tokens:])
+
+
+def format_turn(turn) -> str:
+    if turn["role"] == "user":
+        return f"User: {turn['content']}\n"
+    elif turn["role"] == "assistant":
+        return f"Tutor: {turn['content']}\n"
+    return ""
+
+
+def budget_history(turns, budget=HISTORY_TOKEN_BUDGET, summary="") -> str:
+    # Renders the summary plus as many of the most recent turns as fit in the budget
+    summary_text = f"Summary of the earlier conversation: {summary}\n" if summary else ""
+    remaining = budget - count_tokens(summary_text)
+    if remaining < 0:
+        summary_text = truncate_tokens(summary_text, budget)
+        remaining = 0
+
+    lines = []
+    for turn in reversed(turns or []):
+        line = format_turn(turn)
+        cost = count_tokens(line)
+        if cost > remaining:
+            break
+        lines.append(line)
+        remaining -= cost
+    return summary_text + "".join(reversed(lines))
+
+
+class ConversationStore:
+    # Server-side chat history per session id, shared by the worker processes
+    # through one SQLite file. `summarize(summary, turns_text)` is an async
+    # function returning a new summary that covers the old summary plus the turns.
+    # The async methods run their queries in worker threads, each thread with
+    # its own connection.
+
+    def __init__(self, summarize, budget=HISTORY_TOKEN_BUDGET, keep_messages=HISTORY_KEEP_MESSAGES,
+                 ttl=SESSION_TTL, max_sessions=MAX_SESSIONS, path=SESSION_STORE_PATH):
+        self.summarize = summarize
+        self.budget = budget
+        self.keep_messages = keep_messages
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self.tasks = set()  # running summarisations
+        self.summaries = 0
+
+    @property
+    def conn(self):
+        # Opened on first use in each thread, so importing the pipeline does no I/O
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _connect(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=SESSION_BUSY_TIMEOUT)
+        with self._schema_lock:
+            if self._schema_ready:
+                return conn
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, summary TEXT NOT NULL DEFAULT '', "
+                    "updated REAL NOT NULL, lease REAL NOT NULL DEFAULT 0)"
+                )
+                # Appending a turn is one insert, so workers never overwrite each other's turns
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS turns (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                    "session TEXT NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS turns_session ON turns (session, seq)")
+            self._schema_ready = True
+        return conn
+
+    def _session(self, session_id):
+        # Returns the summary, starting the session over when it has expired
+        now = time.time()
+        row = self.conn.execute("SELECT summary, updated FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is not None and now - row[1] <= self.ttl:
+            return row[0]
+        with self.conn:
+            self.conn.execute("DELETE FROM turns WHERE session = ?", (session_id,))
+            self.conn.execute("INSERT OR REPLACE INTO sessions (id, summary, updated) VALUES (?, '', ?)", (session_id, now))
+            if row is None:
+                self._evict()
+        return ""
+
+    def _evict(self):
+        # Drops the least recently used sessions beyond max_sessions
+        stale = [row[0] for row in self.conn.execute(
+            "SELECT id FROM sessions ORDER BY updated DESC LIMIT -1 OFFSET ?", (self.max_sessions,)
+        )]
+        for session_id in stale:
+            self.conn.execute("DELETE FROM turns WHERE session = ?", (session_id,))
+            self.conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def _turns(self, session_id):
+        return self.conn.execute(
+            "SELECT seq, role, content FROM turns WHERE session = ? ORDER BY seq", (session_id,)
+        ).fetchall()
+
+    def _history_text(self, session_id) -> str:
+        summary = self._session(session_id)
+        turns = [{"role": role, "content": content} for _, role, content in self._turns(session_id)]
+        return budget_history(turns, self.budget, summary)
+
+    async def history_text(self, session_id) -> str:
+        return await asyncio.to_thread(self._history_text, session_id)
+
+    async def record(self, session_id, question, answer):
+        # Appends one exchange and folds older turns into the summary in the background,
+        # so the request that triggered it does not wait for the summarisation call
+        if await asyncio.to_thread(self._append, session_id, question, answer):
+            # The loop keeps only a weak reference to tasks
+            task = asyncio.get_running_loop().create_task(self._compact(session_id))
+            self.tasks.add(task)
+            task.add_done_callback(self._compaction_done)
+
+    def _append(self, session_id, question, answer):
+        # Returns whether this worker claimed the session's summarisation
+        self._session(session_id)
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO turns (session, role, content) VALUES (?, ?, ?)",
+                [(session_id, "user", question), (session_id, "assistant", answer)],
+            )
+            self.conn.execute("UPDATE sessions SET updated = ? WHERE id = ?", (now, session_id))
+            count = self.conn.execute("SELECT COUNT(*) FROM turns WHERE session = ?", (session_id,)).fetchone()[0]
+            # Only one worker summarises a session at a time
+            return count > self.keep_messages and self.conn.execute(
+                "UPDATE sessions SET lease = ? WHERE id = ? AND lease < ?", (now + SUMMARY_LEASE, session_id, now)
+            ).rowcount == 1
+
+    def _compaction_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log(logger, logging.ERROR, "history_summary_crashed", error=str(task.exception()))
+
+    def _fold(self, session_id, summary, last_seq):
+        # Cap the summary so it never crowds out the recent turns
+        with self.conn:
+            self.conn.execute("UPDATE sessions SET summary = ? WHERE id = ?",
+                              (truncate_tokens(summary.strip(), self.budget // 2), session_id))
+            self.conn.execute("DELETE FROM turns WHERE session = ? AND seq <= ?", (session_id, last_seq))
+
+    def _drop_old_turns(self, session_id):
+        turns = self._turns(session_id)
+        if len(turns) > self.keep_messages:
+            with self.conn:
+                self.conn.execute("DELETE FROM turns WHERE session = ? AND seq <= ?",
+                                  (session_id, turns[-self.keep_messages - 1][0]))
+
+    def _release(self, session_id):
+        with self.conn:
+            self.conn.execute("UPDATE sessions SET lease = 0 WHERE id = ?", (session_id,))
+
+    async def _compact(self, session_id):
+        try:
+            while True:
+                turns = await asyncio.to_thread(self._turns, session_id)
+                if len(turns) <= self.keep_messages:
+                    break
+                folded = turns[:-self.keep_messages]
+                turns_text = "".join(format_turn({"role": role, "content": content}) for _, role, content in folded)
+                summary = await self.summarize(await asyncio.to_thread(self._session, session_id), turns_text)
+                await asyncio.to_thread(self._fold, session_id, summary, folded[-1][0])
+                self.summaries += 1
+        except Exception as e:
+            log(logger, logging.ERROR, "history_summary_failed", error=str(e))
+            await asyncio.to_thread(self._drop_old_turns, session_id)
+        finally:
+            await asyncio.to_thread(self._release, session_id)
+
+    def stats(self):
+        sessions = self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {"sessions": sessions, "summaries": self.summaries}
@@ -0,0 +1,207 @@
+import os, time, sqlite3, hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 256))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 4096))
+
+
+def retryable_errors():
+    # Errors worth waiting out instead of failing the whole build. openai is
+    # imported here so that importing this module (the server does) stays cheap.
+    import openai
+    return (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)
+
+
+def embedding_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    # On-disk map of embedding_key -> float32 vector, stored as raw bytes in SQLite
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        # Stay below SQLite's bound-parameter limit
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()],
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    # Wraps an Embeddings model: document texts already embedded with the same
+    # model are served from the cache, the rest are sent in batches of
+    # `batch_size` with at most `concurrency` requests in flight.
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache: EmbeddingCache = None,
+                 batch_size: int = EMBEDDING_BATCH_SIZE, concurrency: int = EMBEDDING_CONCURRENCY,
+                 max_retries: int = 6):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache or EmbeddingCache()
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.hits = 0
+        self.misses = 0
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.embeddings.embed_documents(texts)
+            except retryable_errors() as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(60, 2 ** attempt)
+                print(f"[WARNING] Embedding batch failed ({type(e).__name__}), retrying in {delay}s...")
+                time.sleep(delay)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_key(self.model_name, text) for text in texts]
+        found = self.cache.get_many(list(set(keys)))
+
+        # Each distinct missing text is embedded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - sum(1 for key in keys if key in missing)
+        self.misses += len(missing)
+
+        if missing:
+            missing_keys = list(missing)
+            batches = [missing_keys[i:i + self.batch_size] for i in range(0, len(missing_keys), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as pool:
+                results = pool.map(lambda batch: self._embed_batch([missing[key] for key in batch]), batches)
+                for batch, vectors in zip(batches, results):
+                    new = dict(zip(batch, vectors))
+                    self.cache.put_many(new)
+                    found.update((key, np.asarray(vector, dtype=np.float32)) for key, vector in new.items())
+
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0.0
+        print(f"[INFO] Embedding cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)")
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class CachingQueryEmbeddings(Embeddings):
+    # Wraps the query side of an Embeddings model with a bounded LRU of float32
+    # vectors keyed by the whitespace/case-normalised query. The model always
+    # sees the query as written (the first spelling seen for a key); the key
+    # only decides which spellings share a vector. Document embedding
+    # passes straight through. `aprecompute` warms the cache in one batched call
+    # for queries known in advance (e.g. the templated quiz queries).
+
+    def __init__(self, embeddings: Embeddings, max_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self.vectors = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key):
+        vector = self.vectors.get(key)
+        if vector is None:
+            self.misses += 1
+            return None
+        self.vectors.move_to_end(key)
+        self.hits += 1
+        return vector.tolist()
+
+    def _put(self, key, vector):
+        # Returns the stored float32 values so hits and misses give identical vectors
+        vector = self.vectors[key] = np.asarray(vector, dtype=np.float32)
+        self.vectors.move_to_end(key)
+        while len(self.vectors) > self.max_size:
+            self.vectors.popitem(last=False)
+        return vector.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = self._put(key, self.embeddings.embed_query(text))
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = self._put(key, await self.embeddings.aembed_query(text))
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_queries(self, queries: List[str]) -> List[List[float]]:
+        # Query vectors for many queries: cached ones from the LRU, all others
+        # in a single batched embeddings request
+        keys = [normalize_query(query) for query in queries]
+        found = {}
+        missing = {}
+        for key, query in zip(keys, queries):
+            if key in found or key in missing:
+                continue
+            vector = self._get(key)
+            if vector is not None:
+                found[key] = vector
+            else:
+                missing[key] = query
+        if missing:
+            for key, vector in zip(missing, await self.embeddings.aembed_documents(list(missing.values()))):
+                found[key] = self._put(key, vector)
+        return [found[key] for key in keys]
+
+    async def aprecompute(self, queries: List[str]):
+        missing = {}
+        for query in queries:
+            key = normalize_query(query)
+            if key not in self.vectors:
+                missing.setdefault(key, query)
+        if missing:
+            for key, vector in zip(missing, await self.embeddings.aembed_documents(list(missing.values()))):
+                self._put(key, vector)
+        return len(missing)
+
+    def stats(self):
+        return {"size": len(self.vectors), "hits": self.hits, "misses": self.misses}
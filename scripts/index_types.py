@@ -0,0 +1,185 @@
+import os, json, time
+
+import faiss
+import numpy as np
+
+# FAISS index types selectable at build time. index.json next to index.faiss
+# records the type and its parameters, including the default search-time knob
+# (efSearch for HNSW, nprobe for IVF), which FAISS_EF_SEARCH / FAISS_NPROBE
+# override at serving time without a rebuild.
+INDEX_CONFIG_FILE = "index.json"
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+DEFAULT_INDEX_PARAMS = {
+    "flat": {},
+    "hnsw": {"M": 32, "efConstruction": 200, "efSearch": 64},
+    "ivf_flat": {"nlist": 256, "nprobe": 16},
+    # m sub-quantizers of nbits each: 1536-d float32 (6 KB) -> 64 bytes per vector
+    "ivf_pq": {"nlist": 256, "nprobe": 16, "m": 64, "nbits": 8},
+}
+# Only flat and HNSW (flat storage) and IVF-Flat give back the exact vectors
+EXACT_INDEX_TYPES = ("flat", "hnsw", "ivf_flat")
+
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", 0))
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", 0))
+
+# k-means wants about this many training points per inverted list
+IVF_POINTS_PER_LIST = 39
+
+
+def parse_index_params(spec: str) -> dict:
+    # "M=32,efSearch=128" -> {"M": 32, "efSearch": 128}
+    params = {}
+    for part in filter(None, (part.strip() for part in (spec or "").split(","))):
+        key, value = part.split("=")
+        params[key.strip()] = int(value)
+    return params
+
+
+def build_index(vectors: np.ndarray, kind="flat", params=None):
+    # Returns (trained and filled index, config for index.json). Partitions too
+    # small for the requested IVF / PQ training get fewer lists, or a flat index.
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {kind}, expected one of {', '.join(INDEX_TYPES)}")
+    params = {**DEFAULT_INDEX_PARAMS[kind], **(params or {})}
+    unknown = set(params) - set(DEFAULT_INDEX_PARAMS[kind])
+    if unknown:
+        raise ValueError(f"Unknown parameters for {kind}: {', '.join(sorted(unknown))}")
+    n, dim = vectors.shape
+    config = {"type": kind, "params": params, "dim": dim, "ntotal": n}
+
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["M"])
+        index.hnsw.efConstruction = params["efConstruction"]
+    elif kind in ("ivf_flat", "ivf_pq"):
+        if kind == "ivf_pq":
+            if dim % params["m"]:
+                raise ValueError(f"ivf_pq: m={params['m']} does not divide the dimension {dim}")
+            # Each PQ codebook needs a few training points per centroid
+            if n < 2 ** params["nbits"] * 4:
+                flat, flat_config = build_index(vectors, "flat")
+                return flat, {**flat_config, "requested": kind}
+        nlist = max(1, min(params["nlist"], n // IVF_POINTS_PER_LIST))
+        params.update(nlist=nlist, nprobe=min(params["nprobe"], nlist))
+        quantizer = faiss.IndexFlatL2(dim)
+        if kind == "ivf_pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, params["m"], params["nbits"])
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        index.train(vectors)
+    else:
+        index = faiss.IndexFlatL2(dim)
+
+    index.add(vectors)
+    configure_index(index, config)
+    return index, config
+
+
+def configure_index(index, config=None, ef_search=FAISS_EF_SEARCH, nprobe=FAISS_NPROBE):
+    # Applies the search-time knob: the setting if given, else the built default
+    params = (config or {}).get("params", {})
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search or params.get("efSearch", index.hnsw.efSearch)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe or params.get("nprobe", ivf.nprobe)
+    return index
+
+
+def search_parameters(index, sel=None):
+    # HNSW and IVF indexes reject the base SearchParameters; per-query
+    # parameters replace the index's own knobs, so they are copied over
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=index.hnsw.efSearch)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=sel, nprobe=ivf.nprobe)
+    return faiss.SearchParameters(sel=sel)
+
+
+def enable_reconstruct(index):
+    # IVF indexes need an id -> list map to return stored vectors (used by MMR)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index
+
+
+def write_index_config(folder_path, config):
+    path = os.path.join(folder_path, INDEX_CONFIG_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(config, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def read_index_config(folder_path) -> dict:
+    # Stores built before index types existed are flat
+    path = os.path.join(folder_path, INDEX_CONFIG_FILE)
+    if not os.path.exists(path):
+        return {"type": "flat", "params": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def index_vectors(index, config) -> np.ndarray:
+    # The stored vectors, or None when the index only keeps lossy codes (PQ)
+    if config.get("type", "flat") not in EXACT_INDEX_TYPES:
+        return None
+    return enable_reconstruct(index).reconstruct_n(0, index.ntotal)
+
+
+def index_bytes(index) -> int:
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def sample_queries(vectors: np.ndarray, n: int, seed=0) -> np.ndarray:
+    # Midpoints of random pairs of stored vectors: close to the data like real
+    # questions, without being stored vectors that every index finds trivially
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, len(vectors), size=(n, 2))
+    queries = (vectors[pairs[:, 0]] + vectors[pairs[:, 1]]) / 2
+    return np.ascontiguousarray(queries, dtype=np.float32)
+
+
+def knob_values(config):
+    # Search-time settings swept by the recall report
+    if config["type"] == "hnsw":
+        return "efSearch", [16, 32, 64, 128, 256, 512]
+    if config["type"] in ("ivf_flat", "ivf_pq"):
+        nlist = config["params"]["nlist"]
+        return "nprobe", sorted({min(nlist, value) for value in (1, 2, 4, 8, 16, 32, 64, 128)})
+    return None, [None]
+
+
+def recall_report(index, config, vectors: np.ndarray, k=10, queries=200, seed=0):
+    # recall@k against an exact flat search, query latency (one query per call,
+    # as the API searches) and index size, for each value of the search knob
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    query_vectors = sample_queries(vectors, queries, seed)
+    k = min(k, len(vectors))
+    _, truth = flat.search(query_vectors, k)
+
+    def run(target):
+        latencies, found = [], []
+        for vector in query_vectors:
+            start = time.perf_counter()
+            _, ids = target.search(vector[None, :], k)
+            latencies.append(time.perf_counter() - start)
+            found.append(ids[0])
+        recall = np.mean([len(set(row) & set(expected)) / k for row, expected in zip(found, truth)])
+        latencies.sort()
+        return {
+            "recall": round(float(recall), 4),
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 4),
+            "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 4),
+        }
+
+    rows = [{"type": "flat", "memory_mb": round(index_bytes(flat) / 2**20, 2), **run(flat)}]
+    if config["type"] != "flat":
+        knob, values = knob_values(config)
+        memory_mb = round(index_bytes(index) / 2**20, 2)
+        for value in values:
+            configure_index(index, config, **{"ef_search" if knob == "efSearch" else "nprobe": value})
+            rows.append({"type": config["type"], knob: value, "memory_mb": memory_mb, **run(index)})
+        configure_index(index, config)
+    return {"k": k, "queries": len(query_vectors), "vectors": len(vectors), "params": config["params"], "rows": rows}
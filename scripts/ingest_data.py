@@ -1,14 +1,38 @@
-import os, json
+import os, re, json, time, zlib, argparse
+from collections import deque, Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 
+# One splitter per process instead of one per file
+splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+
+# Worker processes used to parse PDFs in parallel (1 = parse in-process)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+
+# A line is boilerplate (running header/footer, page number, "Reprint" stamp)
+# when it sits among the first or last BOILERPLATE_EDGE_LINES lines of a page
+# and appears there, digits aside, on at least this fraction of a chapter's
+# pages. Odd and even pages carry different headers, so each is on about half
+# of them. Body text is never removed, however often it repeats.
+BOILERPLATE_PAGE_FRACTION = float(os.getenv("BOILERPLATE_PAGE_FRACTION", 0.4))
+BOILERPLATE_EDGE_LINES = int(os.getenv("BOILERPLATE_EDGE_LINES", 3))
+BOILERPLATE_MIN_PAGES = 3
+# Chunks whose estimated Jaccard similarity (5-word shingles) to an earlier
+# chunk of the same partition reaches this are dropped; 0 keeps every chunk
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", 0.9))
 
-def load_and_split_all(data_dir="data/"):
-    all_docs = []
+
+def list_pdf_files(data_dir="data/"):
+    # Returns (file_path, grade, subject, chapter) for every PDF, in a stable order
+    pdf_files = []
 
     for root, dirs, files in os.walk(data_dir):
-        for file in files:
+        dirs.sort()
+        for file in sorted(files):
             if file.endswith(".pdf"):
                 file_path = os.path.join(root, file)
 
@@ -23,29 +47,186 @@ def load_and_split_all(data_dir="data/"):
                     print(f"[WARNING] Skipping improperly structured path: {file_path}")
                     continue
 
-                print(f"[INFO] Processing → Grade {grade}, Subject {subject}, Chapter {chapter}")
+                pdf_files.append((file_path, grade, subject, chapter))
+
+    return pdf_files
+
+
+def _line_key(line):
+    # Page numbers and print dates differ from page to page; the text around them does not
+    return re.sub(r"\d+", "#", " ".join(line.lower().split()))
+
+
+def _edge_keys(lines, edge=BOILERPLATE_EDGE_LINES):
+    # {line position: key} for the first and last `edge` non-blank lines of a
+    # page. The key includes the distance from the top or bottom, so a page
+    # number is only compared with the page numbers of other pages.
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    keys = {i: ("top", n, _line_key(lines[i])) for n, i in enumerate(filled[:edge])}
+    if edge:
+        keys.update({i: ("bottom", n, _line_key(lines[i])) for n, i in enumerate(reversed(filled[-edge:]))})
+    return keys
+
+
+def strip_boilerplate(pages):
+    # Removes header/footer lines repeated across the pages of one PDF, in place;
+    # returns the bytes removed
+    if len(pages) < BOILERPLATE_MIN_PAGES:
+        return 0
+    page_lines = [page.page_content.splitlines() for page in pages]
+    edges = [_edge_keys(lines) for lines in page_lines]
+    counts = Counter(key for edge in edges for key in set(edge.values()))
+    min_pages = max(BOILERPLATE_MIN_PAGES, BOILERPLATE_PAGE_FRACTION * len(pages))
+    boilerplate = {key for key, count in counts.items() if key[2] and count >= min_pages}
+
+    removed = 0
+    for page, lines, edge in zip(pages, page_lines, edges):
+        kept = []
+        for i, line in enumerate(lines):
+            if i in edge and edge[i] in boilerplate:
+                removed += len(line.encode("utf-8")) + 1
+            else:
+                kept.append(line)
+        page.page_content = "\n".join(kept)
+    return removed
+
+
+class NearDuplicateFilter:
+    # MinHash signatures over 5-word shingles with LSH banding: texts sharing a
+    # band with an earlier text are compared on their full signatures, so each
+    # check is close to constant time however many texts were added.
+
+    PRIME = (1 << 31) - 1
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=128, bands=16, shingle=5, seed=0):
+        self.threshold = threshold
+        self.shingle = shingle
+        self.rows = num_perm // bands
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, self.PRIME, size=(num_perm, 1), dtype=np.int64)
+        self.b = rng.integers(0, self.PRIME, size=(num_perm, 1), dtype=np.int64)
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = []
+
+    def signature(self, text):
+        words = text.lower().split()
+        shingles = {" ".join(words[i:i + self.shingle]) for i in range(max(1, len(words) - self.shingle + 1))}
+        hashes = np.array([zlib.crc32(s.encode("utf-8")) % self.PRIME for s in shingles], dtype=np.int64)
+        return ((self.a * hashes + self.b) % self.PRIME).min(axis=1)
+
+    def is_duplicate(self, text):
+        # True for a near-duplicate of an added text; otherwise adds `text`
+        if self.threshold <= 0 or not text.strip():
+            return False
+        signature = self.signature(text)
+        bands = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(len(self.buckets))]
+        candidates = {other for band, bucket in zip(bands, self.buckets) for other in bucket.get(band, ())}
+        if any(np.mean(self.signatures[other] == signature) >= self.threshold for other in candidates):
+            return True
+        position = len(self.signatures)
+        self.signatures.append(signature)
+        for band, bucket in zip(bands, self.buckets):
+            bucket.setdefault(band, []).append(position)
+        return False
 
-                try:
-                    loader = PyPDFLoader(file_path)
-                    docs = loader.load()
-
-                    # Add metadata to each page
-                    for doc in docs:
-                        doc.metadata.update({
-                            "grade": grade,
-                            "subject": subject,
-                            "chapter": chapter
-                        })
-
-                    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-                    split_docs = splitter.split_documents(docs)
-                    all_docs.extend(split_docs)
-
-                except Exception as e:
-                    print(f"[ERROR] Failed to process {file_path}: {e}")
-    
-    return all_docs
+
+def drop_near_duplicates(docs, dedup):
+    # Returns (kept docs, bytes of the dropped ones)
+    kept, removed = [], 0
+    for doc in docs:
+        if dedup.is_duplicate(doc.page_content):
+            removed += len(doc.page_content.encode("utf-8"))
+        else:
+            kept.append(doc)
+    return kept, removed
+
+
+def load_and_split_file(file_path, grade, subject, chapter):
+    # Returns (chunks, bytes of boilerplate removed)
+    print(f"[INFO] Processing → Grade {grade}, Subject {subject}, Chapter {chapter}")
+
+    loader = PyPDFLoader(file_path)
+    docs = loader.load()
+    stripped = strip_boilerplate(docs)
+
+    # Add metadata to each page
+    for doc in docs:
+        doc.metadata.update({
+            "grade": grade,
+            "subject": subject,
+            "chapter": chapter
+        })
+
+    return splitter.split_documents(docs), stripped
+
+
+def _timed_load_and_split(pdf_file):
+    # Runs inside a worker process; returns (chunks or None on failure, seconds, bytes stripped)
+    start = time.perf_counter()
+    try:
+        docs, stripped = load_and_split_file(*pdf_file)
+    except Exception as e:
+        print(f"[ERROR] Failed to process {pdf_file[0]}: {e}")
+        docs, stripped = None, 0
+    return docs, time.perf_counter() - start, stripped
+
+
+def iter_split_files(pdf_files, workers=INGEST_WORKERS):
+    # Yields (pdf_file, chunks, seconds, bytes stripped) in the same order as pdf_files while
+    # parsing up to `workers` PDFs in parallel. Only a small window of parsed
+    # files is held in memory at any time.
+    if workers <= 1:
+        for pdf_file in pdf_files:
+            yield (pdf_file, *_timed_load_and_split(pdf_file))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for pdf_file in pdf_files:
+            pending.append((pdf_file, pool.submit(_timed_load_and_split, pdf_file)))
+            if len(pending) >= 2 * workers:
+                done_file, future = pending.popleft()
+                yield (done_file, *future.result())
+        while pending:
+            done_file, future = pending.popleft()
+            yield (done_file, *future.result())
+
+
+def print_ingest_report(rows):
+    # rows: (file_path, pages, chunks kept, seconds, boilerplate bytes, duplicate chunks, duplicate bytes); slowest files first
+    print(f"[INFO] Ingestion report ({len(rows)} files):")
+    print(f"{'seconds':>8} {'pages':>6} {'chunks':>7} {'stripped':>9} {'dup':>5} {'dup bytes':>9}  file")
+    for file_path, pages, chunks, seconds, stripped, duplicates, duplicate_bytes in sorted(rows, key=lambda row: -row[3]):
+        print(f"{seconds:8.2f} {pages:6d} {chunks:7d} {stripped:9d} {duplicates:5d} {duplicate_bytes:9d}  {file_path}")
+    totals = [sum(row[i] for row in rows) for i in range(1, 7)]
+    print(f"{totals[2]:8.2f} {totals[0]:6d} {totals[1]:7d} {totals[3]:9d} {totals[4]:5d} {totals[5]:9d}  total (cpu seconds)")
+
+
+def iter_split_all(data_dir="data/", workers=INGEST_WORKERS, report=True):
+    # Generator over every chunk of every PDF, in deterministic file order,
+    # without near-duplicates inside each (grade, subject)
+    rows = []
+    filters = {}
+    for pdf_file, docs, seconds, stripped in iter_split_files(list_pdf_files(data_dir), workers):
+        if docs is None:
+            continue
+        pages = len({doc.metadata.get("page") for doc in docs})
+        kept, duplicate_bytes = drop_near_duplicates(docs, filters.setdefault(pdf_file[1:3], NearDuplicateFilter()))
+        rows.append((pdf_file[0], pages, len(kept), seconds, stripped, len(docs) - len(kept), duplicate_bytes))
+        yield from kept
+    if report:
+        print_ingest_report(rows)
+
+
+def load_and_split_all(data_dir="data/", workers=INGEST_WORKERS):
+    return list(iter_split_all(data_dir, workers))
 
 if __name__ == "__main__":
-    docs = load_and_split_all("data/")
-    print(f"Total chunks created: {len(docs)}")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Parse and split all PDFs under the data directory.")
+    parser.add_argument("--data-dir", default="data/")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    total = sum(1 for _ in iter_split_all(args.data_dir, args.workers))
+    print(f"Total chunks created: {total} in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,119 @@
+import os, re, math
+from collections import Counter
+
+import numpy as np
+
+LEXICAL_INDEX_FILE = "bm25.npz"
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from how in is it its of on or that the this
+to was what when where which who why will with explain define describe tell me about
+""".split())
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    # Okapi BM25 over the chunks of one partition. Document numbers are the
+    # FAISS ids of the same partition, so results can be fused with vector hits.
+    # Postings are kept as flat numpy arrays: the postings of term t are
+    # doc_ids[offsets[t]:offsets[t + 1]] with matching term frequencies in tfs.
+
+    def __init__(self, terms, offsets, doc_ids, tfs, doc_lengths, k1=1.2, b=0.75):
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, texts):
+        postings = {}
+        doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(postings[term])
+        flat = [posting for term in terms for posting in postings[term]]
+        doc_ids = np.array([doc_id for doc_id, _ in flat], dtype=np.int32)
+        tfs = np.array([tf for _, tf in flat], dtype=np.float32)
+        return cls(terms, offsets, doc_ids, tfs, np.array(doc_lengths, dtype=np.float32))
+
+    def save(self, folder_path):
+        terms = sorted(self.term_ids, key=self.term_ids.get)
+        np.savez(
+            os.path.join(folder_path, LEXICAL_INDEX_FILE),
+            terms=np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+            offsets=self.offsets, doc_ids=self.doc_ids, tfs=self.tfs, doc_lengths=self.doc_lengths,
+        )
+
+    @classmethod
+    def load(cls, folder_path):
+        path = os.path.join(folder_path, LEXICAL_INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            terms = data["terms"].tobytes().decode("utf-8").split("\n") if data["terms"].size else []
+            return cls(terms, data["offsets"], data["doc_ids"], data["tfs"], data["doc_lengths"])
+
+    def idf(self, term):
+        # 0 for terms absent from the partition
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return 0.0
+        df = self.offsets[term_id + 1] - self.offsets[term_id]
+        return math.log(1 + (len(self.doc_lengths) - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k, id_ranges=None):
+        # Returns ([(doc_id, score)] best first, fraction of query terms found in the index);
+        # id_ranges: [start, end) doc id ranges to search, e.g. chapters, else all
+        terms = set(tokenize(query))
+        if not terms or not len(self.doc_lengths):
+            return [], 0.0
+
+        n_docs = len(self.doc_lengths)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        found = 0
+        for term in terms:
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            found += 1
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs, tfs = self.doc_ids[start:end], self.tfs[start:end]
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avg_length)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+        if id_ranges is not None:
+            inside = np.zeros(n_docs, dtype=bool)
+            for start, end in id_ranges:
+                inside[start:end] = True
+            scores[~inside] = 0
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return [], found / len(terms)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in top], found / len(terms)
+
+
+def reciprocal_rank_fusion(rankings, k, c=60):
+    # rankings: lists of doc ids, best first; returns the k best fused doc ids
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (c + rank + 1)
+    return sorted(fused, key=lambda doc_id: -fused[doc_id])[:k]
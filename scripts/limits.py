@@ -0,0 +1,49 @@
+import os, asyncio
+from contextlib import asynccontextmanager
+
+# Upper bounds on concurrent upstream calls made by one server process
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 64))
+QUERY_EMBEDDING_CONCURRENCY = int(os.getenv("QUERY_EMBEDDING_CONCURRENCY", 32))
+
+
+class ConcurrencyLimit:
+    # asyncio semaphore that also keeps count of callers waiting for and holding a slot
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.completed += 1
+            self.semaphore.release()
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+        }
+
+
+llm_limit = ConcurrencyLimit("llm", LLM_CONCURRENCY)
+embedding_limit = ConcurrencyLimit("embedding", QUERY_EMBEDDING_CONCURRENCY)
+
+
+def queue_stats():
+    return {limit.name: limit.stats() for limit in (llm_limit, embedding_limit)}
@@ -0,0 +1,66 @@
+import os, sys, json, time, random, logging
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line, for log shippers) or "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Fraction of per-request records below WARNING that are written; warnings and
+# errors are always kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = " ".join(f"{key}={value}" for key, value in getattr(record, "fields", {}).items())
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} [{record.levelname}] {record.name}: {record.getMessage()} {fields}".rstrip()
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class SampleFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+def _configure():
+    root = logging.getLogger("tutor")
+    if root.handlers:
+        return root
+    # stderr, so that scripts printing results to stdout (benchmarks) stay parseable
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    # Per-request records go through the sampler
+    logging.getLogger("tutor.requests").addFilter(SampleFilter(LOG_SAMPLE_RATE))
+    return root
+
+
+def get_logger(name):
+    _configure()
+    return logging.getLogger(f"tutor.{name}")
+
+
+def log(logger, level, event, exc_info=False, **fields):
+    # Structured record: `event` is a short constant message, details go in fields
+    if logger.isEnabledFor(level):
+        logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
@@ -0,0 +1,176 @@
+import os, time, logging
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import Counter, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+
+from scripts.conversation import count_tokens
+from scripts.logs import get_logger, log
+
+request_log = get_logger("requests")
+
+LABELS = ["endpoint", "grade", "subject"]
+# Stages run from ~0.1 ms (BM25, FAISS) to tens of seconds (long generations)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_SECONDS = Histogram("tutor_request_seconds", "End-to-end request latency", LABELS + ["outcome"], buckets=STAGE_BUCKETS)
+STAGE_SECONDS = Histogram("tutor_stage_seconds", "Latency of one request stage", LABELS + ["stage"], buckets=STAGE_BUCKETS)
+REQUESTS = Counter("tutor_requests_total", "Requests by outcome", LABELS + ["outcome"])
+TOKENS = Counter("tutor_llm_tokens_total", "Prompt and completion tokens sent to and received from the LLM", LABELS + ["kind"])
+CONTEXT_TOKENS_SAVED = Counter("tutor_context_tokens_saved_total", "Prompt tokens removed from the retrieved context by compression", LABELS)
+# Leaders run the upstream computation; followers wait for an identical request already in flight
+FLIGHTS = Counter("tutor_single_flight_requests_total", "Requests per coalescing group by role", ["flight", "role"])
+
+# grade / subject label values come from the request body; only the partitions
+# of the vector store become series, everything else is counted as "unknown".
+# The pipeline sets the source, read on first use.
+_partitions = {"source": None, "known": None}
+
+
+def set_partition_source(source):
+    # `source()` returns the (grade, subject) pairs of the vector store
+    _partitions.update(source=source, known=None)
+
+
+def partition_labels(grade, subject):
+    if _partitions["known"] is None:
+        source = _partitions["source"]
+        _partitions["known"] = frozenset(source()) if source is not None else frozenset()
+    key = (str(grade), str(subject).lower())
+    return key if key in _partitions["known"] else ("unknown", "unknown")
+
+
+class Trace:
+    # Per-request timing spans and token counts. Stages are recorded into the
+    # Prometheus histograms as they finish and kept for the request log line.
+
+    def __init__(self, endpoint, grade="", subject=""):
+        # The log line keeps the requested values
+        self.request = {"grade": str(grade), "subject": str(subject).lower()}
+        label_grade, label_subject = partition_labels(grade, subject)
+        self.labels = {"endpoint": endpoint, "grade": label_grade, "subject": label_subject}
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.tokens = {"prompt": 0, "completion": 0}
+        # Request details for the log line, e.g. retrieval path, cache hit, error
+        self.notes = {}
+        self.outcome = None
+
+    def record(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_SECONDS.labels(**self.labels, stage=stage).observe(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def add_tokens(self, kind, count):
+        self.tokens[kind] += count
+        TOKENS.labels(**self.labels, kind=kind).inc(count)
+
+    def finish(self, outcome=None):
+        # Records the request once (later calls do nothing) and writes its log line.
+        # The outcome defaults to error / cached / coalesced / ok from the notes.
+        if self.outcome is None:
+            if outcome is None:
+                if "error" in self.notes:
+                    outcome = "error"
+                elif self.notes.get("answer_cache") == "hit":
+                    outcome = "cached"
+                elif self.notes.get("coalesced"):
+                    outcome = "coalesced"
+                else:
+                    outcome = "ok"
+            self.outcome = outcome
+            seconds = time.perf_counter() - self.start
+            REQUEST_SECONDS.labels(**self.labels, outcome=outcome).observe(seconds)
+            REQUESTS.labels(**self.labels, outcome=outcome).inc()
+            log(request_log, logging.WARNING if outcome == "error" else logging.INFO, "request", **self.fields())
+        return self
+
+    def fields(self):
+        # Milliseconds per stage plus token counts, for the structured request log
+        return {
+            **self.labels,
+            **self.request,
+            "outcome": self.outcome,
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 2),
+            **{f"{stage}_ms": round(seconds * 1000, 2) for stage, seconds in self.stages.items()},
+            "prompt_tokens": self.tokens["prompt"],
+            "completion_tokens": self.tokens["completion"],
+            **self.notes,
+        }
+
+
+@contextmanager
+def request_trace(trace, endpoint, grade, subject):
+    # Yields the caller's trace, or opens one (finished on exit) for direct calls
+    if trace is not None:
+        yield trace
+        return
+    trace = Trace(endpoint, grade, subject)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+
+
+class LLMUsage(BaseCallbackHandler):
+    # Splits the LLM call of a chain into prompt assembly and generation, and
+    # counts prompt and completion tokens with the model's tokenizer
+    run_inline = True
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
+        # Prompt assembly starts here, or where retrieval ends when the chain retrieves
+        self.prompt_start = time.perf_counter()
+        self.retriever_start = None
+        self.model_start = None
+        self.first_token = None
+
+    def on_retriever_start(self, serialized, query, **kwargs):
+        self.retriever_start = time.perf_counter()
+
+    def on_retriever_end(self, documents, **kwargs):
+        self.prompt_start = time.perf_counter()
+        if self.retriever_start is not None:
+            self.trace.record("retrieve", self.prompt_start - self.retriever_start)
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.model_start = time.perf_counter()
+        self.trace.record("prompt", self.model_start - self.prompt_start)
+        self.trace.add_tokens("prompt", sum(count_tokens(str(m.content)) for batch in messages for m in batch))
+
+    def on_custom_event(self, name, data, **kwargs):
+        # Sent by scripts.context before the prompt is assembled
+        if name == "context_compressed":
+            saved = data["tokens_before"] - data["tokens_after"]
+            self.trace.notes["context_tokens"] = data["tokens_after"]
+            self.trace.notes["context_tokens_saved"] = self.trace.notes.get("context_tokens_saved", 0) + saved
+            CONTEXT_TOKENS_SAVED.labels(**self.trace.labels).inc(saved)
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.first_token is None and token:
+            self.first_token = time.perf_counter()
+            self.trace.record("first_token", self.first_token - self.model_start)
+
+    def on_llm_end(self, response, **kwargs):
+        if self.model_start is not None:
+            self.trace.record("generate", time.perf_counter() - self.model_start)
+        text = "".join(generation.text for generations in response.generations for generation in generations)
+        self.trace.add_tokens("completion", count_tokens(text))
+
+
+def metrics_response_body():
+    # With several workers, PROMETHEUS_MULTIPROC_DIR makes every process write its
+    # samples there and each scrape aggregates all of them
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
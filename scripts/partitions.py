@@ -0,0 +1,36 @@
+import json, os
+
+# Layout of the partitioned vector store:
+#   vector_store/partitions.json           -> one entry per (grade, subject)
+#   vector_store/<partition name>/         -> FAISS sub-index, chunk store, BM25 index and chapter routing table for that partition
+# Chunks inside a partition are stored grouped by chapter, so every chapter
+# owns a contiguous [start, end) range of FAISS ids.
+PARTITIONS_FILE = "partitions.json"
+
+
+def partition_name(grade, subject):
+    return f"grade_{grade}_{subject.lower()}"
+
+
+def chapter_ranges(docs):
+    # docs must already be grouped by chapter
+    ranges = {}
+    for pos, doc in enumerate(docs):
+        chapter = doc.metadata["chapter"]
+        start, _ = ranges.get(chapter, (pos, pos))
+        ranges[chapter] = (start, pos + 1)
+    return {chapter: list(bounds) for chapter, bounds in ranges.items()}
+
+
+def save_partitions(store_dir, partitions):
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, PARTITIONS_FILE), "w") as f:
+        json.dump(partitions, f, indent=2, sort_keys=True)
+
+
+def load_partitions(store_dir):
+    path = os.path.join(store_dir, PARTITIONS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
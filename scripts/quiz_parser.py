@@ -0,0 +1,89 @@
+import re
+
+from scripts.quiz_pool import valid_questions
+
+# Line patterns of the quiz format in QUIZ_TEMPLATE, with the variations models
+# produce: "Q1." / "Q1:" / "Question 1)" / "1.", "A." / "A)" / "(A)", and
+# "Answer: B" / "Correct answer - (B)". Markdown bold is removed beforehand.
+# A bare number or letter only starts a question or option when followed by a
+# space, so wrapped lines such as "9.8 m/s^2 ..." or "A.C. supply ..." continue
+# the text before them.
+QUESTION_LINE = re.compile(r"^(?:Q(?:uestion)?\s*\d+\s*[.):]|\d+[.)](?!\d)(?=\s|$))\s*(.*)$", re.IGNORECASE)
+OPTION_LINE = re.compile(r"^\(?([A-D])[.)](?=\s|$)\s*(.*)$")
+ANSWER_LINE = re.compile(r"^(?:Correct\s+)?Answer\s*[:\-]?\s*\(?([A-D])\b", re.IGNORECASE)
+
+
+class QuizStreamParser:
+    # Incremental parser over the generated quiz text. `feed` takes text in any
+    # pieces (e.g. LLM tokens) and returns the questions completed by it: a
+    # question is complete when its Answer line ends, and is returned only if
+    # valid (text, options A-D, answer among them). A question cut short by the
+    # next question header, or invalid, is dropped and counted in `dropped`.
+
+    def __init__(self):
+        self.buffer = ""
+        self.current = None   # {"question": [lines], "options": {letter: [lines]}, "answer": ""}
+        self.field = None     # "question" or the option letter continuation lines belong to
+        self.emitted = 0
+        self.dropped = 0
+
+    def feed(self, text: str) -> list[dict]:
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split("\n")
+        return [question for line in lines for question in self._line(line)]
+
+    def close(self) -> list[dict]:
+        # End of the text: the last line has no newline after it
+        questions = self._line(self.buffer)
+        self.buffer = ""
+        if self.current is not None:
+            self.dropped += 1
+            self.current = None
+        return questions
+
+    def _line(self, line: str) -> list[dict]:
+        line = line.replace("**", "").strip()
+        if not line:
+            return []
+
+        match = ANSWER_LINE.match(line)
+        if match:
+            if self.current is None:
+                return []
+            self.current["answer"] = match.group(1).upper()
+            return self._finish()
+
+        match = QUESTION_LINE.match(line)
+        if match:
+            if self.current is not None:
+                self.dropped += 1
+            self.current = {"question": [match.group(1)], "options": {}, "answer": ""}
+            self.field = "question"
+            return []
+
+        if self.current is None:
+            # Text before the first question, e.g. a refusal or a heading
+            return []
+        match = OPTION_LINE.match(line)
+        if match:
+            self.field = match.group(1)
+            self.current["options"][self.field] = [match.group(2)]
+        elif self.field == "question":
+            self.current["question"].append(line)
+        else:
+            self.current["options"][self.field].append(line)
+        return []
+
+    def _finish(self) -> list[dict]:
+        current, self.current = self.current, None
+        question = {
+            "question": " ".join(current["question"]).strip(),
+            "options": {key: " ".join(lines).strip() for key, lines in sorted(current["options"].items())},
+            "answer": current["answer"],
+        }
+        if not valid_questions([question]):
+            self.dropped += 1
+            return []
+        self.emitted += 1
+        return [question]
+
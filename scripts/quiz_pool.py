@@ -0,0 +1,156 @@
+import os, json, asyncio, logging, itertools
+from collections import deque
+
+from scripts.logs import get_logger, log
+
+logger = get_logger("quiz_pool")
+
+TOPIC_FILE = "data/topics.json"
+
+# Quizzes kept ready per chapter; a refill starts once a pool drops below the low watermark
+QUIZ_POOL_SIZE = int(os.getenv("QUIZ_POOL_SIZE", 2))
+QUIZ_POOL_LOW_WATERMARK = int(os.getenv("QUIZ_POOL_LOW_WATERMARK", 1))
+QUIZ_POOL_WORKERS = int(os.getenv("QUIZ_POOL_WORKERS", 4))
+# Fill every chapter's pool in the background at startup, so the first student
+# on a chapter does not wait for a generation. Each server worker process has
+# its own pool, so this costs QUIZ_POOL_SIZE LLM calls per chapter per worker
+# on every start; at most QUIZ_POOL_WORKERS of them run at a time, each holding
+# an LLM slot, and refills for requested chapters go first. Set to 0 to fill a
+# pool only after its first request.
+QUIZ_POOL_WARM = os.getenv("QUIZ_POOL_WARM", "1") == "1"
+# A generation with fewer valid questions than this is rejected
+QUIZ_MIN_QUESTIONS = int(os.getenv("QUIZ_MIN_QUESTIONS", 3))
+
+
+def load_topic_keys(topic_file=TOPIC_FILE):
+    # (grade, subject, chapter) for every entry of data/topics.json
+    if not os.path.exists(topic_file):
+        return []
+    with open(topic_file, "r") as f:
+        raw = json.load(f)
+    keys = []
+    for key, chapters in raw.items():
+        grade, subject = json.loads(key)
+        keys.extend((grade, subject, chapter) for chapter in chapters)
+    return keys
+
+
+def valid_questions(quiz):
+    # Keeps questions with text, options A-D and an answer that is one of them
+    if not isinstance(quiz, list):
+        return []
+    return [
+        q for q in quiz
+        if isinstance(q, dict)
+        and q.get("question", "").strip()
+        and sorted(q.get("options", {})) == ["A", "B", "C", "D"]
+        and all(str(v).strip() for v in q["options"].values())
+        and q.get("answer") in q["options"]
+    ]
+
+
+class QuizPool:
+    # Per-chapter pools of parsed, validated quizzes, refilled by background asyncio workers.
+    # `generate(grade, subject, topic)` is an async function returning raw quiz text and
+    # `parse(text)` turns it into a list of question dicts. Only the chapters
+    # passed to start() are pooled; with `warm` all are filled at start,
+    # otherwise a pool is filled after its first request.
+
+    def __init__(self, generate, parse, size=QUIZ_POOL_SIZE, low_watermark=QUIZ_POOL_LOW_WATERMARK,
+                 workers=QUIZ_POOL_WORKERS, min_questions=QUIZ_MIN_QUESTIONS):
+        self.generate = generate
+        self.parse = parse
+        self.size = size
+        self.low_watermark = low_watermark
+        self.workers = workers
+        self.min_questions = min_questions
+        self.pools = {}
+        self.known = set()
+        self.scheduled = {}  # key -> priority of its pending refill
+        self.queue = None
+        self._order = itertools.count()
+        self.tasks = []
+        self.served = 0
+        self.empty = 0
+        self.generated = 0
+        self.rejected = 0
+
+    def start(self, keys, warm=QUIZ_POOL_WARM):
+        # Must be called from the running event loop (server startup)
+        self.known = set(keys)
+        self.queue = asyncio.PriorityQueue()
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if warm:
+            for key in keys:
+                self._schedule(key, self.WARM)
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    # Refill priorities: chapters students asked for before the startup warm-up
+    REQUESTED, WARM = 0, 1
+
+    def _schedule(self, key, priority=REQUESTED):
+        # A requested chapter still waiting in the warm-up queue is queued again
+        # ahead of it; the later entry finds the pool full and returns
+        if self.queue is not None and key in self.known and priority < self.scheduled.get(key, priority + 1):
+            self.scheduled[key] = priority
+            self.queue.put_nowait((priority, next(self._order), key))
+
+    async def _worker(self):
+        while True:
+            _, _, key = await self.queue.get()
+            try:
+                await self._refill(key)
+            except Exception as e:
+                log(logger, logging.ERROR, "quiz_pool_refill_failed", key=key, error=str(e))
+            finally:
+                self.scheduled.pop(key, None)
+
+    async def _refill(self, key):
+        # Gives up on a chapter after `size` rejected generations in a row
+        failures = 0
+        pool = self.pools.setdefault(key, deque())
+        while len(pool) < self.size and failures < self.size:
+            quiz = self.validate(self.parse(await self.generate(*key)))
+            if quiz is None:
+                failures += 1
+                continue
+            failures = 0
+            pool.append(quiz)
+
+    def validate(self, quiz):
+        questions = valid_questions(quiz)
+        self.generated += 1
+        if len(questions) < self.min_questions:
+            self.rejected += 1
+            return None
+        return questions
+
+    def pop(self, key):
+        # Returns a ready quiz (or None) and, for a known chapter, schedules a
+        # refill when running low
+        pool = self.pools.get(key)
+        quiz = pool.popleft() if pool else None
+        if quiz is None:
+            self.empty += 1
+        else:
+            self.served += 1
+        if len(pool or ()) < self.low_watermark:
+            self._schedule(key)
+        return quiz
+
+    def stats(self):
+        return {
+            "chapters": len(self.known),
+            "filled": len(self.pools),
+            "ready": sum(len(pool) for pool in self.pools.values()),
+            "refills_pending": len(self.scheduled),
+            "served": self.served,
+            "empty": self.empty,
+            "generated": self.generated,
+            "rejected": self.rejected,
+        }
@@ -1,64 +1,355 @@
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
 
 
-from fastapi.responses import JSONResponse
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains.retrieval import create_retrieval_chain
 from langchain_core.runnables import RunnableSequence 
-
-
-import re, pprint, os
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+
+from scripts.partitions import partition_name, load_partitions
+from scripts.limits import llm_limit, embedding_limit
+from scripts.answer_cache import SemanticAnswerCache, history_digest
+from scripts.conversation import ConversationStore, budget_history, get_encoding
+from scripts.lexical_index import BM25Index, reciprocal_rank_fusion
+from scripts.embedding_cache import CachingQueryEmbeddings, normalize_query
+from scripts.chunk_store import ChunkStore, load_partition_store
+from scripts.index_types import configure_index, enable_reconstruct, read_index_config, search_parameters
+from scripts.context import context_compressor, mmr, MMR_FETCH_K
+from scripts.routing import ChapterRouter, Route, ROUTING_TOP_CHAPTERS
+from scripts.serving import configure_faiss_threads, faiss_read_flags
+from scripts.metrics import LLMUsage, request_trace, set_partition_source
+from scripts.single_flight import SingleFlight
+from scripts.quiz_parser import QuizStreamParser
+from scripts.logs import get_logger, log
+
+
+import os, time, asyncio, logging, threading
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import faiss
+import numpy as np
+from typing import Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
 load_dotenv()
 
-# print all environment variables for debugging
-print("Environment Variables:")
-for key, value in os.environ.items():
-    print(f"{key}: {value}")
+logger = get_logger("rag_pipeline")
+# Per-request records, subject to LOG_SAMPLE_RATE
+request_log = get_logger("requests")
 
-# Ensure the necessary environment variables are set
-if not all(key in os.environ for key in ["OPENAI_API_KEY"]):
-    raise ValueError("Missing required environment variables: OPENAI_API_KEY")
+# Importing this module does no I/O: clients and indexes are created on first
+# use through the get_* accessors below, or all at once by warmup() at startup.
 
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-vectorstore = FAISS.load_local("vector_store", embeddings, allow_dangerous_deserialization=True)
-retriever = vectorstore.as_retriever()
 
-def get_rag_response(query: str, grade: str, subject: str, history=None):
-    try:
-        print(f"[QUERY] Grade: {grade}, Subject: {subject}, Question: {query}")
-
-        # Setup retriever with metadata filters
-        retriever = vectorstore.as_retriever(
-            search_kwargs={
-                "k": 4,
-                "filter": {
-                    "grade": grade,
-                    "subject": subject.lower(),
-                }
-            }
+class Lazy:
+    # Zero-argument accessor whose value is built once, on first call, even when
+    # several threads ask for it at the same time
+
+    def __init__(self, build):
+        self.build = build
+        self.value = None
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        if self.value is None:
+            with self.lock:
+                if self.value is None:
+                    self.value = self.build()
+        return self.value
+
+    def loaded(self):
+        return self.value is not None
+
+
+def require_openai_key():
+    if "OPENAI_API_KEY" not in os.environ:
+        raise ValueError("Missing required environment variables: OPENAI_API_KEY")
+
+
+# One pooled HTTP client pair shared by every chain, so requests reuse
+# keep-alive TLS connections instead of opening new ones
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+
+
+def build_llm():
+    require_openai_key()
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model="gpt-4o-mini",
+        temperature=0,
+        http_client=httpx.Client(limits=HTTP_POOL_LIMITS),
+        http_async_client=httpx.AsyncClient(limits=HTTP_POOL_LIMITS),
+    )
+
+
+def build_embeddings():
+    require_openai_key()
+    from langchain_openai import OpenAIEmbeddings
+    # Repeated and templated queries are answered from an in-process LRU of query vectors
+    return CachingQueryEmbeddings(OpenAIEmbeddings(model="text-embedding-3-small"))
+
+
+get_llm = Lazy(build_llm)
+get_embeddings = Lazy(build_embeddings)
+
+STORE_DIR = "vector_store"
+
+Partition = namedtuple("Partition", ["vectorstore", "chapters", "lexical", "router"])
+
+
+def load_vectorstores(store_dir=STORE_DIR):
+    # One FAISS sub-index (plus its BM25 index and chapter routing table) per
+    # (grade, subject), see scripts/build_vector_store.py
+    configure_faiss_threads()
+    stores = {}
+    for name, info in load_partitions(store_dir).items():
+        path = os.path.join(store_dir, name)
+        # Only the index is read here, memory-mapped when FAISS_MMAP is set;
+        # chunk text stays on disk until a query needs it
+        vectorstore = load_partition_store(path, get_embeddings(), faiss_read_flags())
+        # efSearch / nprobe from index.json, or FAISS_EF_SEARCH / FAISS_NPROBE
+        configure_index(vectorstore.index, read_index_config(path))
+        enable_reconstruct(vectorstore.index)
+        stores[(info["grade"], info["subject"])] = Partition(
+            vectorstore, info["chapters"], BM25Index.load(path), ChapterRouter.load(path),
         )
+    return stores
+
+get_vectorstores = Lazy(load_vectorstores)
+# Metric labels are limited to the partitions of the store
+set_partition_source(lambda: [(info["grade"], info["subject"]) for info in load_partitions(STORE_DIR).values()])
+
 
-        # Use updated LLM import (langchain-openai)
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+# Startup work, run concurrently; each phase is timed for /readyz
+WARMUP_PHASES = {
+    "vectorstores": get_vectorstores,
+    "llm": get_llm,
+    "embeddings": get_embeddings,
+    "tokenizer": get_encoding,
+}
+warmup_state = {"ready": False, "phases": {}, "seconds": None, "error": None}
+_warmup_lock = threading.Lock()
 
-        # Format conversation history for prompt
-        history_text = ""
-        if history:
-            for turn in history:
-                if turn["role"] == "user":
-                    history_text += f"User: {turn['content']}\n"
-                elif turn["role"] == "assistant":
-                    history_text += f"Tutor: {turn['content']}\n"
 
+def _run_phase(name, load):
+    start = time.perf_counter()
+    load()
+    warmup_state["phases"][name] = round(time.perf_counter() - start, 3)
 
-        # Define prompt with placeholders
-        prompt = PromptTemplate.from_template("""
+
+def warmup():
+    # Loads everything the request path needs; later calls return immediately
+    # and a failed warmup is retried by the next caller
+    with _warmup_lock:
+        if warmup_state["ready"]:
+            return
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=len(WARMUP_PHASES)) as pool:
+                list(pool.map(lambda phase: _run_phase(*phase), WARMUP_PHASES.items()))
+        except Exception as e:
+            warmup_state["error"] = str(e)
+            raise
+        warmup_state.update(ready=True, error=None, seconds=round(time.perf_counter() - start, 3))
+        log(logger, logging.INFO, "warmup_finished", seconds=warmup_state["seconds"], phases=warmup_state["phases"])
+        if not get_vectorstores.value:
+            log(logger, logging.WARNING, "no_partitions", store_dir=STORE_DIR)
+
+
+async def ensure_warm():
+    if not warmup_state["ready"]:
+        await asyncio.to_thread(warmup)
+
+
+def readiness():
+    # Without partitions (missing or empty partitions.json) every question would
+    # fail, so the process is not ready even though the warmup finished
+    partitions = len(get_vectorstores.value or {})
+    error = warmup_state["error"]
+    if warmup_state["ready"] and not partitions:
+        error = f"No vector store partitions in {STORE_DIR}/, run scripts/build_vector_store.py"
+    return {
+        "ready": warmup_state["ready"] and partitions > 0,
+        "index_loaded": partitions > 0,
+        "partitions": partitions,
+        "phases": dict(warmup_state["phases"]),
+        "warmup_seconds": warmup_state["seconds"],
+        "error": error,
+    }
+
+# Near-identical questions in the same class get the stored answer back
+answer_cache = SemanticAnswerCache()
+# Identical questions (or quiz requests) that arrive while one is being answered
+# wait for that answer instead of calling the LLM again
+ask_flight = SingleFlight("ask")
+quiz_flight = SingleFlight("quiz")
+
+# Candidates taken from each of the dense and lexical rankings before fusion
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", 20))
+# Skip the embedding call when BM25 matched every query term and its best hit
+# scores at least this many times the runner-up (0 disables the fast path).
+# Tuned with benchmarks/hybrid_retrieval.py --margins on the labelled questions:
+# at 1.2 a third of them take the fast path, all with the answer in the top 4
+LEXICAL_FASTPATH_MARGIN = float(os.getenv("LEXICAL_FASTPATH_MARGIN", 1.2))
+
+
+IdRanges = Optional[List[Tuple[int, int]]]
+
+
+def search_partition_ids(vectorstore: FAISS, embedding: List[float], k: int, id_ranges: IdRanges = None) -> List[int]:
+    return search_partition_ids_batch(vectorstore, [embedding], k, id_ranges)[0]
+
+
+def search_partition_ids_batch(vectorstore: FAISS, embeddings: List[List[float]], k: int, id_ranges: IdRanges = None) -> List[List[int]]:
+    # One FAISS call for all query vectors; returns the ids per query.
+    # id_ranges: [start, end) id ranges to search (chapters), else the whole partition
+    vectors = np.array(embeddings, dtype=np.float32)
+    if vectorstore._normalize_L2:
+        faiss.normalize_L2(vectors)
+
+    k = min(k, vectorstore.index.ntotal)
+    if id_ranges is not None:
+        k = min(k, sum(end - start for start, end in id_ranges))
+    if k <= 0 or not len(vectors):
+        return [[] for _ in embeddings]
+
+    params = None
+    if id_ranges is not None:
+        # Chapters own contiguous id ranges, so a flat index only scans the
+        # slice of a single chapter; HNSW and IVF indexes, and several
+        # chapters, skip the other ids while searching
+        if len(id_ranges) == 1:
+            selector = faiss.IDSelectorRange(*id_ranges[0])
+        else:
+            selector = faiss.IDSelectorBatch(np.concatenate([np.arange(start, end, dtype=np.int64) for start, end in id_ranges]))
+        params = search_parameters(vectorstore.index, selector)
+
+    _, indices = vectorstore.index.search(vectors, k, params=params)
+    return [[int(i) for i in row if i != -1] for row in indices]
+
+
+def partition_docs(vectorstore: FAISS, ids: List[int]) -> List[Document]:
+    if isinstance(vectorstore.docstore, ChunkStore):
+        return vectorstore.docstore.by_position(ids)
+    return [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]) for i in ids]
+
+
+def search_partition(vectorstore: FAISS, embedding: List[float], k: int, id_ranges: IdRanges = None) -> List[Document]:
+    return partition_docs(vectorstore, search_partition_ids(vectorstore, embedding, k, id_ranges))
+
+
+def mmr_select(vectorstore: FAISS, ids: List[int], k: int) -> List[int]:
+    # k of the ranked candidates, skipping near-copies of better ranked ones,
+    # compared on the vectors stored in the index
+    if len(ids) <= k:
+        return ids
+    vectors = vectorstore.index.reconstruct_batch(np.array(ids, dtype=np.int64))
+    return [ids[i] for i in mmr(vectors, k)]
+
+
+class PartitionRetriever(BaseRetriever):
+    vectorstore: FAISS
+    lexical: Optional[BM25Index] = None
+    k: int = 4
+    id_range: Optional[Tuple[int, int]] = None
+    # Chapter routing for questions that name no chapter
+    router: Optional[ChapterRouter] = None
+    chapters: Dict[str, List[int]] = {}
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        docs = self.lexical_fast_path(query)
+        if docs is None:
+            embedding = self.vectorstore.embeddings.embed_query(query)
+            docs = self.search_vector(embedding, query, self.route([embedding])[0])
+        return docs
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        docs = self.lexical_fast_path(query)
+        if docs is None:
+            embedding = await self.aembed_query(query)
+            docs = self.search_vector(embedding, query, self.route([embedding])[0])
+        return docs
+
+    async def aembed_query(self, query: str) -> List[float]:
+        async with embedding_limit.slot():
+            return await self.vectorstore.embeddings.aembed_query(query)
+
+    def lexical_fast_path(self, query: str) -> Optional[List[Document]]:
+        # Returns the BM25 top-k when lexical evidence alone is conclusive, else None
+        if self.lexical is None or LEXICAL_FASTPATH_MARGIN <= 0:
+            return None
+        hits, coverage = self.lexical.search(query, max(self.k, 2), self.id_ranges())
+        if coverage < 1.0 or len(hits) < min(self.k, 2):
+            return None
+        if len(hits) > 1 and hits[0][1] < LEXICAL_FASTPATH_MARGIN * hits[1][1]:
+            return None
+        return partition_docs(self.vectorstore, [doc_id for doc_id, _ in hits[:self.k]])
+
+    def route(self, embeddings: List[List[float]], top: int = ROUTING_TOP_CHAPTERS) -> List[Optional[Route]]:
+        # The chapters to search for each query vector, scored in one matrix
+        # product; None searches every chapter (no routing table, a chapter
+        # already chosen, or no more chapters than `top`)
+        if self.router is None or self.id_range is not None or top <= 0 or len(self.chapters) <= top:
+            return [None] * len(embeddings)
+        return self.router.route(embeddings, top)
+
+    def id_ranges(self, route: Optional[Route] = None) -> IdRanges:
+        if route is not None:
+            return [tuple(self.chapters[chapter]) for chapter in route.chapters if chapter in self.chapters]
+        return [self.id_range] if self.id_range is not None else None
+
+    def search_vector(self, embedding: List[float], query: Optional[str] = None, route: Optional[Route] = None) -> List[Document]:
+        # Dense search, fused with BM25 by reciprocal rank when the query text is given,
+        # then MMR over the top MMR_FETCH_K candidates so that overlapping chunks
+        # do not fill the context. With a route, only its chapters are searched.
+        # A flat search over one partition takes well under a millisecond.
+        return self.search_vectors([embedding], [query], [route])[0]
+
+    def search_vectors(self, embeddings: List[List[float]], queries: List[Optional[str]],
+                       routes: Optional[List[Optional[Route]]] = None) -> List[List[Document]]:
+        # search_vector for many queries, with one vectorised FAISS search per set of routed chapters
+        routes = routes or [None] * len(embeddings)
+        groups = {}
+        for i, route in enumerate(routes):
+            groups.setdefault(tuple(sorted(route.chapters)) if route is not None else None, []).append(i)
+
+        fetch_k = max(self.k, MMR_FETCH_K)
+        results = [None] * len(embeddings)
+        for group in groups.values():
+            id_ranges = self.id_ranges(routes[group[0]])
+            dense = search_partition_ids_batch(
+                self.vectorstore, [embeddings[i] for i in group], max(fetch_k, HYBRID_FETCH_K), id_ranges,
+            )
+            for i, ids in zip(group, dense):
+                if self.lexical is not None and queries[i]:
+                    lexical, _ = self.lexical.search(queries[i], HYBRID_FETCH_K, id_ranges)
+                    ids = reciprocal_rank_fusion([ids, [doc_id for doc_id, _ in lexical]], fetch_k)
+                results[i] = partition_docs(self.vectorstore, mmr_select(self.vectorstore, ids[:fetch_k], self.k))
+        return results
+
+
+def get_partition_retriever(grade: str, subject: str, chapter: Optional[str] = None, k: int = 4) -> PartitionRetriever:
+    key = (grade, subject.lower())
+    vectorstores = get_vectorstores()
+    if key not in vectorstores:
+        raise ValueError(f"No vector store partition {partition_name(*key)}")
+    vectorstore, chapters, lexical, router = vectorstores[key]
+
+    id_range = None
+    if chapter:
+        if chapter not in chapters:
+            raise ValueError(f"Unknown chapter {chapter} in partition {partition_name(*key)}")
+        id_range = tuple(chapters[chapter])
+    return PartitionRetriever(vectorstore=vectorstore, lexical=lexical, k=k, id_range=id_range, router=router, chapters=chapters)
+
+
+QA_TEMPLATE = """
         You are a knowledgeable tutor for grade {grade} in {subject}.
         Below is the conversation so far:
         {history}
@@ -72,65 +363,361 @@ def get_rag_response(query: str, grade: str, subject: str, history=None):
 
         Question:
         {input}
-        """)
+        """
 
-        # Fill static vars (grade, subject) at compile time
-        final_prompt = prompt.partial(grade=grade, subject=subject, history=history_text)
 
-        # Build RAG chain
-        combine_docs_chain = create_stuff_documents_chain(llm, final_prompt)
-        rag_chain: RunnableSequence = create_retrieval_chain(retriever, combine_docs_chain)
+def format_history(history):
+    # Format client-sent conversation history for prompt, keeping the most
+    # recent turns that fit in the history token budget
+    return budget_history(history)
 
-        # Run the RAG chain with just `query` as input
-        result = rag_chain.invoke({"input": query})
-        #print("=== RAG Chain Result ===")
-        #pprint.pprint(result)
-
-        # Extract the final answer (always under key "answer")
-        raw_answer = result.get("answer", "No answer found.")
-        answer = raw_answer.get("answer") if isinstance(raw_answer, dict) else raw_answer
-
-        # Extract sources
-        simplified_sources = []
-        for doc in result.get("context", []):
-            metadata = doc.metadata
-            page_content = doc.page_content if hasattr(doc, 'page_content') else "No content available"
-            print(f"Source doc metadata: {metadata}")
-            simplified_sources.append({
-                "filename": metadata.get("source", "Untitled"),
-                "page number": metadata.get("page", "#"),
-                "page content": page_content[:300]  # Limit to first 200 chars for brevity),
-            })
-
-        return {
-            "answer": answer,
-            "sources": simplified_sources
-        }
 
-    except Exception as e:
-        print(f"[ERROR] RAG pipeline failed: {e}")
-        return {
-            "answer": "Sorry, an error occurred while generating your answer.",
-            "sources": []
-        }
+SUMMARY_TEMPLATE = """
+        Summarize the conversation between a student and a tutor below in a few sentences.
+        Keep the topics discussed, facts the tutor explained and anything the student is still unsure about.
 
-    
+        Summary so far:
+        {summary}
+
+        New conversation:
+        {turns}
+        """
+
+get_summary_chain = Lazy(lambda: PromptTemplate.from_template(SUMMARY_TEMPLATE) | get_llm() | StrOutputParser())
+
+
+@asynccontextmanager
+async def llm_slot(trace):
+    # Holds an LLM concurrency slot, recording the wait for it on the request trace
+    queued = time.perf_counter()
+    async with llm_limit.slot():
+        trace.record("llm_queue", time.perf_counter() - queued)
+        yield
+
+
+async def asummarize_history(summary, turns_text):
+    async with llm_limit.slot():
+        return await get_summary_chain().ainvoke({"summary": summary or "(none)", "turns": turns_text})
+
+
+# Server-side history per session: recent turns verbatim plus a rolling summary
+conversations = ConversationStore(asummarize_history)
+
+
+async def session_history(session_id, history):
+    if session_id:
+        return await conversations.history_text(session_id)
+    return format_history(history)
+
+
+def simplify_sources(docs):
+    simplified_sources = []
+    for doc in docs:
+        metadata = doc.metadata
+        page_content = doc.page_content if hasattr(doc, 'page_content') else "No content available"
+        log(request_log, logging.DEBUG, "source", metadata=metadata)
+        simplified_sources.append({
+            "filename": metadata.get("source", "Untitled"),
+            "page number": metadata.get("page", "#"),
+            "page content": page_content[:300],  # Limit to first 300 chars for brevity
+        })
+    return simplified_sources
+
+
+def routing_metadata(route: Optional[Route]):
+    # Response field: the chapters searched, best first, with their routing
+    # scores; None when the whole partition was searched
+    if route is None:
+        return None
+    return {"chapters": list(route.chapters), "scores": list(route.scores)}
+
+
+def build_qa_chain(grade: str, subject: str, lexical: Optional[BM25Index] = None):
+    # Fill static vars (grade, subject) at compile time; history and input are runtime inputs
+    prompt = PromptTemplate.from_template(QA_TEMPLATE)
+    final_prompt = prompt.partial(grade=grade, subject=subject)
+
+    # The retrieved chunks are deduplicated and cut to CONTEXT_TOKEN_BUDGET before the prompt
+    return context_compressor(lexical) | create_stuff_documents_chain(get_llm(), final_prompt)
 
-def generate_quiz(grade, subject, topic, num_questions=5):
 
-    # Setup retriever with metadata filters
-    retriever = vectorstore.as_retriever(
-        search_kwargs={
-            "k": 1,
-            "filter": {
-                "grade": grade,
-                "subject": subject.lower(),
-                "chapter": topic,
+# Chains are compiled once per (kind, grade, subject, chapter, ...) and reused
+# by every request that routes to the same partition
+RagChain = namedtuple("RagChain", ["retriever", "combine_docs_chain", "rag_chain"])
+_chain_registry = {}
+_chain_registry_lock = threading.Lock()
+
+
+def _registered_chain(key, build):
+    chain = _chain_registry.get(key)
+    if chain is None:
+        with _chain_registry_lock:
+            chain = _chain_registry.get(key)
+            if chain is None:
+                chain = _chain_registry[key] = build()
+    return chain
+
+
+def get_qa_chain(grade: str, subject: str) -> RagChain:
+    subject = subject.lower()
+
+    def build():
+        # Route the query straight to the (grade, subject) partition
+        retriever = get_partition_retriever(grade, subject, k=4)
+        combine_docs_chain = build_qa_chain(grade, subject, retriever.lexical)
+        return RagChain(retriever, combine_docs_chain, create_retrieval_chain(retriever, combine_docs_chain))
+
+    return _registered_chain(("qa", grade, subject), build)
+
+
+def get_rag_response(query: str, grade: str, subject: str, history=None, trace=None):
+    with request_trace(trace, "get_rag_response", grade, subject) as trace:
+        try:
+            log(request_log, logging.DEBUG, "query", grade=grade, subject=subject, question=query)
+
+            # Reuse the compiled RAG chain for this partition
+            rag_chain: RunnableSequence = get_qa_chain(grade, subject).rag_chain
+
+            # Run the RAG chain with the query and this conversation's history as inputs
+            with trace.stage("chain"):
+                result = rag_chain.invoke(
+                    {"input": query, "history": format_history(history)},
+                    config={"callbacks": [LLMUsage(trace)]},
+                )
+
+            # Extract the final answer (always under key "answer")
+            raw_answer = result.get("answer", "No answer found.")
+            answer = raw_answer.get("answer") if isinstance(raw_answer, dict) else raw_answer
+
+            return {
+                "answer": answer,
+                "sources": simplify_sources(result.get("context", []))
             }
-        }
-    )
-    try:
-        template = PromptTemplate.from_template("""
+
+        except Exception as e:
+            trace.notes["error"] = str(e)
+            log(logger, logging.ERROR, "rag_pipeline_failed", exc_info=True, error=str(e))
+            return {
+                "answer": "Sorry, an error occurred while generating your answer.",
+                "sources": []
+            }
+
+
+async def aretrieve(chain: RagChain, query: str, grade: str, subject: str, history_text: str, trace):
+    # Returns (docs, query embedding or None, cached result or None, chapter route or None),
+    # timing each step
+    with trace.stage("lexical"):
+        docs = chain.retriever.lexical_fast_path(query)
+    if docs is not None:
+        # Confident lexical matches skip the embedding call (and so the answer cache)
+        trace.notes["retrieval"] = "lexical"
+        return docs, None, None, None
+
+    # The query embedding serves both the answer cache and the vector search
+    with trace.stage("embed"):
+        embedding = await chain.retriever.aembed_query(query)
+    with trace.stage("cache_lookup"):
+        cached = answer_cache.lookup(grade, subject, history_text, embedding)
+    if cached is not None:
+        trace.notes["answer_cache"] = "hit"
+        return None, embedding, cached, None
+
+    with trace.stage("route"):
+        route = chain.retriever.route([embedding])[0]
+    if route is not None:
+        trace.notes["routing"] = list(route.chapters)
+    trace.notes["retrieval"] = "hybrid"
+    with trace.stage("search"):
+        docs = chain.retriever.search_vector(embedding, query, route)
+    return docs, embedding, None, route
+
+
+async def aget_rag_response(query: str, grade: str, subject: str, history=None, session_id=None, trace=None):
+    # Non-blocking variant of get_rag_response: retrieval and generation each
+    # wait for a slot of their upstream concurrency limit instead of a thread
+    with request_trace(trace, "aget_rag_response", grade, subject) as trace:
+        try:
+            log(request_log, logging.DEBUG, "query", grade=grade, subject=subject, question=query)
+
+            # Requests that arrive during startup wait for the warmup instead of racing it
+            await ensure_warm()
+            chain = get_qa_chain(grade, subject)
+            with trace.stage("history"):
+                history_text = await session_history(session_id, history)
+
+            async def answer():
+                # Timed on the trace of the request that starts it
+                docs, embedding, cached, route = await aretrieve(chain, query, grade, subject, history_text, trace)
+                if cached is not None:
+                    return cached
+
+                async with llm_slot(trace):
+                    with trace.stage("llm"):
+                        text = await chain.combine_docs_chain.ainvoke(
+                            {"input": query, "context": docs, "history": history_text},
+                            config={"callbacks": [LLMUsage(trace)]},
+                        )
+
+                result = {
+                    "answer": text,
+                    "sources": simplify_sources(docs),
+                    "routing": routing_metadata(route),
+                }
+                if embedding is not None:
+                    answer_cache.store(grade, subject, history_text, embedding, result)
+                return result
+
+            key = (grade, subject.lower(), normalize_query(query), history_digest(history_text))
+            result, coalesced = await ask_flight.run(key, answer)
+            if coalesced:
+                trace.notes["coalesced"] = True
+            if session_id:
+                await conversations.record(session_id, query, result["answer"])
+            return result
+
+        except Exception as e:
+            trace.notes["error"] = str(e)
+            log(logger, logging.ERROR, "rag_pipeline_failed", exc_info=True, error=str(e))
+            return {
+                "answer": "Sorry, an error occurred while generating your answer.",
+                "sources": []
+            }
+
+
+async def astream_rag_response(query: str, grade: str, subject: str, history=None, session_id=None, trace=None):
+    # Async generator of (event, data) pairs: the retrieved sources first, then
+    # answer tokens as the LLM produces them, then "done". Identical questions
+    # asked while one is being answered (same class, same history) receive the
+    # same retrieval and token stream instead of their own.
+    with request_trace(trace, "astream_rag_response", grade, subject) as trace:
+        log(request_log, logging.DEBUG, "query", grade=grade, subject=subject, question=query, stream=True)
+
+        await ensure_warm()
+        chain = get_qa_chain(grade, subject)
+        with trace.stage("history"):
+            history_text = await session_history(session_id, history)
+
+        async def answer():
+            # Timed on the trace of the request that starts it
+            docs, embedding, cached, route = await aretrieve(chain, query, grade, subject, history_text, trace)
+            if cached is not None:
+                yield "sources", cached["sources"]
+                yield "token", cached["answer"]
+                yield "done", {"cached": True, "routing": cached.get("routing")}
+                return
+
+            sources = simplify_sources(docs)
+            yield "sources", sources
+
+            text = ""
+            async with llm_slot(trace):
+                with trace.stage("llm"):
+                    async for token in chain.combine_docs_chain.astream(
+                        {"input": query, "context": docs, "history": history_text},
+                        config={"callbacks": [LLMUsage(trace)]},
+                    ):
+                        if token:
+                            text += token
+                            yield "token", token
+            routing = routing_metadata(route)
+            if embedding is not None:
+                answer_cache.store(grade, subject, history_text, embedding, {"answer": text, "sources": sources, "routing": routing})
+            yield "done", {"routing": routing}
+
+        key = (grade, subject.lower(), normalize_query(query), history_digest(history_text))
+        events, coalesced = ask_flight.stream(key, answer)
+        if coalesced:
+            trace.notes["coalesced"] = True
+        text = ""
+        async for event, data in events:
+            if event == "token":
+                text += data
+            elif event == "done" and session_id:
+                await conversations.record(session_id, query, text)
+            yield event, data
+
+
+# Worksheets: questions accepted per batch, and LLM calls one batch keeps in flight
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", 100))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 16))
+
+
+async def abatch_rag_responses(questions: List[str], grade: str, subject: str, concurrency=BATCH_CONCURRENCY, trace=None):
+    # Async generator of (indices, result) in completion order; indices are the
+    # positions of every copy of one (normalised) question. Retrieval runs once
+    # for the whole batch: one embeddings request and one FAISS search.
+    with request_trace(trace, "abatch_rag_responses", grade, subject) as trace:
+        await ensure_warm()
+        chain = get_qa_chain(grade, subject)
+        retriever = chain.retriever
+
+        groups = {}
+        for i, question in enumerate(questions):
+            groups.setdefault(normalize_query(question), []).append(i)
+        indices = {questions[group[0]]: group for group in groups.values()}
+        trace.notes.update(questions=len(questions), unique=len(indices))
+
+        docs, vectors, cached, routes = {}, {}, {}, {}
+        with trace.stage("lexical"):
+            for question in indices:
+                found = retriever.lexical_fast_path(question)
+                if found is not None:
+                    docs[question] = found
+
+        pending = [question for question in indices if question not in docs]
+        if pending:
+            with trace.stage("embed"):
+                async with embedding_limit.slot():
+                    embeddings = await get_embeddings().aembed_queries(pending)
+            with trace.stage("cache_lookup"):
+                for question, embedding in zip(pending, embeddings):
+                    hit = answer_cache.lookup(grade, subject, "", embedding)
+                    if hit is not None:
+                        cached[question] = hit
+                    else:
+                        vectors[question] = embedding
+            if vectors:
+                with trace.stage("route"):
+                    routes.update(zip(vectors, retriever.route(list(vectors.values()))))
+                with trace.stage("search"):
+                    found = retriever.search_vectors(list(vectors.values()), list(vectors), list(routes.values()))
+                docs.update(zip(vectors, found))
+        trace.notes.update(cached=len(cached), generated=len(docs))
+
+        for question, result in cached.items():
+            yield indices[question], result
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def answer(question):
+            try:
+                async with semaphore:
+                    async with llm_slot(trace):
+                        text = await chain.combine_docs_chain.ainvoke(
+                            {"input": question, "context": docs[question], "history": ""},
+                            config={"callbacks": [LLMUsage(trace)]},
+                        )
+            except Exception as e:
+                trace.notes["failed"] = trace.notes.get("failed", 0) + 1
+                log(logger, logging.ERROR, "batch_question_failed", exc_info=True, error=str(e))
+                return question, {"answer": "Sorry, an error occurred while generating your answer.", "sources": []}
+            result = {"answer": text, "sources": simplify_sources(docs[question]), "routing": routing_metadata(routes.get(question))}
+            if question in vectors:
+                answer_cache.store(grade, subject, "", vectors[question], result)
+            return question, result
+
+        tasks = [asyncio.create_task(answer(question)) for question in docs]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                question, result = await next_done
+                yield indices[question], result
+        finally:
+            # The client went away: drop the calls that have not finished
+            for task in tasks:
+                task.cancel()
+
+
+QUIZ_TEMPLATE = """
         Context:
         {context}
                                                 
@@ -147,6 +734,7 @@ def generate_quiz(grade, subject, topic, num_questions=5):
         If context is enough to generate quiz, then generate the quiz in the following format:
         Each question should have 4 options (A to D) and indicate the correct answer as 'Answer: <option>' after each question.
         Do not include any additional text or explanations, just the questions and options.
+        {exclude}
         Use the following format for each question:      
         Q1. What is ...?
         A. ...
@@ -154,53 +742,184 @@ def generate_quiz(grade, subject, topic, num_questions=5):
         C. ...
         D. ...
         Answer: A
-        """       )
-        prompt = template.partial(
-            num_questions=num_questions,
-            grade=grade,
-            subject=subject,
-            topic=topic
-        )
+        """
+
+
+def build_quiz_chain(grade, subject, topic, num_questions=5):
+    # `exclude` is empty except when a streamed quiz asks again for dropped questions
+    prompt = PromptTemplate.from_template(QUIZ_TEMPLATE).partial(
+        num_questions=num_questions,
+        grade=grade,
+        subject=subject,
+        topic=topic,
+        exclude="",
+    )
+    return create_stuff_documents_chain(get_llm(), prompt)
+
+
+def quiz_query(grade, subject, topic, num_questions=5):
+    return f"Generate {num_questions} MCQs for grade {grade} and subject {subject} for topic {topic}."
+
 
-        # Build RAG chain
-        combine_docs_chain = create_stuff_documents_chain(llm, prompt)
-        rag_chain: RunnableSequence = create_retrieval_chain(retriever, combine_docs_chain)
+def get_quiz_chain(grade, subject, topic, num_questions=5) -> RagChain:
+    subject = subject.lower()
+
+    def build():
+        # Route to the (grade, subject) partition, restricted to the chapter's id range
+        retriever = get_partition_retriever(grade, subject, chapter=topic, k=1)
+        combine_docs_chain = build_quiz_chain(grade, subject, topic, num_questions)
+        return RagChain(retriever, combine_docs_chain, create_retrieval_chain(retriever, combine_docs_chain))
+
+    return _registered_chain(("quiz", grade, subject, topic, num_questions), build)
+
+
+def generate_quiz(grade, subject, topic, num_questions=5):
+
+    try:
+        # Reuse the compiled quiz chain for this chapter
+        rag_chain: RunnableSequence = get_quiz_chain(grade, subject, topic, num_questions).rag_chain
 
         # Run the RAG chain with just `query` as input
-        query = f"Generate {num_questions} MCQs for grade {grade} and subject {subject} for topic {topic}."
+        query = quiz_query(grade, subject, topic, num_questions)
 
         result = rag_chain.invoke({"input": query})
-        print("=== RAG Chain Result ===")
-        pprint.pprint(result)
+        log(request_log, logging.DEBUG, "quiz_result", result=result)
 
         return result['answer'] if isinstance(result, dict) and "answer" in result else result
     except Exception as e:
-        print(f"[ERROR] Quiz generation failed: {e}")
+        log(logger, logging.ERROR, "quiz_generation_failed", exc_info=True, error=str(e))
         return "Error generating quiz."
-    
-def parse_quiz_text(raw_text: str) -> list[dict]:
-    blocks = raw_text.split("Q")[1:]  # Each block starts with "1:", "2:", ...
-    parsed_quiz = []
-    print(f"[INFO] Found {len(blocks)} quiz blocks to parse.")
-    for block in blocks:
+
+
+def available_topic_keys(topic_keys):
+    # The (grade, subject, chapter) topics whose chapter is in the vector store;
+    # the others are reported in one log line instead of failing later
+    vectorstores = get_vectorstores()
+    available, missing = [], []
+    for grade, subject, chapter in topic_keys:
+        partition = vectorstores.get((grade, subject.lower()))
+        if partition is not None and chapter in partition.chapters:
+            available.append((grade, subject.lower(), chapter))
+        else:
+            missing.append(f"{partition_name(grade, subject)}/{chapter}")
+    if missing:
+        log(logger, logging.WARNING, "quiz_topics_not_indexed", count=len(missing), topics=missing)
+    return available
+
+
+async def aprecompute_quiz_queries(topic_keys, num_questions=5):
+    # Quiz retrieval queries are deterministic per chapter, so embed them all up front
+    queries = [quiz_query(grade, subject, topic, num_questions) for grade, subject, topic in topic_keys]
+    count = await get_embeddings().aprecompute(queries)
+    log(logger, logging.INFO, "quiz_queries_precomputed", count=count)
+
+
+async def agenerate_quiz(grade, subject, topic, num_questions=5, trace=None, coalesce=True):
+    # Non-blocking variant of generate_quiz for the async API. Quiz pool refills
+    # pass coalesce=False: joining a student's generation would pool the quiz
+    # that student has just been given.
+    with request_trace(trace, "agenerate_quiz", grade, subject) as trace:
         try:
-            question_part = block.split("A.")[0].strip()
-            options_part = re.findall(r'[A-D]\..+?(?=(?:[A-D]\.|Answer:))', block, re.DOTALL)
-            options = {}
-            for opt in options_part:
-                key = opt.strip()[0]
-                val = opt.strip()[2:].strip()
-                options[key] = val
-
-            answer_match = re.search(r'Answer:\s*([A-D])', block)
-            answer = answer_match.group(1) if answer_match else ""
-
-            parsed_quiz.append({
-                "question": question_part,
-                "options": options,
-                "answer": answer
-            })
+            await ensure_warm()
+            chain = get_quiz_chain(grade, subject, topic, num_questions)
+            query = quiz_query(grade, subject, topic, num_questions)
+
+            async def generate():
+                with trace.stage("retrieve"):
+                    docs = await chain.retriever.ainvoke(query)
+                async with llm_slot(trace):
+                    with trace.stage("llm"):
+                        return await chain.combine_docs_chain.ainvoke(
+                            {"input": query, "context": docs},
+                            config={"callbacks": [LLMUsage(trace)]},
+                        )
+
+            if not coalesce:
+                return await generate()
+            text, coalesced = await quiz_flight.run((grade, subject.lower(), topic, num_questions), generate)
+            if coalesced:
+                trace.notes["coalesced"] = True
+            return text
         except Exception as e:
-            print(f"Error parsing block: {block[:30]}... — {e}")
+            trace.notes["error"] = str(e)
+            log(logger, logging.ERROR, "quiz_generation_failed", exc_info=True, error=str(e))
+            return "Error generating quiz."
+
+
+# Rounds of re-asking for the questions of a streamed quiz that were dropped as malformed
+QUIZ_STREAM_RETRIES = int(os.getenv("QUIZ_STREAM_RETRIES", 1))
+
+
+def quiz_exclusion(questions):
+    # Prompt line listing questions the student already has
+    if not questions:
+        return ""
+    listed = "\n".join(f"        - {question}" for question in questions)
+    return f"Do not repeat any of these questions, the student already has them:\n{listed}"
+
+
+async def _astream_quiz_questions(grade, subject, topic, num_questions, parser, trace, exclude=()):
+    # Validated questions of one generation, each as soon as its Answer line ends
+    chain = get_quiz_chain(grade, subject, topic, num_questions)
+    query = quiz_query(grade, subject, topic, num_questions)
+    with trace.stage("retrieve"):
+        docs = await chain.retriever.ainvoke(query)
+    async with llm_slot(trace):
+        with trace.stage("llm"):
+            async for token in chain.combine_docs_chain.astream(
+                {"input": query, "context": docs, "exclude": quiz_exclusion(exclude)},
+                config={"callbacks": [LLMUsage(trace)]},
+            ):
+                for question in parser.feed(token):
+                    yield question
+            for question in parser.close():
+                yield question
+
+
+async def astream_quiz(grade, subject, topic, num_questions=5, trace=None):
+    # Async generator of ("question", question dict) events while the quiz is
+    # generated, then ("done", counts). Malformed questions are dropped; if any
+    # were, only the missing number is asked for again, listing the questions
+    # already sent so the retry does not reproduce them. Identical concurrent
+    # requests share one generation. Errors propagate.
+    with request_trace(trace, "astream_quiz", grade, subject) as trace:
+        await ensure_warm()
+
+        async def generate():
+            # Timed on the trace of the request that starts it
+            start = time.perf_counter()
+            seen, sent, dropped = set(), [], 0
+            for attempt in range(1 + QUIZ_STREAM_RETRIES):
+                parser = QuizStreamParser()
+                async for question in _astream_quiz_questions(
+                    grade, subject, topic, num_questions - len(seen), parser, trace, exclude=sent,
+                ):
+                    key = normalize_query(question["question"])
+                    # A retry may still repeat a question already sent
+                    if key in seen or len(seen) >= num_questions:
+                        continue
+                    if not seen:
+                        trace.record("first_question", time.perf_counter() - start)
+                    seen.add(key)
+                    sent.append(question["question"])
+                    yield "question", question
+                dropped += parser.dropped
+                # Without dropped questions a short quiz is the model's answer (e.g. out of syllabus)
+                if len(seen) >= num_questions or not parser.dropped:
+                    break
+            trace.notes.update(questions=len(seen), dropped=dropped, attempts=attempt + 1)
+            yield "done", {"questions": len(seen), "dropped": dropped}
+
+        events, coalesced = quiz_flight.stream((grade, subject.lower(), topic, num_questions), generate)
+        if coalesced:
+            trace.notes["coalesced"] = True
+        async for event in events:
+            yield event
+
 
+def parse_quiz_text(raw_text: str) -> list[dict]:
+    # Questions without options A-D and a valid answer are left out
+    parser = QuizStreamParser()
+    parsed_quiz = parser.feed(raw_text) + parser.close()
+    log(logger, logging.DEBUG, "quiz_parsed", questions=len(parsed_quiz), dropped=parser.dropped)
     return parsed_quiz
@@ -0,0 +1,87 @@
+import os
+from collections import namedtuple
+
+import faiss
+import numpy as np
+
+# Routing table of one partition: a few k-means centroids per chapter over that
+# chapter's chunk vectors, kept in one contiguous float32 array grouped by
+# chapter. A question that names no chapter is scored against every centroid
+# with a single matrix product and only its best chapters are searched.
+ROUTING_FILE = "routing.npz"
+# Centroids per chapter, fixed at build time
+ROUTING_CENTROIDS = int(os.getenv("ROUTING_CENTROIDS", 4))
+# Chapters searched per question; 0 searches the whole partition, as do
+# partitions with no more chapters than this
+ROUTING_TOP_CHAPTERS = int(os.getenv("ROUTING_TOP_CHAPTERS", 3))
+
+# chapters: names best first; scores: cosine similarity of the closest centroid of each
+Route = namedtuple("Route", ["chapters", "scores"])
+
+
+def _unit(vectors):
+    vectors = np.array(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+class ChapterRouter:
+    # Chapter names are in FAISS id order; the retriever maps them to the id
+    # ranges of partitions.json.
+
+    def __init__(self, chapters, centroids, owners):
+        self.chapters = list(chapters)
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        # Chapter number of each centroid; centroids of a chapter are adjacent
+        self.owners = owners
+        self.starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]]) if len(owners) else owners
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, ranges: dict, per_chapter=ROUTING_CENTROIDS, seed=0):
+        # ranges: {chapter: [start, end)} of the FAISS ids, as in partitions.json
+        chapters = sorted(ranges, key=lambda chapter: ranges[chapter][0])
+        centroids, owners = [], []
+        for number, chapter in enumerate(chapters):
+            start, end = ranges[chapter]
+            members = _unit(vectors[start:end])
+            k = min(per_chapter, len(members))
+            if k < len(members):
+                # Spherical k-means: centroids stay on the unit sphere, like the queries
+                kmeans = faiss.Kmeans(members.shape[1], k, niter=20, seed=seed + number, spherical=True,
+                                      min_points_per_centroid=1)
+                kmeans.train(members)
+                members = kmeans.centroids
+            centroids.append(members)
+            owners.extend([number] * len(members))
+        if not centroids:
+            centroids = [np.zeros((0, vectors.shape[1]), dtype=np.float32)]
+        return cls(chapters, np.concatenate(centroids), np.array(owners, dtype=np.int32))
+
+    def save(self, folder_path):
+        np.savez(
+            os.path.join(folder_path, ROUTING_FILE),
+            chapters=np.frombuffer("\n".join(self.chapters).encode("utf-8"), dtype=np.uint8),
+            centroids=self.centroids, owners=self.owners,
+        )
+
+    @classmethod
+    def load(cls, folder_path):
+        path = os.path.join(folder_path, ROUTING_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            chapters = data["chapters"].tobytes().decode("utf-8").split("\n") if data["chapters"].size else []
+            return cls(chapters, data["centroids"], data["owners"])
+
+    def route(self, queries, top=ROUTING_TOP_CHAPTERS):
+        # One Route per query vector
+        if not len(self.centroids):
+            return [Route((), ()) for _ in queries]
+        scores = _unit(queries) @ self.centroids.T
+        # Best centroid of each chapter, then the best chapters
+        chapter_scores = np.maximum.reduceat(scores, self.starts, axis=1)
+        top = min(top, chapter_scores.shape[1])
+        best = np.argsort(-chapter_scores, axis=1)[:, :top]
+        return [
+            Route(tuple(self.chapters[c] for c in row), tuple(round(float(s), 4) for s in chapter_scores[i, row]))
+            for i, row in enumerate(best)
+        ]
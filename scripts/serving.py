@@ -0,0 +1,74 @@
+import os, logging, resource, argparse
+
+import faiss
+
+from scripts.logs import get_logger, log
+
+logger = get_logger("serving")
+
+# Open saved FAISS indexes read-only and memory-mapped, so every worker
+# process shares one copy of the vectors through the OS page cache
+FAISS_MMAP = os.getenv("FAISS_MMAP", "1") == "1"
+# uvicorn reads the worker count from WEB_CONCURRENCY as well
+SERVE_WORKERS = int(os.getenv("WEB_CONCURRENCY", 1))
+# OpenMP threads per worker; by default the cores are split between the workers
+FAISS_OMP_THREADS = int(os.getenv("FAISS_OMP_THREADS", max(1, (os.cpu_count() or 1) // SERVE_WORKERS)))
+
+
+def faiss_read_flags():
+    if not FAISS_MMAP:
+        return 0
+    # IO_FLAG_MMAP_IFC also maps the codes of flat indexes (faiss >= 1.9)
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def configure_faiss_threads(threads=FAISS_OMP_THREADS):
+    # Without a cap every worker's OpenMP pool would use all cores
+    faiss.omp_set_num_threads(threads)
+    return threads
+
+
+def memory_report():
+    # Resident memory of this process in MB; "shared" counts pages also mapped by
+    # other processes (mmapped indexes, shared libraries)
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    except OSError:
+        # No /proc (macOS): only the peak RSS is available
+        return {"pid": os.getpid(), "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+    return {
+        "pid": os.getpid(),
+        "rss_mb": round(fields.get("Rss", 0.0), 1),
+        "pss_mb": round(fields.get("Pss", 0.0), 1),
+        "shared_mb": round(fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0), 1),
+        "private_mb": round(fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0), 1),
+    }
+
+
+def log_memory_report():
+    log(logger, logging.INFO, "worker_memory", **memory_report())
+
+
+if __name__ == "__main__":
+    # python -m scripts.serving --workers 4
+    # Starts N uvicorn workers over memory-mapped indexes, with the cores split between them
+    parser = argparse.ArgumentParser(description="Serve the API with several workers sharing the memory-mapped indexes.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--omp-threads", type=int, help="OpenMP threads per worker (default: cores / workers)")
+    args = parser.parse_args()
+
+    # Workers are fresh interpreters and read their settings from the environment
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    os.environ["FAISS_MMAP"] = "1"
+    os.environ["FAISS_OMP_THREADS"] = str(args.omp_threads or max(1, (os.cpu_count() or 1) // args.workers))
+
+    import uvicorn
+    uvicorn.run("app.backend:app", host=args.host, port=args.port, workers=args.workers)
@@ -0,0 +1,121 @@
+import os, asyncio
+
+from scripts.metrics import FLIGHTS
+
+# Set to 0 to compute every request separately
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "1") == "1"
+
+
+class Broadcast:
+    # The items of one async iterator, consumed once in its own task and
+    # replayed from the start to every subscriber, including late ones. The
+    # source is cancelled when its last subscriber goes away before the end.
+
+    def __init__(self, source):
+        self.items = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = RuntimeError("stream abandoned by every subscriber")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def subscribe(self):
+        # Counted from the first read until the iterator ends or is closed; a
+        # subscription that is never iterated does not keep the source alive
+        return self._follow()
+
+    async def _follow(self):
+        position = 0
+        self.subscribers += 1
+        try:
+            while True:
+                while position < len(self.items):
+                    position += 1
+                    yield self.items[position - 1]
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self.changed.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done:
+                self.task.cancel()
+
+
+class SingleFlight:
+    # Coalesces concurrent identical calls: the first caller for a key (the
+    # leader) starts the computation and every caller with the same key that
+    # arrives before it finishes (a follower) awaits the same result or error.
+    # The computation runs in its own task, so a caller that goes away does not
+    # cancel it for the others.
+
+    def __init__(self, name: str, enabled=SINGLE_FLIGHT):
+        self.name = name
+        self.enabled = enabled
+        self.in_flight = {}  # key -> task
+        self.streams = {}    # key -> Broadcast
+        self.leaders = 0
+        self.followers = 0
+
+    def _count(self, coalesced):
+        if coalesced:
+            self.followers += 1
+        else:
+            self.leaders += 1
+        FLIGHTS.labels(flight=self.name, role="follower" if coalesced else "leader").inc()
+
+    async def run(self, key, factory):
+        # `factory` is a no-argument coroutine function; returns (result, coalesced)
+        if not self.enabled:
+            return await factory(), False
+        task = self.in_flight.get(key)
+        coalesced = task is not None
+        self._count(coalesced)
+        if not coalesced:
+            task = asyncio.ensure_future(factory())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(task), coalesced
+
+    def stream(self, key, factory):
+        # Streaming variant of run: `factory` is a no-argument function returning
+        # an async iterator (e.g. an async generator function). Returns (async
+        # iterator, coalesced); followers get every item from the first one on,
+        # then the same end or error. Must be called from the event loop.
+        if not self.enabled:
+            return factory(), False
+        broadcast = self.streams.get(key)
+        coalesced = broadcast is not None
+        self._count(coalesced)
+        if not coalesced:
+            broadcast = self.streams[key] = Broadcast(factory())
+            broadcast.task.add_done_callback(lambda _: self.streams.pop(key, None))
+        return broadcast.subscribe(), coalesced
+
+    def stats(self):
+        total = self.leaders + self.followers
+        return {
+            "in_flight": len(self.in_flight) + len(self.streams),
+            "leaders": self.leaders,
+            "coalesced": self.followers,
+            "coalesced_rate": self.followers / total if total else 0.0,
+        }
@@ -0,0 +1,137 @@
+import os, sys, zlib
+
+import numpy as np
+import pytest
+
+# The scripts are run both as `scripts.x` (backend, benchmarks) and from the
+# scripts directory with bare imports (build_vector_store.py); allow both
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "scripts")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from benchmarks.common import FakeEncoding
+from scripts.lexical_index import tokenize
+
+# One "PDF" per chapter of grade 12 computer science, one chunk per line
+CORPUS = {
+    "03_stack": [
+        "A stack is a linear data structure in which elements are added and removed at the top.",
+        "Adding an element to the top of the stack is called push.",
+        "Removing the element at the top of the stack is called pop.",
+        "A stack follows the last in first out order, known as LIFO.",
+        "Trying to pop from an empty stack is an underflow.",
+        "Pushing onto a full stack is an overflow.",
+        "Stacks evaluate postfix expressions and convert infix expressions to postfix.",
+        "The browser back button keeps the visited pages on a stack.",
+    ],
+    "04_queue": [
+        "A queue is a linear data structure in which elements are added at the rear and removed from the front.",
+        "Adding an element at the rear of the queue is called enqueue.",
+        "Removing the element at the front of the queue is called dequeue.",
+        "A queue follows the first in first out order, known as FIFO.",
+        "A deque allows insertion and deletion at both ends of the queue.",
+        "Print jobs wait in a queue until the printer is free.",
+        "Customers waiting at a bank counter form a queue.",
+        "A circular queue reuses the slots freed at the front.",
+    ],
+    "05_sorting": [
+        "Sorting arranges the elements of a list in ascending or descending order.",
+        "Bubble sort compares adjacent elements and swaps them when they are out of order.",
+        "Every iteration of bubble sort through the list is called a pass.",
+        "Selection sort selects the smallest element and swaps it into place.",
+        "Insertion sort inserts each element into the sorted part of the list.",
+        "Bubble sort and selection sort take quadratic time.",
+        "A sorted list can be searched with binary search.",
+        "Sorting student marks in descending order gives the rank list.",
+    ],
+    "06_searching": [
+        "Linear search compares the key with every element of the list in turn.",
+        "Binary search halves the sorted list at every step.",
+        "Binary search compares the key with the middle element.",
+        "Hashing finds a key in a hash table in a single step.",
+        "The remainder method is a simple hash function for numbers.",
+        "Two keys mapped to the same slot of a hash table are a collision.",
+        "Collision resolution finds another slot for the second key.",
+        "A perfect hash function maps every key to a unique slot.",
+    ],
+}
+
+
+class HashEmbeddings(Embeddings):
+    # Bag-of-words vectors: every non-stopword is hashed to one of `size`
+    # dimensions, so texts sharing words are close, deterministically and offline
+
+    def __init__(self, size=64):
+        self.size = size
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for token in tokenize(text):
+            vector[zlib.crc32(token.encode("utf-8")) % self.size] += 1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def split_lines(pdf_files, workers=1):
+    # Stand-in for ingest_data.iter_split_files over the plain-text "PDFs"
+    for pdf_file in pdf_files:
+        path, grade, subject, chapter = pdf_file
+        with open(path) as f:
+            docs = [
+                Document(page_content=line, metadata={"grade": grade, "subject": subject, "chapter": chapter, "page": n})
+                for n, line in enumerate(f.read().splitlines())
+            ]
+        yield pdf_file, docs, 0.0, 0
+
+
+@pytest.fixture
+def offline_tokenizer(monkeypatch):
+    # Whitespace tokens instead of tiktoken's BPE file, which needs a download
+    from scripts import conversation
+    encoding = FakeEncoding()
+    monkeypatch.setattr(conversation, "get_encoding", lambda: encoding)
+    return encoding
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Vector store directory built from CORPUS by build_vector_store
+    import build_vector_store
+    folder = tmp_path / "data" / "grade_12" / "computer"
+    folder.mkdir(parents=True)
+    for chapter, lines in CORPUS.items():
+        (folder / f"{chapter}.pdf").write_text("\n".join(lines))
+    monkeypatch.setattr(build_vector_store, "iter_split_files", split_lines)
+    store_dir = tmp_path / "store"
+    build_vector_store.update_vector_store(HashEmbeddings(), str(tmp_path / "data"), str(store_dir), workers=1)
+    return store_dir
+
+
+@pytest.fixture
+def pipeline(store, monkeypatch, offline_tokenizer):
+    # scripts.rag_pipeline over `store`, with HashEmbeddings and a canned chat
+    # model (replace rag_pipeline.get_llm.value to change its answers)
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from scripts import rag_pipeline
+    from scripts.answer_cache import SemanticAnswerCache
+    from scripts.embedding_cache import CachingQueryEmbeddings
+
+    monkeypatch.setattr(rag_pipeline.get_embeddings, "value", CachingQueryEmbeddings(HashEmbeddings()))
+    monkeypatch.setattr(rag_pipeline.get_vectorstores, "value", rag_pipeline.load_vectorstores(str(store)))
+    monkeypatch.setattr(rag_pipeline.get_llm, "value", FakeListChatModel(responses=["A fake answer."]))
+    monkeypatch.setitem(rag_pipeline.warmup_state, "ready", True)
+    monkeypatch.setattr(rag_pipeline, "_chain_registry", {})
+    monkeypatch.setattr(rag_pipeline, "answer_cache", SemanticAnswerCache(path=""))
+    return rag_pipeline
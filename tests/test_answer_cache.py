@@ -0,0 +1,57 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from scripts import answer_cache as answer_cache_module
+from scripts.answer_cache import SemanticAnswerCache
+
+
+def test_hits_above_the_threshold_within_the_same_bucket():
+    cache = SemanticAnswerCache(threshold=0.95, path="")
+    cache.store("12", "Computer", "", [1.0, 0.0, 0.0], {"answer": "push"})
+    # cos = 0.995: a paraphrase
+    assert cache.lookup("12", "computer", "", [1.0, 0.1, 0.0]) == {"answer": "push"}
+    # cos = 0.89: a different question
+    assert cache.lookup("12", "computer", "", [1.0, 0.5, 0.0]) is None
+    # Same question, other class or conversation
+    assert cache.lookup("11", "computer", "", [1.0, 0.0, 0.0]) is None
+    assert cache.lookup("12", "computer", "Q: what is a queue?", [1.0, 0.0, 0.0]) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+
+
+def test_expired_and_least_recently_used_entries_are_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache_module.time, "time", lambda: now[0])
+    cache = SemanticAnswerCache(threshold=0.99, ttl=60, max_entries=2, path="")
+    cache.store("12", "computer", "", [1, 0, 0], {"answer": "a"})
+    cache.store("12", "computer", "", [0, 1, 0], {"answer": "b"})
+    assert cache.lookup("12", "computer", "", [1, 0, 0]) == {"answer": "a"}
+    # "b" is now the least recently used entry
+    cache.store("12", "computer", "", [0, 0, 1], {"answer": "c"})
+    assert cache.lookup("12", "computer", "", [0, 1, 0]) is None
+    assert cache.stats()["evictions"] == 1
+
+    now[0] += 61
+    assert cache.lookup("12", "computer", "", [1, 0, 0]) is None
+    assert cache.stats()["entries"] == 1
+
+
+def test_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "answers.sqlite")
+    SemanticAnswerCache(path=path).store("12", "computer", "", [0.6, 0.8], {"answer": "FIFO"})
+    assert SemanticAnswerCache(path=path).lookup("12", "computer", "", [0.6, 0.8]) == {"answer": "FIFO"}
+
+
+def test_paraphrase_is_answered_from_the_cache(pipeline, monkeypatch):
+    # No lexical fast path, so both questions go through the embedding and the cache
+    monkeypatch.setattr(pipeline, "LEXICAL_FASTPATH_MARGIN", 0)
+    llm = FakeListChatModel(responses=["Pop removes the top element.", "A second answer."])
+    monkeypatch.setattr(pipeline.get_llm, "value", llm)
+
+    async def run():
+        first = await pipeline.aget_rag_response("What does pop do to a stack?", "12", "computer")
+        second = await pipeline.aget_rag_response("what does POP do to a  stack", "12", "Computer")
+        return first, second
+    first, second = asyncio.run(run())
+    assert first["answer"] == second["answer"] == "Pop removes the top element."
+    assert pipeline.answer_cache.stats()["hits"] == 1
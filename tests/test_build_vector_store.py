@@ -0,0 +1,118 @@
+import os
+
+import pytest
+from langchain_core.documents import Document
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+import build_vector_store as bvs
+from index_types import read_index_config
+
+
+def fake_split(pdf_files, workers=1):
+    # Every line of a "PDF" is one chunk, so no PDF parsing is needed
+    for pdf_file in pdf_files:
+        path, grade, subject, chapter = pdf_file
+        with open(path) as f:
+            docs = [
+                Document(page_content=line, metadata={"grade": grade, "subject": subject, "chapter": chapter, "page": n})
+                for n, line in enumerate(f.read().splitlines())
+            ]
+        yield pdf_file, docs, 0.0, 0
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    embedded: int = 0
+
+    def embed_documents(self, texts):
+        self.embedded += len(texts)
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(bvs, "iter_split_files", fake_split)
+    data = tmp_path / "data"
+
+    def write(chapter, lines):
+        folder = data / "grade_12" / "computer"
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / f"{chapter}.pdf").write_text("\n".join(f"{chapter} {line} text" for line in lines))
+    return data, tmp_path / "store", write
+
+
+def build(data, store, embeddings, **kwargs):
+    return bvs.update_vector_store(embeddings, str(data), str(store), workers=1, **kwargs)
+
+
+def test_index_settings_change_rebuilds_unchanged_corpus(corpus):
+    data, store, write = corpus
+    for chapter in ("01_intro", "02_lists"):
+        write(chapter, [f"line {n}" for n in range(40)])
+    embeddings = CountingEmbeddings(size=16)
+    build(data, store, embeddings)
+    assert read_index_config(str(store / "grade_12_computer"))["type"] == "flat"
+
+    embeddings.embedded = 0
+    build(data, store, embeddings, index_type="hnsw", index_params={"M": 8})
+    assert read_index_config(str(store / "grade_12_computer"))["type"] == "hnsw"
+    assert embeddings.embedded == 0  # rebuilt from the stored vectors
+    assert bvs.load_manifest(str(store))["partitions"]["grade_12_computer"]["index_type"] == "hnsw"
+
+    mtime = os.path.getmtime(store / "grade_12_computer" / "index.json")
+    build(data, store, embeddings, index_type="hnsw", index_params={"M": 8})
+    assert os.path.getmtime(store / "grade_12_computer" / "index.json") == mtime
+
+
+def test_manifest_tracks_added_changed_and_removed_files(corpus):
+    data, store, write = corpus
+    write("01_intro", [f"line {n}" for n in range(10)])
+    write("02_lists", [f"line {n}" for n in range(10)])
+    embeddings = CountingEmbeddings(size=16)
+    build(data, store, embeddings)
+    assert embeddings.embedded == 20
+
+    # Added: only the new file is embedded
+    embeddings.embedded = 0
+    write("03_stack", [f"line {n}" for n in range(5)])
+    partitions = build(data, store, embeddings)
+    assert embeddings.embedded == 5
+    assert sorted(partitions["grade_12_computer"]["chapters"]) == ["01_intro", "02_lists", "03_stack"]
+    assert partitions["grade_12_computer"]["size"] == 25
+
+    # Changed: the file's old vectors are replaced
+    embeddings.embedded = 0
+    write("02_lists", [f"edited line {n}" for n in range(3)])
+    partitions = build(data, store, embeddings)
+    assert embeddings.embedded == 3
+    assert partitions["grade_12_computer"]["chapters"]["02_lists"][1] - partitions["grade_12_computer"]["chapters"]["02_lists"][0] == 3
+
+    # Removed: dropped from the manifest and the partition without embedding anything
+    embeddings.embedded = 0
+    (data / "grade_12" / "computer" / "01_intro.pdf").unlink()
+    partitions = build(data, store, embeddings)
+    assert embeddings.embedded == 0
+    assert sorted(partitions["grade_12_computer"]["chapters"]) == ["02_lists", "03_stack"]
+    files = bvs.load_manifest(str(store))["files"]
+    assert sorted(files) == [os.path.join("grade_12", "computer", f"{c}.pdf") for c in ("02_lists", "03_stack")]
+    assert sum(len(info["ids"]) for info in files.values()) == partitions["grade_12_computer"]["size"] == 8
+
+    # Last file of a partition removed: the partition goes too
+    for chapter in ("02_lists", "03_stack"):
+        (data / "grade_12" / "computer" / f"{chapter}.pdf").unlink()
+    assert build(data, store, embeddings) == {}
+    assert not (store / "grade_12_computer").exists()
+
+
+def test_new_chunks_repeating_indexed_ones_are_not_embedded(corpus):
+    data, store, write = corpus
+    lines = [" ".join(f"w{n}_{i}" for i in range(40)) for n in range(6)]
+    write("01_intro", lines)
+    embeddings = CountingEmbeddings(size=16)
+    build(data, store, embeddings)
+
+    # A later chapter reprints the first one with a new line of its own
+    embeddings.embedded = 0
+    write("02_review", lines + ["a new line of review text"])
+    partitions = build(data, store, embeddings)
+    assert embeddings.embedded == 1
+    assert partitions["grade_12_computer"]["size"] == 7
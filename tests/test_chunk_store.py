@@ -0,0 +1,68 @@
+import faiss
+import numpy as np
+import pytest
+
+import build_vector_store as bvs
+from chunk_store import ChunkStore, load_partition_store
+from conftest import HashEmbeddings
+from index_types import build_index, index_vectors, read_index_config
+from scripts.serving import faiss_read_flags
+
+PARTITION = "grade_12_computer"
+
+
+def vectors(n, dim=16, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+
+def test_ivf_pq_falls_back_to_flat_below_its_training_size():
+    # nbits=4 needs 2**4 * 4 = 64 training vectors
+    index, config = build_index(vectors(63), "ivf_pq", {"m": 4, "nbits": 4})
+    assert isinstance(index, faiss.IndexFlatL2)
+    assert config["type"] == "flat" and config["requested"] == "ivf_pq"
+    assert index_vectors(index, config).shape == (63, 16)
+
+    index, config = build_index(vectors(64), "ivf_pq", {"m": 4, "nbits": 4})
+    assert isinstance(index, faiss.IndexIVFPQ)
+    assert config["params"]["nlist"] == 1  # 64 vectors train a single list
+    assert "requested" not in config
+    assert index_vectors(index, config) is None  # PQ codes are lossy
+
+
+def test_ivf_pq_rejects_an_m_that_does_not_divide_the_dimension():
+    with pytest.raises(ValueError, match="does not divide"):
+        build_index(vectors(100), "ivf_pq", {"m": 5, "nbits": 4})
+
+
+def test_memory_mapped_partition_matches_a_loaded_one(store):
+    path = str(store / PARTITION)
+    embeddings = HashEmbeddings()
+    loaded = load_partition_store(path, embeddings)
+    mapped = load_partition_store(path, embeddings, faiss_read_flags())
+    assert isinstance(mapped.docstore, ChunkStore)
+    assert mapped.index.ntotal == loaded.index.ntotal == 32
+
+    query = "Removing the element at the top of the stack"
+    assert [doc.page_content for doc in mapped.similarity_search(query, k=3)] == \
+           [doc.page_content for doc in loaded.similarity_search(query, k=3)]
+    docs = mapped.docstore.by_position([9, 0])
+    assert [doc.metadata["chapter"] for doc in docs] == ["04_queue", "03_stack"]
+
+
+@pytest.mark.parametrize("index_params, expected", [
+    ({"m": 8, "nbits": 2}, "ivf_pq"),  # 32 chunks train 2-bit codebooks
+    ({"m": 8, "nbits": 8}, "flat"),    # but not 8-bit ones
+])
+def test_ivf_pq_partition_is_served_memory_mapped(store, pipeline, index_params, expected):
+    data = store.parent / "data"
+    bvs.update_vector_store(HashEmbeddings(), str(data), str(store), workers=1,
+                            index_type="ivf_pq", index_params=index_params)
+    config = read_index_config(str(store / PARTITION))
+    assert config["type"] == expected
+    assert config.get("requested", "ivf_pq") == "ivf_pq"
+
+    partition = pipeline.load_vectorstores(str(store))[("12", "computer")]
+    assert partition.vectorstore.index.ntotal == 32
+    docs = pipeline.search_partition(partition.vectorstore, HashEmbeddings().embed_query("queue enqueue rear"), 4)
+    assert len(docs) == 4
+    assert any(doc.metadata["chapter"] == "04_queue" for doc in docs)
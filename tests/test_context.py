@@ -0,0 +1,74 @@
+import numpy as np
+from langchain_core.documents import Document
+
+from scripts.context import compress_docs, context_compressor, mmr
+from scripts.conversation import count_tokens
+from scripts.metrics import LLMUsage, Trace
+
+QUERY = "What is a stack overflow?"
+
+
+def chunk(text, page):
+    return Document(page_content=text, metadata={"chapter": "03_stack", "page": page})
+
+
+def test_sentences_repeated_between_chunks_are_sent_once(offline_tokenizer):
+    docs = [
+        chunk("A stack is a linear data structure. Pushing onto a full stack is an overflow.", 1),
+        # Overlap with the previous chunk, differently spaced
+        chunk("Pushing onto a full  stack is an overflow. Popping an empty stack is an underflow.", 2),
+    ]
+    compressed, before, after = compress_docs(docs, QUERY, budget=600)
+    assert [doc.page_content for doc in compressed] == [
+        "A stack is a linear data structure. Pushing onto a full stack is an overflow.",
+        "Popping an empty stack is an underflow.",
+    ]
+    assert [doc.metadata["page"] for doc in compressed] == [1, 2]
+    assert before == sum(count_tokens(doc.page_content) for doc in docs)
+    assert after == sum(count_tokens(doc.page_content) for doc in compressed) < before
+
+
+def test_over_budget_keeps_the_sentences_matching_the_query(offline_tokenizer):
+    docs = [
+        chunk("Stacks are used by compilers. Browsers keep the visited pages on a stack.", 1),
+        chunk("Pushing onto a full stack is an overflow. The top of the stack moves on push.", 2),
+        chunk("Queues are used by printers.", 3),
+    ]
+    compressed, before, after = compress_docs(docs, QUERY, budget=16)
+    assert after <= 16 < before
+    # "overflow" and "stack" match; the queue chunk shares no term and is dropped
+    assert [doc.page_content for doc in compressed] == [
+        "Browsers keep the visited pages on a stack.",
+        "Pushing onto a full stack is an overflow.",
+    ]
+
+
+def test_rare_query_terms_outweigh_common_ones(offline_tokenizer):
+    docs = [chunk("The stack is a stack of stacks on the stack.", 1), chunk("An overflow is an error.", 2)]
+    idf = {"stack": 0.1, "overflow": 3.0}.get
+    compressed, _, _ = compress_docs(docs, QUERY, budget=5, idf=lambda term: idf(term, 1.0))
+    assert [doc.page_content for doc in compressed] == ["An overflow is an error."]
+
+
+def test_zero_budget_sends_the_chunks_unchanged(offline_tokenizer):
+    docs = [chunk("Push. Push.", 1), chunk("Push.", 2)]
+    assert compress_docs(docs, QUERY, budget=0) == (docs, 3, 3)
+
+
+def test_compression_is_reported_to_the_request_trace(offline_tokenizer):
+    docs = [chunk("Pushing onto a full stack is an overflow. Stacks are used by compilers.", 1)]
+    trace = Trace("test")
+    result = context_compressor(budget=8).invoke(
+        {"input": QUERY, "context": docs}, config={"callbacks": [LLMUsage(trace)]},
+    )
+    assert result["context"][0].page_content == "Pushing onto a full stack is an overflow."
+    assert trace.notes["context_tokens"] == count_tokens("Pushing onto a full stack is an overflow.") == 8
+    assert trace.notes["context_tokens_saved"] == 5
+
+
+def test_mmr_skips_near_copies_of_better_ranked_candidates():
+    vectors = np.array([[1.0, 0.0], [0.99, 0.01], [0.0, 1.0], [0.7, 0.7]], dtype=np.float32)
+    assert mmr(vectors, 2, lambda_mult=0.5) == [0, 2]
+    # Relevance only: the ranking is kept
+    assert mmr(vectors, 3, lambda_mult=1.0) == [0, 1, 2]
+    assert mmr(vectors[:2], 3) == [0, 1]
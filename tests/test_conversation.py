@@ -0,0 +1,107 @@
+import asyncio, sqlite3
+
+import pytest
+
+from scripts import conversation
+from scripts.conversation import ConversationStore
+
+
+class Words:
+    # Whitespace tokenizer, so the tests need no BPE download
+    def encode(self, text):
+        return text.split(" ")
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+def make_store(path, summarize=None, **kwargs):
+    async def no_summary(summary, turns_text):
+        return summary
+    return ConversationStore(summarize or no_summary, path=str(path), **kwargs)
+
+
+def test_sessions_are_shared_between_stores(tmp_path, monkeypatch):
+    monkeypatch.setattr(conversation, "get_encoding", lambda: Words())
+    first, second = make_store(tmp_path / "sessions.sqlite"), make_store(tmp_path / "sessions.sqlite")
+
+    async def turns():
+        # Two worker processes answering alternate turns of one conversation
+        await first.record("s1", "What is a stack?", "A LIFO list.")
+        await second.record("s1", "And a queue?", "A FIFO list.")
+    asyncio.run(turns())
+
+    for store in (first, second):
+        history = asyncio.run(store.history_text("s1"))
+        assert "User: What is a stack?" in history
+        assert "Tutor: A FIFO list." in history
+    assert asyncio.run(first.history_text("other")) == ""
+
+
+def test_old_turns_are_folded_into_the_summary(tmp_path, monkeypatch):
+    monkeypatch.setattr(conversation, "get_encoding", lambda: Words())
+    calls = []
+
+    async def summarize(summary, turns_text):
+        calls.append(turns_text)
+        return "talked about stacks"
+
+    store = make_store(tmp_path / "sessions.sqlite", summarize, keep_messages=2)
+
+    async def turns():
+        await store.record("s1", "q1", "a1")
+        await store.record("s1", "q2", "a2")
+        await asyncio.gather(*store.tasks)
+    asyncio.run(turns())
+
+    assert calls == ["User: q1\nTutor: a1\n"]
+    assert asyncio.run(store.history_text("s1")) == "Summary of the earlier conversation: talked about stacks\nUser: q2\nTutor: a2\n"
+    assert not store.tasks
+
+
+def test_failed_summary_keeps_recent_turns(tmp_path, monkeypatch):
+    monkeypatch.setattr(conversation, "get_encoding", lambda: Words())
+
+    async def summarize(summary, turns_text):
+        raise RuntimeError("model unavailable")
+
+    store = make_store(tmp_path / "sessions.sqlite", summarize, keep_messages=2)
+
+    async def turns():
+        await store.record("s1", "q1", "a1")
+        await store.record("s1", "q2", "a2")
+        await asyncio.gather(*store.tasks)
+    asyncio.run(turns())
+
+    assert asyncio.run(store.history_text("s1")) == "User: q2\nTutor: a2\n"
+
+
+def test_lock_wait_does_not_block_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(conversation, "get_encoding", lambda: Words())
+    monkeypatch.setattr(conversation, "SESSION_BUSY_TIMEOUT", 0.3)
+    store = make_store(tmp_path / "sessions.sqlite")
+    asyncio.run(store.history_text("s1"))
+    # Another worker process holds the write lock
+    other = sqlite3.connect(tmp_path / "sessions.sqlite")
+    other.execute("BEGIN IMMEDIATE")
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        with pytest.raises(sqlite3.OperationalError):
+            await store.record("s1", "q1", "a1")
+        ticker.cancel()
+        return ticks
+
+    try:
+        assert asyncio.run(run()) >= 10
+    finally:
+        other.rollback()
+        other.close()
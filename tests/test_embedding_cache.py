@@ -0,0 +1,47 @@
+import asyncio
+
+from langchain_core.embeddings import Embeddings
+
+from scripts.embedding_cache import CachingQueryEmbeddings
+
+
+class RecordingEmbeddings(Embeddings):
+    # Case-sensitive: "BFS" and "bfs" get different vectors
+    def __init__(self):
+        self.seen = []
+
+    def _embed(self, text):
+        self.seen.append(text)
+        return [float(sum(c.isupper() for c in text)), float(len(text))]
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def test_query_is_embedded_as_written_and_shared_by_its_spellings():
+    inner = RecordingEmbeddings()
+    cache = CachingQueryEmbeddings(inner)
+    vector = cache.embed_query("What is  BFS?")
+    assert inner.seen == ["What is  BFS?"]
+    assert vector == [4.0, 13.0]
+    # Another spelling of the same query is a hit with the first spelling's vector
+    assert cache.embed_query("what is bfs?") == vector
+    assert asyncio.run(cache.aembed_query("WHAT IS BFS?")) == vector
+    assert inner.seen == ["What is  BFS?"]
+    assert cache.stats() == {"size": 1, "hits": 2, "misses": 1}
+
+
+def test_batched_queries_embed_the_original_text_once_per_key():
+    inner = RecordingEmbeddings()
+    cache = CachingQueryEmbeddings(inner)
+
+    async def run():
+        assert await cache.aprecompute(["Define Stack", "define stack", "Queue"]) == 2
+        assert inner.seen == ["Define Stack", "Queue"]
+        vectors = await cache.aembed_queries(["DEFINE STACK", "Binary Search", "binary  search"])
+        assert inner.seen == ["Define Stack", "Queue", "Binary Search"]
+        assert vectors == [[2.0, 12.0], [2.0, 13.0], [2.0, 13.0]]
+    asyncio.run(run())
@@ -0,0 +1,96 @@
+from langchain_core.documents import Document
+
+from scripts.ingest_data import strip_boilerplate, NearDuplicateFilter, drop_near_duplicates
+
+
+def page(number, body):
+    header = "Computer Science – Class XI" if number % 2 else "Functions"
+    return Document(page_content="\n".join([header, str(140 + number), *body, f"Ch 7.indd {140 + number} 08-Apr-19", "Reprint 2025-26"]))
+
+
+WORDS = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+
+
+def body(number):
+    # Different prose on every page around lines that repeat inside the text
+    word = WORDS[number]
+    return [
+        f"The {word} example shows a function called with arguments.",
+        f"#Program 7-{number + 1}",
+        "def add(a, b):",
+        "    return a + b",
+        "Output:",
+        "8",
+        "13",
+        "functions",
+        f"Each {word} call runs the instructions again.",
+    ]
+
+
+def test_strip_boilerplate_removes_headers_and_footers_only():
+    pages = [page(number, body(number)) for number in range(8)]
+    removed = strip_boilerplate(pages)
+    assert removed > 0
+    for number, doc in enumerate(pages):
+        # Captions, program output and repeated words inside the page survive
+        assert doc.page_content.splitlines() == body(number)
+
+
+def test_strip_boilerplate_keeps_unchanged_content_page():
+    content = [
+        "Stacks follow the last in, first out principle.",
+        "Output:",
+        "8",
+        "A queue is first in, first out.",
+    ]
+    pages = [page(number, body(number)) for number in range(8)] + [Document(page_content="\n".join(content))]
+    strip_boilerplate(pages)
+    assert pages[-1].page_content.splitlines() == content
+
+
+def test_strip_boilerplate_ignores_short_documents():
+    pages = [page(number, body(number)) for number in range(2)]
+    original = [doc.page_content for doc in pages]
+    assert strip_boilerplate(pages) == 0
+    assert [doc.page_content for doc in pages] == original
+
+
+def test_near_duplicates_dropped_within_filter():
+    text = " ".join(f"word{i}" for i in range(200))
+    docs = [Document(page_content=text), Document(page_content=text + " extra"), Document(page_content="something else entirely here")]
+    kept, removed = drop_near_duplicates(docs, NearDuplicateFilter(threshold=0.9))
+    assert [doc.page_content for doc in kept] == [docs[0].page_content, docs[2].page_content]
+    assert removed == len(docs[1].page_content.encode("utf-8"))
+
+
+def test_near_duplicate_filter_compares_shingles_not_words():
+    words = [f"word{i}" for i in range(200)]
+    dedup = NearDuplicateFilter(threshold=0.9)
+    assert not dedup.is_duplicate(" ".join(words))
+    # Case and spacing do not matter
+    assert dedup.is_duplicate("  ".join(words).upper())
+    # The same words in another order share no shingle
+    assert not dedup.is_duplicate(" ".join(reversed(words)))
+    # One word in ten changed: well under the threshold
+    assert not dedup.is_duplicate(" ".join("other" if i % 10 == 0 else word for i, word in enumerate(words)))
+    assert not dedup.is_duplicate("   ")
+
+
+def test_near_duplicate_filter_disabled_with_zero_threshold():
+    dedup = NearDuplicateFilter(threshold=0)
+    docs = [Document(page_content="the same chunk of text repeated twice")] * 2
+    assert drop_near_duplicates(docs, dedup) == (docs, 0)
+
+
+def test_near_duplicates_dropped_within_each_class_only(monkeypatch):
+    from scripts import ingest_data
+    text = " ".join(f"word{i}" for i in range(50))
+    files = [("a.pdf", "11", "computer", "01"), ("b.pdf", "11", "computer", "02"), ("c.pdf", "12", "computer", "01")]
+
+    def split(pdf_files, workers):
+        for pdf_file in pdf_files:
+            yield pdf_file, [Document(page_content=text, metadata={"page": 0, "grade": pdf_file[1]})], 0.0, 0
+    monkeypatch.setattr(ingest_data, "list_pdf_files", lambda data_dir: files)
+    monkeypatch.setattr(ingest_data, "iter_split_files", split)
+    docs = list(ingest_data.iter_split_all(report=False))
+    assert [doc.metadata["grade"] for doc in docs] == ["11", "12"]
@@ -0,0 +1,46 @@
+import asyncio
+
+from scripts.metrics import Trace
+
+# BM25 scores its best chunk 6.8 and the runner-up 4.6 (ratio 1.48)
+CONCLUSIVE = "What is a collision in a hash table?"
+
+
+def test_fast_path_needs_the_margin_over_the_runner_up(pipeline, monkeypatch):
+    retriever = pipeline.get_partition_retriever("12", "computer")
+    docs = retriever.lexical_fast_path(CONCLUSIVE)
+    assert docs[0].page_content.startswith("Two keys mapped to the same slot")
+    assert len(docs) == retriever.k
+
+    monkeypatch.setattr(pipeline, "LEXICAL_FASTPATH_MARGIN", 1.5)
+    assert retriever.lexical_fast_path(CONCLUSIVE) is None
+    monkeypatch.setattr(pipeline, "LEXICAL_FASTPATH_MARGIN", 0)
+    assert retriever.lexical_fast_path(CONCLUSIVE) is None
+
+
+def test_fast_path_needs_every_query_term_and_a_clear_winner(pipeline):
+    retriever = pipeline.get_partition_retriever("12", "computer")
+    # "quantum" is not in the partition
+    assert retriever.lexical_fast_path("quantum stack") is None
+    # Four chunks tie on "stack"
+    assert retriever.lexical_fast_path("stack") is None
+    # A single matching chunk is not enough evidence for k=4
+    assert retriever.lexical_fast_path("What is FIFO?") is None
+
+
+def test_fast_path_skips_the_query_embedding(pipeline):
+    embeddings = pipeline.get_embeddings.value
+
+    async def ask(question):
+        trace = Trace("test", "12", "computer")
+        await pipeline.aget_rag_response(question, "12", "computer", trace=trace)
+        return trace
+
+    trace = asyncio.run(ask(CONCLUSIVE))
+    assert trace.notes["retrieval"] == "lexical"
+    assert "embed" not in trace.stages
+    assert embeddings.stats()["misses"] == 0
+
+    trace = asyncio.run(ask("stack"))
+    assert trace.notes["retrieval"] == "hybrid"
+    assert embeddings.stats()["misses"] == 1
@@ -0,0 +1,38 @@
+from scripts import metrics
+from scripts.metrics import Trace, REQUESTS
+
+
+def test_labels_are_limited_to_known_partitions(monkeypatch):
+    monkeypatch.setattr(metrics, "_partitions", {"source": lambda: [("12", "computer")], "known": None})
+    assert Trace("/ask", "12", "Computer").labels == {"endpoint": "/ask", "grade": "12", "subject": "computer"}
+    assert Trace("/ask", "12", "computer").labels["subject"] == "computer"
+
+    before = REQUESTS.labels(endpoint="/ask", grade="unknown", subject="unknown", outcome="ok")._value.get()
+    for subject in ("astrology", "x" * 200, "Astrology"):
+        trace = Trace("/ask", "12", subject).finish()
+        assert trace.labels["grade"] == trace.labels["subject"] == "unknown"
+        assert trace.fields()["subject"] == subject.lower()
+    assert REQUESTS.labels(endpoint="/ask", grade="unknown", subject="unknown", outcome="ok")._value.get() == before + 3
+
+
+def test_pipeline_reads_the_partitions_of_its_store(pipeline, store, monkeypatch):
+    monkeypatch.setattr(pipeline, "STORE_DIR", str(store))
+    monkeypatch.setattr(metrics, "_partitions", {**metrics._partitions, "known": None})
+    assert metrics.partition_labels("12", "COMPUTER") == ("12", "computer")
+    assert metrics.partition_labels("11", "computer") == ("unknown", "unknown")
+
+
+def test_prompt_stage_excludes_retrieval(pipeline, monkeypatch):
+    import time
+    search = pipeline.PartitionRetriever._get_relevant_documents
+
+    def slow_search(self, query, *, run_manager):
+        time.sleep(0.2)
+        return search(self, query, run_manager=run_manager)
+
+    monkeypatch.setattr(pipeline.PartitionRetriever, "_get_relevant_documents", slow_search)
+    trace = Trace("get_rag_response", "12", "computer")
+    result = pipeline.get_rag_response("What is a stack?", "12", "computer", trace=trace)
+    assert result["sources"], trace.notes
+    assert trace.stages["retrieve"] >= 0.2
+    assert trace.stages["prompt"] < 0.1
@@ -0,0 +1,71 @@
+from scripts.quiz_parser import QuizStreamParser
+
+
+def parse(text, pieces=None):
+    # Feeds the text whole, or in pieces of the given size as an LLM stream would
+    parser = QuizStreamParser()
+    if pieces is None:
+        questions = parser.feed(text)
+    else:
+        questions = [q for i in range(0, len(text), pieces) for q in parser.feed(text[i:i + pieces])]
+    return questions + parser.close(), parser
+
+
+QUIZ = """Q1. What is the acceleration due to gravity
+9.8 m/s^2 on Earth. Which is true?
+A. It is
+constant everywhere
+B. It varies with height
+C. It is zero
+D. A.C. supply changes it
+Answer: B
+Q2: Which unit measures force?
+(A) newton
+(B) joule
+(C) watt
+(D) pascal
+Correct answer - (A)
+"""
+
+
+def test_decimal_and_wrapped_lines_continue_the_question():
+    questions, parser = parse(QUIZ)
+    assert [q["question"] for q in questions] == [
+        "What is the acceleration due to gravity 9.8 m/s^2 on Earth. Which is true?",
+        "Which unit measures force?",
+    ]
+    assert questions[0]["options"]["A"] == "It is constant everywhere"
+    assert questions[0]["options"]["D"] == "A.C. supply changes it"
+    assert [q["answer"] for q in questions] == ["B", "A"]
+    assert parser.dropped == 0
+
+
+def test_same_questions_from_any_token_split():
+    whole, _ = parse(QUIZ)
+    for size in (1, 3, 7):
+        assert parse(QUIZ, size)[0] == whole
+
+
+def test_bare_number_headers():
+    text = "1. First?\nA. a\nB. b\nC. c\nD. d\nAnswer: C\n2) Second?\nA) a\nB) b\nC) c\nD) d\nAnswer: D"
+    questions, _ = parse(text)
+    assert [(q["question"], q["answer"]) for q in questions] == [("First?", "C"), ("Second?", "D")]
+
+
+def test_incomplete_and_invalid_questions_are_dropped():
+    text = (
+        "Here is your quiz.\n"
+        "Q1. Missing options?\nA. a\nB. b\nAnswer: A\n"
+        "Q2. Cut short?\nA. a\n"
+        "Q3. Fine?\nA. a\nB. b\nC. c\nD. d\nAnswer: A\n"
+        "Q4. No answer line?\nA. a\nB. b\nC. c\nD. d"
+    )
+    questions, parser = parse(text)
+    assert [q["question"] for q in questions] == ["Fine?"]
+    assert parser.emitted == 1
+    assert parser.dropped == 3
+
+
+def test_markdown_bold_is_ignored():
+    questions, _ = parse("**Q1.** Bold?\n**A.** a\nB. b\nC. c\nD. d\n**Answer: D**\n")
+    assert questions == [{"question": "Bold?", "options": {"A": "a", "B": "b", "C": "c", "D": "d"}, "answer": "D"}]
@@ -0,0 +1,102 @@
+import asyncio
+
+from scripts.quiz_pool import QuizPool
+
+QUESTION = {"question": "Q?", "options": {"A": "a", "B": "b", "C": "c", "D": "d"}, "answer": "A"}
+KEY = ("12", "computer", "03_stack")
+
+
+def make_pool(calls):
+    async def generate(grade, subject, topic):
+        calls.append((grade, subject, topic))
+        return "quiz"
+    return QuizPool(generate, lambda text: [QUESTION] * 3, size=2, low_watermark=1, workers=1)
+
+
+def test_pool_fills_after_first_request_only():
+    calls = []
+    pool = make_pool(calls)
+
+    async def run():
+        pool.start([KEY], warm=False)
+        await asyncio.sleep(0.01)
+        assert calls == []  # nothing generated at startup
+        assert pool.pop(KEY) is None
+        await asyncio.sleep(0.01)
+        assert pool.pop(KEY) == [QUESTION] * 3
+        await pool.stop()
+    asyncio.run(run())
+    assert calls == [KEY, KEY]
+
+
+def test_warm_start_fills_every_known_chapter():
+    calls = []
+    pool = make_pool(calls)
+
+    async def run():
+        pool.start([KEY], warm=True)
+        await asyncio.sleep(0.01)
+        await pool.stop()
+    asyncio.run(run())
+    assert calls == [KEY, KEY]
+
+
+def test_requested_chapter_is_refilled_before_the_warm_up():
+    calls = []
+    pool = make_pool(calls)
+    keys = [("12", "computer", f"{n:02d}_chapter") for n in range(1, 6)]
+
+    async def run():
+        pool.start(keys)  # warm by default
+        assert pool.pop(keys[-1]) is None
+        await asyncio.sleep(0.05)
+        await pool.stop()
+    asyncio.run(run())
+    # One worker: the requested chapter is generated first, then the warm-up continues
+    assert calls[:2] == [keys[-1], keys[-1]]
+    assert sorted(set(calls)) == keys
+    assert len(calls) == 2 * len(keys)
+
+
+def test_unknown_keys_are_not_pooled():
+    calls = []
+    pool = make_pool(calls)
+
+    async def run():
+        pool.start([KEY], warm=False)
+        assert pool.pop(("12", "computer", "no_such_chapter")) is None
+        await asyncio.sleep(0.01)
+        await pool.stop()
+    asyncio.run(run())
+    assert calls == []
+    assert pool.stats()["filled"] == 0
+
+
+def quiz_text(label):
+    return "\n".join(
+        f"Q{n}. {label} question {n} about stacks?\nA. push\nB. pop\nC. peek\nD. top\nAnswer: B" for n in (1, 2, 3)
+    )
+
+
+def test_refill_after_a_miss_does_not_pool_the_quiz_just_served(pipeline, monkeypatch):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from app import backend
+
+    monkeypatch.setattr(pipeline.get_llm, "value", FakeListChatModel(responses=[quiz_text(label) for label in ("First", "Second", "Third")]))
+    pool = QuizPool(backend.quiz_pool.generate, pipeline.parse_quiz_text, size=1, low_watermark=1, workers=1)
+    monkeypatch.setattr(backend, "quiz_pool", pool)
+    request = backend.QuizRequest(grade="12", subject="computer", topic="03_stack")
+
+    async def run():
+        pool.start([("12", "computer", "03_stack")], warm=False)
+        missed = await backend.quiz_endpoint(request)
+        while pool.scheduled:
+            await asyncio.sleep(0.01)
+        hit = await backend.quiz_endpoint(request)
+        await pool.stop()
+        return missed["quiz"], hit["quiz"]
+
+    missed, hit = asyncio.run(run())
+    assert len(missed) == len(hit) == 3
+    assert [q["question"] for q in missed] != [q["question"] for q in hit]
+    assert pool.served == 1
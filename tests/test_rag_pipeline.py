@@ -0,0 +1,18 @@
+from scripts import rag_pipeline
+
+
+def test_not_ready_without_partitions(monkeypatch):
+    monkeypatch.setitem(rag_pipeline.warmup_state, "ready", True)
+    monkeypatch.setattr(rag_pipeline.get_vectorstores, "value", {})
+    state = rag_pipeline.readiness()
+    assert not state["ready"]
+    assert state["partitions"] == 0
+    assert "No vector store partitions" in state["error"]
+
+
+def test_ready_with_partitions(monkeypatch):
+    monkeypatch.setitem(rag_pipeline.warmup_state, "ready", True)
+    monkeypatch.setattr(rag_pipeline.get_vectorstores, "value", {("11", "physics"): object()})
+    state = rag_pipeline.readiness()
+    assert state["ready"] and state["index_loaded"]
+    assert state["error"] is None
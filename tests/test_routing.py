@@ -0,0 +1,60 @@
+import asyncio
+
+import numpy as np
+
+from conftest import HashEmbeddings
+from scripts.metrics import Trace
+from scripts.routing import ChapterRouter
+
+
+def clustered(centers, per_cluster=10, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.concatenate([center + 0.05 * rng.standard_normal((per_cluster, len(center))) for center in centers]).astype(np.float32)
+
+
+def test_router_ranks_chapters_by_their_closest_centroid(tmp_path):
+    centers = np.eye(4, dtype=np.float32)
+    vectors = clustered(centers[:3])
+    # Listed out of id order: chapters are kept in FAISS id order
+    ranges = {"02_b": [10, 20], "01_a": [0, 10], "03_c": [20, 30]}
+    router = ChapterRouter.build(vectors, ranges, per_chapter=2)
+    assert router.chapters == ["01_a", "02_b", "03_c"]
+    assert list(router.owners) == [0, 0, 1, 1, 2, 2]
+
+    routes = router.route([centers[1], centers[2] + 0.4 * centers[0]], top=2)
+    assert [route.chapters for route in routes] == [("02_b", "01_a"), ("03_c", "01_a")]
+    assert routes[0].scores[0] > 0.9 > routes[0].scores[1]
+
+    router.save(str(tmp_path))
+    loaded = ChapterRouter.load(str(tmp_path))
+    assert loaded.route([centers[1]], top=2) == router.route([centers[1]], top=2)
+    assert ChapterRouter.load(str(tmp_path / "missing")) is None
+
+
+def test_small_chapters_keep_their_vectors_as_centroids():
+    vectors = clustered(np.eye(3, dtype=np.float32), per_cluster=3)
+    router = ChapterRouter.build(vectors, {"01_a": [0, 3], "02_b": [3, 9]}, per_chapter=4)
+    assert list(router.owners) == [0, 0, 0, 1, 1, 1, 1]
+
+
+def test_retriever_searches_only_the_routed_chapters(pipeline):
+    retriever = pipeline.get_partition_retriever("12", "computer")
+    embedding = HashEmbeddings().embed_query("enqueue and dequeue at the rear and front")
+    route = retriever.route([embedding], top=2)[0]
+    assert route.chapters[0] == "04_queue" and len(route.chapters) == 2
+    docs = retriever.search_vector(embedding, None, route)
+    assert {doc.metadata["chapter"] for doc in docs} <= set(route.chapters)
+
+    # No routing when a chapter is chosen, when disabled, or with no more chapters than `top`
+    assert pipeline.get_partition_retriever("12", "computer", chapter="03_stack").route([embedding]) == [None]
+    assert retriever.route([embedding], top=0) == [None]
+    assert retriever.route([embedding], top=4) == [None]
+
+
+def test_response_reports_the_routed_chapters(pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, "LEXICAL_FASTPATH_MARGIN", 0)
+    trace = Trace("test", "12", "computer")
+    result = asyncio.run(pipeline.aget_rag_response("How does a circular queue reuse slots?", "12", "computer", trace=trace))
+    assert result["routing"]["chapters"] == trace.notes["routing"]
+    assert result["routing"]["chapters"][0] == "04_queue"
+    assert len(result["routing"]["scores"]) == len(result["routing"]["chapters"])
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from scripts.single_flight import SingleFlight
+
+
+def test_run_error_reaches_leader_and_followers_once():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        results = await asyncio.gather(*(flight.run("key", fail) for _ in range(3)), return_exceptions=True)
+        assert [type(r) for r in results] == [ValueError] * 3
+        assert flight.stats()["in_flight"] == 0
+        # The failed key is not kept: the next call computes again
+        with pytest.raises(ValueError):
+            await flight.run("key", fail)
+    asyncio.run(run())
+    assert len(calls) == 2
+    assert flight.stats()["coalesced"] == 2
+
+
+def test_stream_error_after_items_reaches_every_subscriber():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def tokens():
+        calls.append(1)
+        for token in ("a", "b"):
+            await asyncio.sleep(0.005)
+            yield token
+        raise ValueError("stream failed")
+
+    async def consume():
+        stream, coalesced = flight.stream("key", tokens)
+        received = []
+        with pytest.raises(ValueError):
+            async for token in stream:
+                received.append(token)
+        return received, coalesced
+
+    async def run():
+        results = await asyncio.gather(*(consume() for _ in range(3)))
+        assert [received for received, _ in results] == [["a", "b"]] * 3
+        assert [coalesced for _, coalesced in results] == [False, True, True]
+        assert flight.stats()["in_flight"] == 0
+    asyncio.run(run())
+    assert len(calls) == 1
+
+
+def test_stream_continues_when_one_subscriber_leaves():
+    flight = SingleFlight("test")
+
+    async def tokens():
+        for token in range(5):
+            await asyncio.sleep(0.005)
+            yield token
+
+    async def first_only():
+        stream, _ = flight.stream("key", tokens)
+        async for token in stream:
+            await stream.aclose()
+            return [token]
+
+    async def everything():
+        stream, _ = flight.stream("key", tokens)
+        return [token async for token in stream]
+
+    async def run():
+        assert await asyncio.gather(first_only(), everything()) == [[0], [0, 1, 2, 3, 4]]
+    asyncio.run(run())
+
+
+def test_stream_is_cancelled_when_only_unread_subscriptions_remain():
+    flight = SingleFlight("test")
+    produced = []
+
+    async def tokens():
+        for token in range(100):
+            await asyncio.sleep(0.001)
+            produced.append(token)
+            yield token
+
+    async def run():
+        stream, _ = flight.stream("key", tokens)
+        flight.stream("key", tokens)  # a follower that never reads
+        async for token in stream:
+            break
+        await stream.aclose()
+        await asyncio.sleep(0.02)
+        assert flight.stats()["in_flight"] == 0
+    asyncio.run(run())
+    assert len(produced) < 100